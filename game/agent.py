@@ -1,16 +1,14 @@
-import pygame
-import os
-from colors import Colors
-cell_size = 30  # Should be passed from game or made configurable
-grid_size = 20  # Should be passed from game or made configurable
-screen = None   # Should be passed from game
+from .colors import Colors
+from .clock import WallClock
+cell_size = 30  # Default, the game passes its own to draw()
+grid_size = 20  # Default, the game passes its own to move()
 
 class Agent:
-    def __init__(self, x, y, color, dx, shoot_key, player_id):
+    def __init__(self, x, y, color, dx, shoot_key=None, player_id=0, bullets=None, clock=None):
         self.x = x
         self.y = y
         self.color = color
-        self.bullets = []
+        self.bullets = bullets  # BulletPool shared by both agents
         self.dx = dx
         #self.shoot_key = shoot_key Skal vi fjerne denne?
 
@@ -22,16 +20,20 @@ class Agent:
         self.hit_cooldown = 500
         self.hit_time = 0
         self.player_id = player_id
+        self.clock = clock if clock is not None else WallClock()  # get_ticks() in milliseconds
 
-    def check_bullet_collision(self, bullet):
+    def check_bullet_collision(self, owner):
+        '''Take a hit from the first bullet fired by owner that reached this agent'''
         if not self.alive:
             return False
             
-        now = pygame.time.get_ticks()
+        now = self.clock.get_ticks()
         if now - self.hit_time < self.hit_cooldown:
             return False
             
-        if (abs(self.x - bullet.x) < 1 and abs(self.y - bullet.y) < 1):
+        hit = self.bullets.find_hit(self.x, self.y, owner)
+        if hit >= 0:
+            self.bullets.remove(hit)
             self.health -= 1
             self.hit_time = now
             if self.health <= 0:
@@ -39,9 +41,11 @@ class Agent:
             return True
         return False
 
-    def draw(self):
+    def draw(self, screen, cell_size=cell_size):
+        import pygame
+        
         # Flash when hit
-        now = pygame.time.get_ticks()
+        now = self.clock.get_ticks()
         if now - self.hit_time < 200 and self.alive:
             flash_color = (255, 255, 255)  # White flash
         else:
@@ -57,25 +61,17 @@ class Agent:
                            (self.x * cell_size, self.y * cell_size - 10,
                             health_width, 5))
         
-    def move(self, dy):
+    def move(self, dy, grid_size=grid_size):
         new_y = self.y + dy
         if 0 <= new_y < grid_size:
             self.y = new_y
     
     def shoot(self):
-        now = pygame.time.get_ticks()
+        now = self.clock.get_ticks()
         if now - self.last_shot > self.shot_cooldown:
-            from bullet import Bullet
-            self.bullets.append(Bullet(self.x, self.y, self.dx, 0))
+            self.bullets.spawn(self.x, self.y, self.dx, 0, 1.0, self.player_id)
             self.last_shot = now
 
-    def update_bullets(self):
-        for bullet in self.bullets[:]:
-            bullet.move()
-            bullet.draw()
-            if bullet.off_screen():
-                self.bullets.remove(bullet)
-
     def update_position(self, x, y):
         self.x = x
         self.y = y
\ No newline at end of file
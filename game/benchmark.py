@@ -0,0 +1,381 @@
+"""
+Benchmarks for the AI Fight Club simulator and training setup
+
+Run from the repository root:
+    python -m game.benchmark simulator --json results.json [--compare baseline.json]
+    python -m game.benchmark observation --timesteps 20000
+    python -m game.benchmark vecenv --workers 4 8 16
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from .core import DEFAULT_DT, OBSERVATION_MODES, AIFightClubCore, BatchedAIFightClubCore, StepProfiler
+from .train_ai_fight_club import PPO_HYPERPARAMS, AIFightClubEnv, create_env, create_vec_env
+
+
+def _peak_rss_mb() -> float:
+    """Peak resident set size of the current process in MB"""
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# ==================== SIMULATOR THROUGHPUT ====================
+# Each case builder takes the number of calls it must support and returns a
+# function performing call i, plus the core it steps (None when the call does
+# not go through a core's step() phases). Actions are drawn up front so the
+# timed loop only measures the simulator.
+
+def _random_actions(n: int, seed: int) -> list:
+    return np.random.default_rng(seed).integers(0, 4, size=n).tolist()
+
+
+def _core_step_case(opponent: str):
+    def build(n: int):
+        core = AIFightClubCore(dt=DEFAULT_DT, seed=0)
+        actions = _random_actions(n, 1)
+        opponent_actions = _random_actions(n, 2) if opponent == 'random' else [None] * n
+
+        def step(i):
+            _, _, terminated, truncated, _ = core.step(actions[i], opponent_actions[i])
+            if terminated or truncated:
+                core.reset()
+        return step, core
+    return build
+
+
+def _core_observation_case(**core_kwargs):
+    def build(n: int):
+        # Play into a mid-game state so there are bullets on the grid
+        core = AIFightClubCore(dt=DEFAULT_DT, seed=0, **core_kwargs)
+        for action in _random_actions(60, 1):
+            core.step(action)
+        return (lambda i: core._get_observation()), None
+    return build
+
+
+def _env_step_case(**env_kwargs):
+    def build(n: int):
+        env = AIFightClubEnv(**env_kwargs)
+        env.reset(seed=0)
+        actions = _random_actions(n, 1)
+
+        def step(i):
+            _, _, terminated, truncated, _ = env.step(actions[i])
+            if terminated or truncated:
+                env.reset()
+        return step, env.game
+    return build
+
+
+def _batched_core_step_case(num_matches: int, opponent: str):
+    def build(n: int):
+        core = BatchedAIFightClubCore(num_matches, dt=DEFAULT_DT, seed=0)
+        rng = np.random.default_rng(1)
+        actions = rng.integers(0, 4, size=(n, num_matches))
+        opponent_actions = rng.integers(0, 4, size=(n, num_matches)) if opponent == 'random' else [None] * n
+        return (lambda i: core.step(actions[i], opponent_actions[i])), core
+    return build
+
+
+def _gridgame_step_case(opponent: str):
+    def build(n: int):
+        from .game import GridGame
+        grid_game = GridGame(render=False)
+        actions = _random_actions(n, 1)
+        opponent_actions = _random_actions(n, 2) if opponent == 'random' else [None] * n
+
+        def step(i):
+            _, _, done, _ = grid_game.step(actions[i], opponent_actions[i])
+            if done:
+                grid_game.reset()
+        return step, None
+    return build
+
+
+# name -> (case builder, game steps per call)
+SIMULATOR_CASES = {
+    'core_step_scripted': (_core_step_case('scripted'), 1),
+    'core_step_random': (_core_step_case('random'), 1),
+    'core_observation_grid': (_core_observation_case(), 1),
+    'core_observation_incremental': (_core_observation_case(incremental_obs=True), 1),
+    'core_observation_features': (_core_observation_case(observation='features'), 1),
+    'env_step_scripted': (_env_step_case(), 1),
+    'env_step_scripted_incremental': (_env_step_case(incremental_obs=True), 1),
+    'env_step_scripted_skip4': (_env_step_case(incremental_obs=True, frame_skip=4), 4),
+    'batched_core_step_scripted_64': (_batched_core_step_case(64, 'scripted'), 64),
+    'batched_core_step_random_64': (_batched_core_step_case(64, 'random'), 64),
+    'gridgame_step_scripted': (_gridgame_step_case('scripted'), 1),
+    'gridgame_step_random': (_gridgame_step_case('random'), 1),
+}
+
+
+def _percentiles_us(latencies_ns: np.ndarray) -> dict:
+    p50, p90, p99 = np.percentile(latencies_ns, [50, 90, 99]) / 1e3
+    return {'p50': p50, 'p90': p90, 'p99': p99, 'max': latencies_ns.max() / 1e3}
+
+
+def _phase_latencies(step, core, first: int, calls: int) -> np.ndarray:
+    """Per-call time of every StepProfiler phase, shape (calls, phases) in ns"""
+    samples = np.empty((calls, len(StepProfiler.PHASES)), dtype=np.int64)
+    profiler = core.profiler = StepProfiler()
+    try:
+        for i in range(calls):
+            profiler.reset()
+            step(first + i)
+            samples[i] = [profiler.phase_ns[phase] for phase in StepProfiler.PHASES]
+    finally:
+        core.profiler = None
+    return samples
+
+
+def _run_simulator_case(name: str, steps: int, warmup: int, alloc_steps: int) -> dict:
+    """Time one case and measure its latency distribution, allocations and peak RSS"""
+    build, steps_per_call = SIMULATOR_CASES[name]
+    try:
+        step, core = build(warmup + 2 * steps + alloc_steps)
+        for i in range(warmup):
+            step(i)
+
+        # Timed pass: per-call latency with the clock read around every call
+        clock = time.perf_counter_ns
+        latencies = np.empty(steps, dtype=np.int64)
+        start = clock()
+        for i in range(warmup, warmup + steps):
+            t0 = clock()
+            step(i)
+            latencies[i - warmup] = clock() - t0
+        elapsed = (clock() - start) / 1e9
+
+        # Allocation pass: tracemalloc slows everything down, so it runs separately.
+        # Transient bytes = high-water mark of traced memory during the call.
+        transient = np.empty(alloc_steps, dtype=np.int64)
+        tracemalloc.start()
+        for i in range(alloc_steps):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            step(warmup + steps + i)
+            transient[i] = tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.stop()
+
+        # Phase pass: the profiler's timers add overhead, so like tracemalloc
+        # they get a pass of their own, reading every phase's time per call
+        phases = None
+        if core is not None:
+            phases = _phase_latencies(step, core, warmup + steps + alloc_steps, steps)
+    except Exception as e:
+        return {'case': name, 'error': f"{type(e).__name__}: {e}"}
+
+    result = {
+        'case': name,
+        'calls': steps,
+        'steps_per_call': steps_per_call,
+        'calls_per_sec': steps / elapsed,
+        'steps_per_sec': steps * steps_per_call / elapsed,
+        'latency_us': _percentiles_us(latencies),
+        'alloc_bytes_per_call': float(transient.mean()),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+    if phases is not None:
+        result['phase_latency_us'] = {phase: _percentiles_us(phases[:, j])
+                                      for j, phase in enumerate(StepProfiler.PHASES)}
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_simulator(cases=None, steps: int = 20000, warmup: int = 1000,
+                        alloc_steps: int = 500, json_path: str = None) -> dict:
+    """
+    Measure simulator throughput for each case, each in a fresh process
+
+    Reports steps/sec, per-call latency percentiles, transient bytes allocated
+    per call (tracemalloc high-water mark) and peak RSS. Cases that step a
+    core also get latency percentiles per step phase (StepProfiler.PHASES),
+    so a regression can be traced to the phase it comes from. If json_path
+    is given the results are written there together with the commit and
+    platform.
+    """
+    cases = list(SIMULATOR_CASES) if cases is None else cases
+    results = []
+    ctx = mp.get_context('spawn')
+    for name in cases:
+        with ctx.Pool(1) as pool:
+            results.append(pool.apply(_run_simulator_case, (name, steps, warmup, alloc_steps)))
+
+    print(f"{'case':<32} {'steps/s':>10} {'p50 us':>8} {'p99 us':>8} {'alloc B':>9} {'RSS MB':>8}")
+    for r in results:
+        if 'error' in r:
+            print(f"{r['case']:<32} unavailable: {r['error']}")
+            continue
+        print(f"{r['case']:<32} {r['steps_per_sec']:>10.0f} {r['latency_us']['p50']:>8.1f} "
+              f"{r['latency_us']['p99']:>8.1f} {r['alloc_bytes_per_call']:>9.0f} {r['peak_rss_mb']:>8.1f}")
+
+    print(f"\n{'phase p50/p99 us':<32} " + ' '.join(f"{phase:>13}" for phase in StepProfiler.PHASES))
+    for r in results:
+        if 'phase_latency_us' not in r:
+            continue
+        print(f"{r['case']:<32} " + ' '.join(
+            f"{p['p50']:.1f}/{p['p99']:.1f}".rjust(13) for p in r['phase_latency_us'].values()))
+
+    report = {
+        'commit': _git_commit(),
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'steps': steps,
+        'results': results,
+    }
+    if json_path is not None:
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def compare_reports(baseline: dict, current: dict, tolerance: float = 0.1) -> list:
+    """Print the throughput change per case and return the cases slower by more than tolerance"""
+    baseline_results = {r['case']: r for r in baseline['results'] if 'error' not in r}
+    regressions = []
+    print(f"{'case':<32} {'baseline':>10} {'current':>10} {'change':>8}")
+    for r in current['results']:
+        base = baseline_results.get(r['case'])
+        if base is None or 'error' in r:
+            continue
+        change = r['steps_per_sec'] / base['steps_per_sec'] - 1
+        flag = '  REGRESSION' if change < -tolerance else ''
+        print(f"{r['case']:<32} {base['steps_per_sec']:>10.0f} {r['steps_per_sec']:>10.0f} "
+              f"{change:>+7.1%}{flag}")
+        if flag:
+            regressions.append(r['case'])
+    return regressions
+
+
+# ==================== OBSERVATION ENCODINGS ====================
+def _train_observation_mode(observation: str, total_timesteps: int) -> dict:
+    """Train PPO on one observation encoding and measure speed and memory"""
+    from stable_baselines3 import PPO
+    from stable_baselines3.common.vec_env import DummyVecEnv
+
+    env = DummyVecEnv([lambda: create_env(observation=observation)])
+    model = PPO("MlpPolicy", env, verbose=0, device='cpu', **PPO_HYPERPARAMS)
+
+    start = time.perf_counter()
+    model.learn(total_timesteps=total_timesteps)
+    elapsed = time.perf_counter() - start
+    env.close()
+
+    return {
+        'observation': observation,
+        'observation_size': env.observation_space.shape[0],
+        'steps_per_sec': model.num_timesteps / elapsed,
+        'policy_params': sum(p.numel() for p in model.policy.parameters()),
+        'rollout_buffer_mb': model.rollout_buffer.observations.nbytes / 2**20,
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def benchmark_observation_modes(total_timesteps: int = 20000, modes=OBSERVATION_MODES) -> list:
+    """
+    Compare PPO training throughput and memory across observation encodings
+
+    Each mode is trained in a fresh process so peak RSS is not shared between them.
+    """
+    results = []
+    ctx = mp.get_context('spawn')
+    for observation in modes:
+        with ctx.Pool(1) as pool:
+            results.append(pool.apply(_train_observation_mode, (observation, total_timesteps)))
+
+    print(f"{'observation':<12} {'obs dim':>8} {'steps/s':>10} {'params':>10} "
+          f"{'buffer MB':>10} {'peak RSS MB':>12}")
+    for r in results:
+        print(f"{r['observation']:<12} {r['observation_size']:>8} {r['steps_per_sec']:>10.0f} "
+              f"{r['policy_params']:>10} {r['rollout_buffer_mb']:>10.2f} {r['peak_rss_mb']:>12.1f}")
+    return results
+
+
+# ==================== VECTORIZED ENVIRONMENTS ====================
+def _vec_env_steps_per_sec(backend: str, n_envs: int, steps: int, observation: str) -> float:
+    """Step a vec env with random actions and return env steps per second"""
+    env = create_vec_env(n_envs, backend=backend, observation=observation, seed=0)
+    rng = np.random.default_rng(0)
+    actions = rng.integers(0, 4, size=(steps, n_envs))
+    try:
+        env.reset()
+        start = time.perf_counter()
+        for step_actions in actions:
+            env.step(step_actions)
+        return n_envs * steps / (time.perf_counter() - start)
+    finally:
+        env.close()
+
+
+def benchmark_vec_envs(worker_counts=(4, 8, 16), steps: int = 2000, observation: str = 'grid',
+                       backends=('subproc', 'shm')) -> list:
+    """Compare rollout throughput of pickled-pipe and shared-memory worker backends"""
+    results = []
+    for n_envs in worker_counts:
+        for backend in backends:
+            results.append({
+                'backend': backend,
+                'n_envs': n_envs,
+                'observation': observation,
+                'steps_per_sec': _vec_env_steps_per_sec(backend, n_envs, steps, observation),
+            })
+
+    print(f"{'backend':<10} {'n_envs':>7} {'steps/s':>10}")
+    for r in results:
+        print(f"{r['backend']:<10} {r['n_envs']:>7} {r['steps_per_sec']:>10.0f}")
+    return results
+
+
+# ==================== MAIN EXECUTION ====================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    sim_parser = subparsers.add_parser('simulator', help='core, env and GridGame step throughput')
+    sim_parser.add_argument('--cases', nargs='+', choices=list(SIMULATOR_CASES))
+    sim_parser.add_argument('--steps', type=int, default=20000)
+    sim_parser.add_argument('--json', dest='json_path', help='write machine-readable results here')
+    sim_parser.add_argument('--compare', help='baseline JSON to check for regressions')
+    sim_parser.add_argument('--tolerance', type=float, default=0.1)
+
+    obs_parser = subparsers.add_parser('observation', help='grid vs feature observation training cost')
+    obs_parser.add_argument('--timesteps', type=int, default=20000)
+
+    vec_parser = subparsers.add_parser('vecenv', help='subprocess vs shared-memory rollout throughput')
+    vec_parser.add_argument('--workers', type=int, nargs='+', default=[4, 8, 16])
+    vec_parser.add_argument('--steps', type=int, default=2000)
+    vec_parser.add_argument('--observation', choices=OBSERVATION_MODES, default='grid')
+    vec_parser.add_argument('--backends', nargs='+', default=['subproc', 'shm'])
+
+    args = parser.parse_args()
+    if args.benchmark == 'simulator':
+        report = benchmark_simulator(cases=args.cases, steps=args.steps, json_path=args.json_path)
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+            if compare_reports(baseline, report, tolerance=args.tolerance):
+                sys.exit(1)
+    elif args.benchmark == 'observation':
+        benchmark_observation_modes(total_timesteps=args.timesteps)
+    elif args.benchmark == 'vecenv':
+        benchmark_vec_envs(worker_counts=args.workers, steps=args.steps,
+                           observation=args.observation, backends=args.backends)
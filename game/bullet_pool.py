@@ -0,0 +1,324 @@
+import math
+
+import numpy as np
+
+# Pools with at most this many live bullets are searched in plain Python
+SMALL_POOL = 8
+
+
+def sweep_span(start: float, delta: float, low: float, high: float, closed_low: bool = False) -> tuple:
+    """
+    Part of a move from start to start + delta that lies between low and high
+
+    Returns (enter, leave) as fractions of the move, clipped to [0, 1]; the
+    span is empty when enter >= leave. Bounds are open, except low when
+    closed_low is set (for the grid, where 0 is still inside).
+    """
+    if delta == 0:
+        inside = (low <= start if closed_low else low < start) and start < high
+        return (0.0, 1.0) if inside else (1.0, 0.0)
+    a = (low - start) / delta
+    b = (high - start) / delta
+    if a > b:
+        a, b = b, a
+    return max(a, 0.0), min(b, 1.0)
+
+
+def sweep_spans(start: np.ndarray, delta: np.ndarray, low, high, closed_low: bool = False) -> tuple:
+    """Array version of sweep_span(), with the same floating point results"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = (low - start) / delta
+        b = (high - start) / delta
+    inside = ((low <= start) if closed_low else (low < start)) & (start < high)
+    still = delta == 0
+    enter = np.where(still, np.where(inside, 0.0, 1.0), np.maximum(np.minimum(a, b), 0.0))
+    leave = np.where(still, np.where(inside, 1.0, 0.0), np.minimum(np.maximum(a, b), 1.0))
+    return enter, leave
+
+
+class OccupancyIndex:
+    """
+    Per-row buckets of bullet slots, one set of rows for every owner
+
+    A bullet within one cell of a target on both axes lies in the target's row
+    or one of its two neighbours, so a hit check only looks at the bullets in
+    those three buckets instead of every bullet. Bullets above or below the
+    grid are kept in the first or last row, since their path may still have
+    crossed the grid. The index is kept up to date by the BulletPool that
+    owns it; after a move only the bullets that crossed into another row are
+    re-bucketed, and when every bullet flies horizontally there is nothing to
+    update at all.
+    """
+
+    def __init__(self, grid_size: int, capacity: int, num_owners: int = 2):
+        self.grid_size = grid_size
+        self.key = [-1] * capacity  # bucket of every slot, -1 = not indexed
+        self.buckets = [set() for _ in range(num_owners * grid_size)]
+
+    def row_key(self, y: float, owner: int) -> int:
+        """Bucket of a bullet"""
+        g = self.grid_size
+        return owner * g + min(max(math.floor(y), 0), g - 1)
+
+    def clear(self):
+        self.key = [-1] * len(self.key)
+        for bucket in self.buckets:
+            bucket.clear()
+
+    def insert(self, slot: int, key: int):
+        self.key[slot] = key
+        if key >= 0:
+            self.buckets[key].add(slot)
+
+    def discard(self, slot: int):
+        key = self.key[slot]
+        if key >= 0:
+            self.buckets[key].discard(slot)
+            self.key[slot] = -1
+
+    def move(self, source: int, target: int):
+        """Re-bucket the bullet that moved from slot source to the empty slot target"""
+        key = self.key[source]
+        self.discard(source)
+        self.insert(target, key)
+
+    def rekey(self, pool: 'BulletPool'):
+        """Re-bucket the bullets whose row changed since the last update"""
+        n = pool.count
+        if n <= SMALL_POOL:
+            keys = [self.row_key(y, owner) for _, y, owner in pool.items()]
+        else:
+            g = self.grid_size
+            rows = np.clip(np.floor(pool.y[:n]), 0, g - 1).astype(np.int64)
+            keys = (pool.owner[:n] * g + rows).tolist()
+        current = self.key
+        for slot, key in enumerate(keys):
+            if key != current[slot]:
+                self.discard(slot)
+                self.insert(slot, key)
+
+    def query(self, y: float, owner: int) -> list:
+        """Buckets of owner's bullets in the rows around y"""
+        g = self.grid_size
+        row = math.floor(y)
+        base = owner * g
+        return self.buckets[base + max(row - 1, 0):base + min(row + 2, g)]
+
+
+class BulletPool:
+    """
+    Fixed-capacity, array-backed pool of bullets
+
+    Every bullet is one slot in a set of parallel arrays (x, y, dx, dy, speed,
+    owner). Live bullets are always packed into slots [0, count); removing a
+    bullet moves the last live bullet into its slot (swap-remove), so the order
+    of bullets is not preserved. Moving, culling and compaction work on whole
+    arrays instead of per-bullet Python objects.
+
+    x/y and dx/dy are column views of the (capacity, 2) position and direction
+    arrays, so a move or a bounds check is one numpy call for both axes. The
+    position before the last advance() is kept in previous, so sweep() can
+    test the whole path a bullet took.
+
+    With a grid_size the pool also keeps an OccupancyIndex, and hit checks
+    only look at the bullets in the rows around the target. Code that writes
+    the position arrays directly must call moved() afterwards.
+    """
+
+    def __init__(self, capacity: int = 64, grid_size: int = None):
+        self.capacity = capacity
+        self.position = np.zeros((capacity, 2), dtype=np.float64)
+        self.previous = np.zeros((capacity, 2), dtype=np.float64)  # position before the last move
+        self.direction = np.zeros((capacity, 2), dtype=np.float64)
+        self.velocity = np.zeros((capacity, 2), dtype=np.float64)  # direction * speed
+        self.speed = np.zeros(capacity, dtype=np.float64)
+        self.owner = np.zeros(capacity, dtype=np.int64)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.x, self.y = self.position[:, 0], self.position[:, 1]
+        self.dx, self.dy = self.direction[:, 0], self.direction[:, 1]
+        self.count = 0
+        self._items = []  # items() cache, None when stale
+        self._fields = (self.position, self.previous, self.direction, self.velocity, self.speed, self.owner)
+        self.index = OccupancyIndex(grid_size, capacity) if grid_size is not None else None
+        self.vertical = 0  # live bullets with dy != 0, which can change row
+
+    def __len__(self) -> int:
+        return self.count
+
+    def items(self) -> list:
+        """
+        (x, y, owner) of every live bullet as Python values, in slot order
+
+        The list is cached until the pool changes, so a step that culls,
+        checks hits and builds an observation converts the arrays only once.
+        """
+        if self._items is None:
+            n = self.count
+            self._items = [(x, y, owner) for (x, y), owner in
+                           zip(self.position[:n].tolist(), self.owner[:n].tolist())]
+        return self._items
+
+    def clear(self):
+        """Remove all bullets"""
+        self.alive[:self.count] = False
+        self.count = 0
+        self._items = []
+        self.vertical = 0
+        if self.index is not None:
+            self.index.clear()
+
+    def spawn(self, x: float, y: float, dx: float, dy: float, speed: float, owner: int):
+        """
+        Add a bullet
+
+        Raises RuntimeError when the pool is full rather than dropping the
+        bullet, since a dropped shot would silently change the game; size the
+        pool for the most bullets that can be in flight at once.
+        """
+        i = self.count
+        if i == self.capacity:
+            raise RuntimeError(f"BulletPool is full ({self.capacity} bullets)")
+        self.position[i] = self.previous[i] = (x, y)
+        self.direction[i] = (dx, dy)
+        self.velocity[i] = (dx * speed, dy * speed)
+        self.speed[i] = speed
+        self.owner[i] = owner
+        self.alive[i] = True
+        self.count = i + 1
+        self._items = None
+        self.vertical += dy != 0
+        if self.index is not None:
+            self.index.insert(i, self.index.row_key(y, owner))
+
+    def advance(self, dt: float = 1.0):
+        """Move every live bullet by speed * dt along its direction"""
+        n = self.count
+        if n:
+            self.previous[:n] = self.position[:n]
+            self.position[:n] += self.velocity[:n] * dt
+            self.moved()
+
+    def moved(self):
+        """Bring caches and the occupancy index up to date after positions changed"""
+        self._items = None
+        if self.index is not None and self.vertical:
+            self.index.rekey(self)
+
+    def cull(self, grid_size: int) -> int:
+        """Remove bullets outside the grid and return how many were removed"""
+        n = self.count
+        if n == 0:
+            return 0
+        position = self.position[:n]
+        if n <= SMALL_POOL:
+            if all(0 <= x < grid_size and 0 <= y < grid_size for x, y, _ in self.items()):
+                return 0
+        elif position.min() >= 0 and position.max() < grid_size:
+            return 0
+        self.alive[:n] = ((position >= 0) & (position < grid_size)).all(axis=1)
+        return self.compact()
+
+    def remove(self, index: int):
+        """Remove one bullet by moving the last live bullet into its slot"""
+        last = self.count - 1
+        self.vertical -= bool(self.dy[index] != 0)
+        if self.index is not None:
+            self.index.discard(index)
+            if index != last:
+                self.index.move(last, index)
+        if index != last:
+            for field in self._fields:
+                field[index] = field[last]
+        self.alive[last] = False
+        self.count = last
+        self._items = None
+
+    def compact(self) -> int:
+        """Swap-remove all dead bullets and return how many were removed"""
+        n = self.count
+        alive = self.alive[:n]
+        keep = int(np.count_nonzero(alive))
+        if keep == n:
+            return 0
+        # Dead slots below the new count are filled with live bullets from above it
+        holes = np.flatnonzero(~alive[:keep])
+        movers = np.flatnonzero(alive[keep:]) + keep
+        if self.index is not None:
+            for slot in np.flatnonzero(~alive).tolist():
+                self.index.discard(slot)
+            for hole, mover in zip(holes.tolist(), movers.tolist()):
+                self.index.move(mover, hole)
+        for field in self._fields:
+            field[holes] = field[movers]
+        self.vertical = int(np.count_nonzero(self.dy[:keep]))
+        self.alive[:keep] = True
+        self.alive[keep:n] = False
+        self.count = keep
+        self._items = None
+        return n - keep
+
+    def owned_by(self, owner: int) -> np.ndarray:
+        """Slot indices of the live bullets fired by the given owner"""
+        return np.flatnonzero(self.owner[:self.count] == owner)
+
+    def find_hit(self, x: float, y: float, owner: int) -> int:
+        """Slot of the first bullet from owner within one cell of (x, y), or -1"""
+        n = self.count
+        if n == 0:
+            return -1
+        if self.index is not None:
+            hit = -1
+            for bucket in self.index.query(y, owner):
+                for slot in bucket:
+                    if (hit < 0 or slot < hit) and abs(self.x[slot] - x) < 1 and abs(self.y[slot] - y) < 1:
+                        hit = slot
+            return hit
+        near = (np.abs(self.position[:n] - (x, y)) < 1).all(axis=1)
+        near &= self.owner[:n] == owner
+        i = int(near.argmax())
+        return i if near[i] else -1
+
+    def sweep(self, x: float, y: float, owner: int, grid_size: int) -> list:
+        """
+        When owner's bullets passed within one cell of (x, y) during the last move
+
+        Every bullet is tested along its whole path from previous to position,
+        so a bullet that moved several cells cannot skip over the target. Only
+        the part of the path inside the grid counts, since a bullet that leaves
+        the grid is gone.
+
+        :return: (enter, leave, slot) for every bullet whose path came within
+            one cell of (x, y) on both axes, with enter < leave given as
+            fractions of the move (0 = previous, 1 = position)
+        """
+        n = self.count
+        if n == 0:
+            return []
+        if self.index is not None:
+            # End rows within one cell of y, widened by the largest vertical move
+            reach = 0
+            if self.vertical:
+                reach = math.ceil(np.abs(self.position[:n, 1] - self.previous[:n, 1]).max())
+            g = self.index.grid_size
+            base = owner * g
+            row = math.floor(y)
+            slots = [slot for bucket in self.index.buckets[base + max(row - 1 - reach, 0):
+                                                           base + min(row + 2 + reach, g)]
+                     for slot in bucket]
+        else:
+            slots = self.owned_by(owner).tolist()
+
+        spans = []
+        for slot in slots:
+            x0, y0 = self.previous[slot].tolist()
+            x1, y1 = self.position[slot].tolist()
+            dx, dy = x1 - x0, y1 - y0
+            enter_x, leave_x = sweep_span(x0, dx, x - 1, x + 1)
+            enter_y, leave_y = sweep_span(y0, dy, y - 1, y + 1)
+            enter_gx, leave_gx = sweep_span(x0, dx, 0, grid_size, closed_low=True)
+            enter_gy, leave_gy = sweep_span(y0, dy, 0, grid_size, closed_low=True)
+            enter = max(enter_x, enter_y, enter_gx, enter_gy)
+            leave = min(leave_x, leave_y, leave_gx, leave_gy)
+            if enter < leave:
+                spans.append((enter, leave, slot))
+        return spans
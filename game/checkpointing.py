@@ -0,0 +1,183 @@
+"""
+Checkpoints written in the background while training goes on
+
+model.save() pickles and compresses the whole model on the training thread,
+which stalls rollout collection every time a checkpoint is taken. An
+AsyncCheckpointer only takes an in-memory snapshot of the model on the
+training thread (the parameters, the optimizer state and the model's
+attributes) and hands it to a writer thread. Each checkpoint becomes a new
+version, e.g. best_model_v0007.zip, written under a temporary name and
+renamed into place once complete, so a reader never sees a partial file;
+best_model.zip is then atomically replaced by the newest version and only the
+newest versions are kept.
+
+If checkpoints are taken faster than they can be written, a snapshot that is
+still waiting is replaced by the newer one instead of queueing up.
+"""
+
+import copy
+import glob
+import os
+import re
+import shutil
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from stable_baselines3.common.save_util import save_to_zip_file
+
+
+def snapshot_model(model) -> dict:
+    """
+    Copy of everything model.save() writes, taken so that training can go on
+    while it is written (the arguments of save_to_zip_file)
+    """
+    data = model.__dict__.copy()
+    exclude = set(model._excluded_save_params())
+    state_dicts_names, torch_variable_names = model._get_torch_save_params()
+    for name in state_dicts_names + torch_variable_names:
+        exclude.add(name.split(".")[0])
+    for name in exclude:
+        data.pop(name, None)
+    # Training keeps updating arrays and buffers in place
+    for name, value in data.items():
+        if isinstance(value, (np.ndarray, list, dict, deque)):
+            data[name] = copy.copy(value)
+
+    pytorch_variables = None
+    if torch_variable_names is not None:
+        pytorch_variables = {name: copy.deepcopy(_getattr(model, name)) for name in torch_variable_names}
+    # deepcopy clones the tensors of the state dicts, including the optimizer state
+    params = copy.deepcopy(model.get_parameters())
+    return {'data': data, 'params': params, 'pytorch_variables': pytorch_variables}
+
+
+def _getattr(obj, name: str):
+    for attr in name.split("."):
+        obj = getattr(obj, attr)
+    return obj
+
+
+class AsyncCheckpointer:
+    """
+    Writes versioned model checkpoints from a background thread
+
+    :param path: Path of the newest checkpoint, e.g. "best_model.zip"; the
+        versions are written next to it as best_model_v0001.zip, ...
+    :param keep: Number of versions kept on disk (None keeps all of them)
+    :param verbose: Whether to print every checkpoint written
+    """
+
+    def __init__(self, path: str = "best_model.zip", keep: int = 5, verbose: int = 0):
+        root, ext = os.path.splitext(path)
+        self.path = root + (ext or ".zip")
+        self.keep = keep
+        self.verbose = verbose
+        self._version_pattern = root + "_v{:04d}.zip"
+        self._version_regex = re.compile(re.escape(os.path.basename(root)) + r"_v(\d+)\.zip$")
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Carry on numbering after the versions of earlier runs
+        self.version = max((version for version, _ in self._versions()), default=0)
+
+        self.snapshot_time = 0.0  # Seconds spent on the training thread, summed
+        self.write_time = 0.0  # Seconds spent writing on the background thread, summed
+        self.written = 0
+        self.dropped = 0  # Snapshots replaced by a newer one before being written
+        self._pending = None  # (version, snapshot) waiting to be written
+        self._writing = False
+        self._error = None
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def save(self, model) -> str:
+        """Snapshot the model and return the path its version will be written to"""
+        self._raise_error()
+        start = time.perf_counter()
+        snapshot = snapshot_model(model)
+        self.snapshot_time += time.perf_counter() - start
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The checkpointer is closed")
+            self.version += 1
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (self.version, snapshot)
+            self._condition.notify_all()
+        return self._version_pattern.format(self.version)
+
+    def wait(self):
+        """Block until every snapshot taken so far is written"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._pending is None and not self._writing)
+        self._raise_error()
+
+    def close(self):
+        """Write the remaining snapshot and stop the writer thread"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Writing a checkpoint failed") from error
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None or self._closed)
+                if self._pending is None:
+                    return
+                (version, snapshot), self._pending = self._pending, None
+                self._writing = True
+            try:
+                start = time.perf_counter()
+                self._write(version, snapshot)
+                self.write_time += time.perf_counter() - start
+                self.written += 1
+            except Exception as error:
+                self._error = error
+            finally:
+                with self._condition:
+                    self._writing = False
+                    self._condition.notify_all()
+
+    def _write(self, version: int, snapshot: dict):
+        """Write a version, point self.path at it and delete the oldest versions"""
+        path = self._version_pattern.format(version)
+        temporary = path + ".tmp"
+        save_to_zip_file(temporary, **snapshot)
+        os.replace(temporary, path)
+
+        # Link (or copy) the version to a temporary name and rename it over self.path
+        temporary = self.path + ".tmp"
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        try:
+            os.link(path, temporary)
+        except OSError:
+            shutil.copyfile(path, temporary)
+        os.replace(temporary, self.path)
+        if self.verbose:
+            print(f"Saved checkpoint {path}")
+
+        if self.keep is not None:
+            versions = sorted(self._versions())
+            for _, old in versions[:max(len(versions) - self.keep, 0)]:
+                os.remove(old)
+
+    def _versions(self) -> list:
+        """(version, path) of the versions on disk"""
+        versions = []
+        for path in glob.glob(self._version_pattern.replace("{:04d}", "*")):
+            match = self._version_regex.search(path)
+            if match:
+                versions.append((int(match.group(1)), path))
+        return versions
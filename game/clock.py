@@ -0,0 +1,46 @@
+"""
+Clocks for GridGame and its agents
+
+Shot and hit cooldowns are measured in milliseconds read from a clock's
+get_ticks(), like pygame.time.get_ticks(). A TickClock only moves when the
+game loop ticks it, so a game runs headless, deterministically and as fast
+as it can be stepped; a WallClock follows real time.
+"""
+
+import time
+
+
+class TickClock:
+    """Game-time clock that advances a fixed number of milliseconds per tick"""
+
+    def __init__(self, ms_per_tick: float = 1000 / 30):
+        self.ms_per_tick = ms_per_tick
+        self.ticks = 0
+
+    def tick(self):
+        """Advance the clock by one tick"""
+        self.ticks += 1
+
+    def get_ticks(self) -> float:
+        """Milliseconds of game time since the last reset"""
+        return self.ticks * self.ms_per_tick
+
+    def reset(self):
+        self.ticks = 0
+
+
+class WallClock:
+    """Real-time clock; tick() does nothing"""
+
+    def __init__(self):
+        self.start = time.monotonic()
+
+    def tick(self):
+        pass
+
+    def get_ticks(self) -> float:
+        """Milliseconds of real time since the last reset"""
+        return (time.monotonic() - self.start) * 1000
+
+    def reset(self):
+        self.start = time.monotonic()
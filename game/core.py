@@ -0,0 +1,1236 @@
+"""
+Game rules of AI Fight Club without rendering or training code
+
+AIFightClubCore runs one match and BatchedAIFightClubCore many at once with
+the same rules. Both only need numpy, so a game server, the replay tools or
+a rollout worker can import them without loading the training stack; the
+gym environments and the training code live in train_ai_fight_club.py.
+"""
+
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from .bullet_pool import BulletPool, sweep_spans
+
+# Fixed simulation timestep used for training (seconds per step)
+DEFAULT_DT = 1 / 30
+
+# Observation encodings supported by AIFightClubCore
+OBSERVATION_MODES = ('grid', 'features')
+
+# What the cores' step() puts in info: 'full' = the match statistics on every
+# step, 'terminal' = only on the step a match ends (see AIFightClubCore.step)
+INFO_MODES = ('full', 'terminal')
+
+# ==================== INSTRUMENTATION ====================
+class StepProfiler:
+    """
+    Per-phase timers and counters for the game cores' step()
+    
+    A core only touches its profiler when one is attached (core.profiler is
+    not None), so instrumentation costs a None check per phase when disabled.
+    """
+    
+    PHASES = ('actions', 'opponent', 'bullets', 'collisions', 'reward', 'info', 'observation')
+    
+    def __init__(self):
+        self.reset()
+    
+    def reset(self):
+        """Clear all accumulated timings and counters"""
+        self.phase_ns = dict.fromkeys(self.PHASES, 0)
+        self.steps = 0
+        self.resets = 0
+        self.bullets = 0
+        self._last = 0
+    
+    def start(self):
+        """Mark the start of a step"""
+        self._last = time.perf_counter_ns()
+    
+    def lap(self, phase: str):
+        """Charge the time since the previous mark to the given phase"""
+        now = time.perf_counter_ns()
+        self.phase_ns[phase] += now - self._last
+        self._last = now
+    
+    def end_step(self, bullets: int):
+        """Count a finished step and the bullets in flight during it"""
+        self.steps += 1
+        self.bullets += bullets
+    
+    def summary(self) -> dict:
+        """Mean microseconds per step for each phase, plus per-step counters"""
+        steps = max(self.steps, 1)
+        stats = {f'{phase}_us': ns / steps / 1e3 for phase, ns in self.phase_ns.items()}
+        stats['step_us'] = sum(self.phase_ns.values()) / steps / 1e3
+        stats['bullets_per_step'] = self.bullets / steps
+        stats['resets'] = self.resets
+        stats['steps'] = self.steps
+        return stats
+    
+    @staticmethod
+    def merge(summaries: list) -> dict:
+        """Combine summaries from several envs, weighting the means by step count"""
+        summaries = [s for s in summaries if s and s['steps'] > 0]
+        if not summaries:
+            return {}
+        steps = sum(s['steps'] for s in summaries)
+        merged = {key: sum(s[key] * s['steps'] for s in summaries) / steps
+                  for key in summaries[0] if key not in ('steps', 'resets')}
+        merged['resets'] = sum(s['resets'] for s in summaries)
+        merged['steps'] = steps
+        return merged
+
+# ==================== GAME CORE ====================
+class AIFightClubCore:
+    """Core game logic for AI Fight Club without rendering"""
+    
+    def __init__(self, grid_size: int = 20, dt: float = None, seed: int = None,
+                 incremental_obs: bool = False, observation: str = 'grid',
+                 num_nearest_bullets: int = 8, frame_skip: int = 1, info_mode: str = 'full'):
+        """
+        Args:
+            grid_size: Width and height of the square grid
+            dt: Fixed timestep in seconds. Each tick advances a tick clock by dt,
+                so a seed and action sequence always give the same trajectory.
+                If None, the wall-clock time between ticks is used instead.
+            seed: Seed for the scripted opponent's random number generator
+            incremental_obs: Keep one preallocated observation buffer and only
+                clear/set the cells that changed since the last step. The
+                returned observation is then that buffer and is overwritten by
+                the next step, so callers must copy it if they keep it.
+                Only applies to the grid observation.
+            observation: 'grid' for the one-hot 20x20x4 grid plus health, or
+                'features' for a compact vector of positions, health, cooldown
+                timers and the nearest bullets (see _get_feature_observation)
+            num_nearest_bullets: Number of bullets in the feature observation
+            frame_skip: Number of ticks each step() repeats the actions for
+            info_mode: One of INFO_MODES. With 'terminal', step() returns an
+                empty info dict until the step the match ends on; the
+                statistics are always available from match_stats().
+        """
+        if observation not in OBSERVATION_MODES:
+            raise ValueError(f"Unknown observation mode: {observation}")
+        if frame_skip < 1:
+            raise ValueError(f"frame_skip must be at least 1, got {frame_skip}")
+        if info_mode not in INFO_MODES:
+            raise ValueError(f"Unknown info mode: {info_mode}")
+        
+        self.grid_size = grid_size
+        self.cell_size = 1
+        self.dt = dt
+        self.frame_skip = frame_skip
+        self.info_mode = info_mode
+        self.np_random = np.random.default_rng(seed)
+        self.profiler = None  # StepProfiler, see profile()
+        
+        # Bullets of both agents, tagged with the shooter's player_id and
+        # indexed by row for the hit checks. A bullet crosses the grid in
+        # grid_size / speed seconds and each agent fires at most once per
+        # shot_cooldown, which bounds the bullets in flight.
+        self.bullet_speed = 5.0  # cells per second
+        self.shot_cooldown = 0.5
+        per_agent = int(np.ceil(grid_size / (self.bullet_speed * self.shot_cooldown))) + 2
+        self.bullets = BulletPool(capacity=2 * per_agent, grid_size=grid_size)
+        
+        self.observation = observation
+        self.num_nearest_bullets = num_nearest_bullets
+        self.incremental_obs = incremental_obs and observation == 'grid'
+        if observation == 'features':
+            # 10 agent/opponent features + (dx, dy, owner, present) per bullet
+            self.observation_size = 10 + 4 * num_nearest_bullets
+        else:
+            self.observation_size = grid_size * grid_size * 4 + 2
+        if self.incremental_obs:
+            self._obs = np.zeros(self.observation_size, dtype=np.float32)
+            self._obs_cells = []  # Flat indices of the cells set to 1 last step
+        
+        self.reset()
+    
+    def reset(self, seed: int = None, out: np.ndarray = None) -> np.ndarray:
+        """Reset the game to initial state and return initial observation"""
+        if seed is not None:
+            self.np_random = np.random.default_rng(seed)
+        if self.profiler is not None:
+            self.profiler.resets += 1
+        
+        # Create agents with 3 lives each
+        self.agent = self._create_agent(3, 10, 1, 0)
+        self.opponent = self._create_agent(16, 10, -1, 1)
+        self.bullets.clear()
+        
+        # Game state
+        self.done = False
+        self.winner = None
+        self.step_count = 0
+        self.tick = 0
+        self.last_update_time = time.time()
+        self.current_time = 0.0 if self.dt is not None else self.last_update_time
+        
+        # Game statistics
+        self.agent_lives_lost = 0
+        self.opponent_lives_lost = 0
+        self.agent_shots_fired = 0
+        self.opponent_shots_fired = 0
+        
+        return self._get_observation(out)
+    
+    def _create_agent(self, x: int, y: int, dx: int, player_id: int) -> dict:
+        """Create an agent with the given parameters"""
+        return {
+            'x': x, 'y': y, 'dx': dx, 'player_id': player_id,
+            'health': 3, 'alive': True,
+            'last_shot': 0, 'shot_cooldown': self.shot_cooldown,
+            'hit_time': float('-inf'), 'hit_cooldown': 0.5,
+            'score': 0, 'bullets_spawned': 0
+        }
+    
+    def step(self, agent_action: int, opponent_action: int = None,
+             out: np.ndarray = None) -> tuple:
+        """
+        Execute one game step
+        
+        With frame_skip > 1 the actions are repeated for up to frame_skip ticks
+        and the observation is only built after the last one. The reward is the
+        sum over the ticks, and the step ends early on the tick the match ends.
+        
+        Args:
+            agent_action: Action for the learning agent (0-3)
+            opponent_action: Action for the opponent (if None, use scripted policy)
+            out: Optional float32 array (e.g. a row of a rollout buffer) that the
+                observation is written into instead of a new array
+        
+        Returns:
+            observation, reward, terminated, truncated, info
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start()
+        
+        reward, terminated, truncated = self._run_ticks(agent_action, opponent_action)
+        
+        # Get info with detailed statistics
+        if terminated or truncated or self.info_mode == 'full':
+            info = self.match_stats()
+        else:
+            info = {}
+        
+        self.step_count += 1
+        
+        if profiler is None:
+            return self._get_observation(out), reward, terminated, truncated, info
+        
+        profiler.lap('info')
+        observation = self._get_observation(out)
+        profiler.lap('observation')
+        profiler.end_step(len(self.bullets))
+        return observation, reward, terminated, truncated, info
+    
+    def advance(self, agent_action: int, opponent_action: int = None) -> tuple:
+        """
+        Execute one game step like step(), without building the observation
+        or the info (e.g. for a game server that only sends the state)
+        
+        Returns:
+            reward, terminated, truncated
+        """
+        reward, terminated, truncated = self._run_ticks(agent_action, opponent_action)
+        self.step_count += 1
+        return reward, terminated, truncated
+    
+    def _run_ticks(self, agent_action: int, opponent_action: int = None) -> tuple:
+        """Run the ticks of one step and return (reward, terminated, truncated)"""
+        reward = 0.0
+        for repeat in range(self.frame_skip):
+            if repeat:
+                self.step_count += 1
+            reward += self._tick(agent_action, opponent_action)
+            
+            # Check if game is done
+            terminated = self.done
+            truncated = self.step_count > 1000  # End after 1000 ticks
+            if terminated or truncated:
+                break
+        return reward, terminated, truncated
+    
+    def match_stats(self) -> dict:
+        """Statistics of the current match, as in the info returned by step()"""
+        return {
+            'winner': self.winner,
+            'agent_health': self.agent['health'],
+            'opponent_health': self.opponent['health'],
+            'step_count': self.step_count,
+            'agent_lives_lost': self.agent_lives_lost,
+            'opponent_lives_lost': self.opponent_lives_lost,
+            'agent_shots_fired': self.agent_shots_fired,
+            'opponent_shots_fired': self.opponent_shots_fired,
+        }
+    
+    def _tick(self, agent_action: int, opponent_action: int = None) -> float:
+        """Advance the game by one tick and return the learning agent's reward for it"""
+        profiler = self.profiler
+        current_time, dt = self._advance_clock()
+        
+        # Process actions
+        self._process_action(self.agent, agent_action, dt)
+        if profiler is not None:
+            profiler.lap('actions')
+        
+        if opponent_action is not None:
+            self._process_action(self.opponent, opponent_action, dt)
+        else:
+            # Default opponent behavior
+            self._default_opponent_behavior(dt)
+        if profiler is not None:
+            profiler.lap('opponent')
+        
+        # Update game state
+        self._update_bullets(dt)
+        if profiler is not None:
+            profiler.lap('bullets')
+        self._check_collisions(current_time, dt)
+        if profiler is not None:
+            profiler.lap('collisions')
+        
+        # Get reward
+        reward = self._get_reward()
+        if profiler is not None:
+            profiler.lap('reward')
+        return reward
+    
+    @contextmanager
+    def profile(self, profiler: StepProfiler = None):
+        """
+        Time each phase of step() while the context is active
+        
+        Usage:
+            with core.profile() as profiler:
+                ...
+            print(profiler.summary())
+        """
+        previous = self.profiler
+        self.profiler = profiler if profiler is not None else StepProfiler()
+        try:
+            yield self.profiler
+        finally:
+            self.profiler = previous
+    
+    def _advance_clock(self) -> tuple:
+        """Advance the game clock by one tick and return (current_time, dt)"""
+        if self.dt is None:
+            current_time = time.time()
+            dt = current_time - self.last_update_time
+            self.last_update_time = current_time
+            self.current_time = current_time
+            return current_time, dt
+        
+        # Tick clock: time is derived from the tick count so it never drifts
+        self.tick += 1
+        self.current_time = self.tick * self.dt
+        return self.current_time, self.dt
+    
+    def _process_action(self, agent: dict, action: int, dt: float):
+        """Convert action index to game action"""
+        if action == 0:  # MOVE UP
+            self._move_agent(agent, -1)
+        elif action == 1:  # MOVE DOWN
+            self._move_agent(agent, 1)
+        elif action == 2:  # SHOOT
+            self._shoot_bullet(agent, dt)
+            # Track shots fired
+            if agent['player_id'] == 0:
+                self.agent_shots_fired += 1
+            else:
+                self.opponent_shots_fired += 1
+        # action 3: DO_NOTHING
+    
+    def _move_agent(self, agent: dict, dy: int):
+        """Move agent vertically"""
+        new_y = agent['y'] + dy
+        if 0 <= new_y < self.grid_size:
+            agent['y'] = new_y
+    
+    def _shoot_bullet(self, agent: dict, dt: float):
+        """Agent shoots a bullet if cooldown has expired"""
+        agent['last_shot'] += dt
+        if agent['last_shot'] >= agent['shot_cooldown']:
+            self.bullets.spawn(agent['x'], agent['y'], agent['dx'], 0,
+                               self.bullet_speed, agent['player_id'])
+            agent['last_shot'] = 0  # Reset cooldown
+            agent['bullets_spawned'] += 1
+    
+    def _default_opponent_behavior(self, dt: float):
+        """Default behavior for opponent (simple tracking)"""
+        # Move toward player with some randomness
+        if self.opponent['y'] < self.agent['y'] and self.np_random.random() > 0.3:
+            self._move_agent(self.opponent, 1)
+        elif self.opponent['y'] > self.agent['y'] and self.np_random.random() > 0.3:
+            self._move_agent(self.opponent, -1)
+        
+        # Shoot with some probability
+        if self.np_random.random() < 0.1:  # 10% chance to shoot each frame
+            self._shoot_bullet(self.opponent, dt)
+    
+    def _update_bullets(self, dt: float):
+        """Update bullet positions; off-screen bullets are removed after the collision check"""
+        self.bullets.advance(dt)
+    
+    def _check_collisions(self, current_time: float, dt: float):
+        """
+        Check for bullet collisions along the bullets' paths during the step
+        
+        A bullet hits when its path passes within one cell of a target that is
+        out of its hit cooldown. Hits are applied in time order at their time
+        of impact, and the first death ends the match, so one long step gives
+        the same hits as many short ones.
+        """
+        step_start = current_time - dt
+        
+        # Agent bullets can hit the opponent, opponent bullets the agent; on a
+        # tie the agent's hit is applied first
+        candidates = []
+        for target, shooter in ((self.opponent, self.agent), (self.agent, self.opponent)):
+            spans = []
+            if target['alive']:
+                spans = [(step_start + enter * dt, step_start + leave * dt, slot) for enter, leave, slot in
+                         self.bullets.sweep(target['x'], target['y'], shooter['player_id'], self.grid_size)]
+            candidates.append((target, shooter, spans))
+        
+        hit_slots = []
+        end_time = float('inf')
+        while True:
+            # Earliest time a bullet is inside a target that can be hit. Of
+            # bullets that are inside at the same time, the one that would
+            # leave first hits.
+            best = None
+            for order, (target, shooter, spans) in enumerate(candidates):
+                if not target['alive']:
+                    continue
+                ready = target['hit_time'] + target['hit_cooldown']
+                for span in spans:
+                    hit_time = max(span[0], ready)
+                    key = (hit_time, order, span[1])
+                    if hit_time < span[1] and (best is None or key < best[0]):
+                        best = (key, span)
+            if best is None or best[0][0] > end_time:
+                break
+            
+            (hit_time, order, _), span = best
+            target, shooter, spans = candidates[order]
+            spans.remove(span)
+            hit_slots.append(span[2])
+            self._apply_hit(target, hit_time)
+            shooter['score'] += 1  # Reward for hitting
+            if not target['alive']:
+                self.done = True
+                self.winner = shooter['player_id']
+                end_time = hit_time
+        
+        # Remove spent bullets from the back so the other slots stay valid,
+        # then the bullets that left the grid during the step
+        for slot in sorted(hit_slots, reverse=True):
+            self.bullets.remove(slot)
+        self.bullets.cull(self.grid_size)
+    
+    def _apply_hit(self, agent: dict, hit_time: float):
+        """Take one life from an agent that was hit by a bullet at hit_time"""
+        agent['health'] -= 1
+        
+        # Track lives lost
+        if agent['player_id'] == 0:
+            self.agent_lives_lost += 1
+        else:
+            self.opponent_lives_lost += 1
+            
+        agent['hit_time'] = hit_time
+        if agent['health'] <= 0:
+            agent['alive'] = False
+    
+    def _get_observation(self, out: np.ndarray = None) -> np.ndarray:
+        """Convert game state to numerical representation for AI"""
+        if self.observation == 'features':
+            return self._get_feature_observation(out)
+        if self.incremental_obs:
+            return self._update_observation_buffer(out)
+        
+        # Create a grid representation
+        state = np.zeros((self.grid_size, self.grid_size, 4), dtype=np.float32)
+        
+        # Channel 0: Agent position
+        if self.agent['alive']:
+            y, x = int(self.agent['y']), int(self.agent['x'])
+            if 0 <= x < self.grid_size and 0 <= y < self.grid_size:
+                state[y, x, 0] = 1.0
+        
+        # Channel 1: Opponent position
+        if self.opponent['alive']:
+            y, x = int(self.opponent['y']), int(self.opponent['x'])
+            if 0 <= x < self.grid_size and 0 <= y < self.grid_size:
+                state[y, x, 1] = 1.0
+        
+        # Channels 2/3: Agent and opponent bullets (the pool only holds on-screen bullets)
+        n = self.bullets.count
+        if n:
+            x = self.bullets.x[:n].astype(np.int64)
+            y = self.bullets.y[:n].astype(np.int64)
+            state[y, x, 2 + self.bullets.owner[:n]] = 1.0
+        
+        # Flatten and add health information
+        grid_state = state.flatten()
+        health_info = np.array([
+            self.agent['health'] / 3.0, 
+            self.opponent['health'] / 3.0
+        ], dtype=np.float32)
+        
+        if out is not None:
+            out[:-2] = grid_state
+            out[-2:] = health_info
+            return out
+        
+        full_state = np.concatenate([grid_state, health_info])
+        return full_state
+    
+    def _update_observation_buffer(self, out: np.ndarray = None) -> np.ndarray:
+        """Update the preallocated observation buffer in place"""
+        obs = self._obs
+        
+        # Clear the cells set last step, then set the current ones. Only a
+        # handful of cells are occupied, so this touches a few floats per step.
+        for cell in self._obs_cells:
+            obs[cell] = 0.0
+        cells = self._occupied_cells()
+        for cell in cells:
+            obs[cell] = 1.0
+        self._obs_cells = cells
+        
+        # Health information
+        obs[-2] = self.agent['health'] / 3.0
+        obs[-1] = self.opponent['health'] / 3.0
+        
+        if out is not None:
+            np.copyto(out, obs)
+            return out
+        return obs
+    
+    def _occupied_cells(self) -> list:
+        """Flat indices of the set cells in the (y, x, channel) grid observation"""
+        g = self.grid_size
+        cells = []
+        
+        # Channels 0/1: agent and opponent positions
+        for channel, agent in enumerate((self.agent, self.opponent)):
+            if agent['alive']:
+                y, x = int(agent['y']), int(agent['x'])
+                if 0 <= x < g and 0 <= y < g:
+                    cells.append((y * g + x) * 4 + channel)
+        
+        # Channels 2/3: agent and opponent bullets (the pool only holds on-screen bullets)
+        for x, y, owner in self.bullets.items():
+            cells.append((int(y) * g + int(x)) * 4 + 2 + owner)
+        
+        return cells
+    
+    def _get_feature_observation(self, out: np.ndarray = None, player: int = 0) -> np.ndarray:
+        """
+        Encode the game state as a compact fixed-size feature vector
+        
+        Layout (all values in [-1, 1]):
+            0-3: agent x, agent y, opponent x, opponent y (divided by grid size)
+            4-5: agent and opponent health
+            6-7: agent and opponent shot cooldown progress (1 = ready to fire)
+            8-9: agent and opponent remaining hit cooldown (0 = can be hit)
+            10-: for the K nearest bullets to the agent, (dx, dy) offset from
+                 the agent divided by grid size, owner (0 = agent, 1 = opponent)
+                 and a present flag; unused slots are all zeros
+        
+        With player=1 the vector is built from the opponent's side: the roles
+        are swapped and x is mirrored (see get_opponent_observation).
+        """
+        g = self.grid_size
+        agent, opponent = self.agent, self.opponent
+        features = out if out is not None else np.empty(self.observation_size, dtype=np.float32)
+        if player:
+            agent, opponent = opponent, agent
+        
+        features[:10] = (
+            agent['x'] / g, agent['y'] / g,
+            opponent['x'] / g, opponent['y'] / g,
+            agent['health'] / 3.0, opponent['health'] / 3.0,
+            min(agent['last_shot'] / agent['shot_cooldown'], 1.0),
+            min(opponent['last_shot'] / opponent['shot_cooldown'], 1.0),
+            self._hit_cooldown_left(agent),
+            self._hit_cooldown_left(opponent),
+        )
+        if player:
+            features[0:4:2] = (g - 1 - agent['x']) / g, (g - 1 - opponent['x']) / g
+        
+        # K nearest bullets, relative to the agent
+        slots = features[10:].reshape(self.num_nearest_bullets, 4)
+        slots[:] = 0.0
+        ax, ay = agent['x'], agent['y']
+        bullets = [(x - ax, y - ay, owner) for x, y, owner in self.bullets.items()]
+        if bullets:
+            # Equally near bullets: the observing side's own bullets first
+            bullets.sort(key=lambda b: (b[0] * b[0] + b[1] * b[1], b[2] != player))
+            bullets = bullets[:self.num_nearest_bullets]
+            if player:
+                bullets = [(-dx, dy, 1 - owner) for dx, dy, owner in bullets]
+            slots[:len(bullets)] = [(dx / g, dy / g, owner, 1.0) for dx, dy, owner in bullets]
+        
+        return features
+    
+    def get_opponent_observation(self, out: np.ndarray = None) -> np.ndarray:
+        """
+        Observation of the current state from the opponent's side
+        
+        The game is mirrored along x (x -> grid_size - 1 - x) and the roles are
+        swapped, so the opponent sees itself as the agent starting on the left,
+        exactly like the learning agent does. A policy trained as the agent can
+        then play the opponent (self-play).
+        """
+        if self.observation == 'features':
+            return self._get_feature_observation(out, player=1)
+        
+        g = self.grid_size
+        state = np.zeros((g, g, 4), dtype=np.float32)
+        
+        # Channels 0/1: opponent and agent positions
+        for channel, agent in enumerate((self.opponent, self.agent)):
+            if agent['alive']:
+                y, x = int(agent['y']), g - 1 - int(agent['x'])
+                if 0 <= x < g and 0 <= y < g:
+                    state[y, x, channel] = 1.0
+        
+        # Channels 2/3: opponent and agent bullets
+        n = self.bullets.count
+        if n:
+            x = (g - 1 - self.bullets.x[:n]).astype(np.int64)
+            y = self.bullets.y[:n].astype(np.int64)
+            state[y, x, 3 - self.bullets.owner[:n]] = 1.0
+        
+        observation = out if out is not None else np.empty(self.observation_size, dtype=np.float32)
+        observation[:-2] = state.ravel()
+        observation[-2] = self.opponent['health'] / 3.0
+        observation[-1] = self.agent['health'] / 3.0
+        return observation
+    
+    def _hit_cooldown_left(self, agent: dict) -> float:
+        """Fraction of the agent's hit cooldown still remaining"""
+        left = agent['hit_cooldown'] - (self.current_time - agent['hit_time'])
+        return min(max(left / agent['hit_cooldown'], 0.0), 1.0)
+    
+    def _get_reward(self) -> float:
+        """Calculate reward for the learning agent"""
+        reward = 0.0
+        
+        # Small penalty for each step to encourage faster games
+        reward -= 0.001
+        
+        # Reward for hitting opponent
+        reward += self.agent['score'] * 1.0
+        self.agent['score'] = 0  # Reset for next step
+        
+        # Penalty for getting hit
+        if self.agent_lives_lost > 0:
+            reward -= 0.2 * self.agent_lives_lost
+            self.agent_lives_lost = 0
+        
+        # Large reward for winning
+        if self.done and self.winner == 0:
+            reward += 10.0
+        
+        # Large penalty for losing
+        if self.done and self.winner == 1:
+            reward -= 10.0
+        
+        return reward
+
+# ==================== BATCHED GAME CORE ====================
+class BatchedAIFightClubCore:
+    """
+    Vectorized game logic running N independent matches at once.
+
+    State is kept as struct-of-arrays: every per-agent field is an (N, 2) array
+    where column 0 is the learning agent and column 1 the opponent, and bullets
+    live in fixed-capacity (N, 2, capacity) arrays indexed by owner. The rules
+    (movement, shot cooldown, hit cooldown, rewards, truncation) are the same as
+    in AIFightClubCore.
+    """
+    
+    AGENT_START = (3, 10)
+    OPPONENT_START = (16, 10)
+    
+    # Per-match state arrays (the clock and the opponent RNG are shared;
+    # match_time is the shared clock's time a match was last advanced to)
+    MATCH_STATE = ('x', 'y', 'health', 'alive', 'last_shot', 'hit_time', 'match_time',
+                   'bullet_x', 'bullet_y', 'bullet_prev_x', 'bullet_prev_y',
+                   'bullet_dx', 'bullet_dy', 'bullet_alive',
+                   'done', 'winner', 'step_count', 'lives_lost', 'shots_fired')
+    
+    def __init__(self, num_matches: int, grid_size: int = 20, dt: float = None,
+                 seed: int = None, autoreset: bool = True, observation: str = 'grid',
+                 num_nearest_bullets: int = 8, frame_skip: int = 1,
+                 opponent_view: bool = False, info_mode: str = 'full'):
+        """
+        Args are as in AIFightClubCore, plus:
+            num_matches: Number of matches stepped together
+            autoreset: Reset finished matches at the end of step()
+            opponent_view: Also keep every opponent's observation of its match,
+                mirrored as in AIFightClubCore.get_opponent_observation, in
+                opponent_observations (for self-play)
+            info_mode: With 'full', every info array has one entry per match.
+                With 'terminal', they only hold the matches that ended this
+                step, in the order of info['ended'] (the same matches as
+                info['reset_indices'] with autoreset).
+        """
+        if observation not in OBSERVATION_MODES:
+            raise ValueError(f"Unknown observation mode: {observation}")
+        if frame_skip < 1:
+            raise ValueError(f"frame_skip must be at least 1, got {frame_skip}")
+        if info_mode not in INFO_MODES:
+            raise ValueError(f"Unknown info mode: {info_mode}")
+        
+        self.num_matches = num_matches
+        self.grid_size = grid_size
+        self.cell_size = 1
+        self.dt = dt  # None = wall-clock time between ticks, as in AIFightClubCore
+        self.frame_skip = frame_skip  # Ticks per step(), as in AIFightClubCore
+        self.info_mode = info_mode
+        self._observed_players = (0, 1) if opponent_view else (0,)
+        self.autoreset = autoreset
+        self.observation = observation
+        self.num_nearest_bullets = num_nearest_bullets
+        
+        # Game rules (same values as AIFightClubCore)
+        self.max_health = 3
+        self.shot_cooldown = 0.5
+        self.hit_cooldown = 0.5
+        self.bullet_speed = 5.0  # cells per second
+        self.max_steps = 1000
+        
+        # A bullet crosses the grid in grid_size / speed seconds and an owner can
+        # fire at most once per shot_cooldown, which bounds bullets in flight
+        self.bullet_capacity = int(np.ceil(grid_size / (self.bullet_speed * self.shot_cooldown))) + 2
+        if observation == 'features':
+            # Same layout as AIFightClubCore._get_feature_observation
+            self.observation_size = 10 + 4 * num_nearest_bullets
+        else:
+            self.observation_size = grid_size * grid_size * 4 + 2
+        
+        self.np_random = np.random.default_rng(seed)
+        self.profiler = None  # StepProfiler, timings are per batched step
+        self._rows = np.arange(num_matches)
+        self._allocate_state()
+        self.reset()
+    
+    @property
+    def opponent_observations(self) -> np.ndarray:
+        """(N, obs_size) observations from the opponents' side, reused between steps"""
+        if len(self._observed_players) < 2:
+            raise RuntimeError("Create the core with opponent_view=True to get opponent observations")
+        return self._opponent_obs
+    
+    def _allocate_state(self):
+        """Allocate the struct-of-arrays state for all matches"""
+        n, cap = self.num_matches, self.bullet_capacity
+        
+        # Agents: column 0 = learning agent, column 1 = opponent
+        self.x = np.zeros((n, 2), dtype=np.int64)
+        self.y = np.zeros((n, 2), dtype=np.int64)
+        self.dx = np.tile(np.array([1, -1], dtype=np.int64), (n, 1))
+        self.health = np.zeros((n, 2), dtype=np.int64)
+        self.alive = np.zeros((n, 2), dtype=bool)
+        self.last_shot = np.zeros((n, 2), dtype=np.float64)
+        self.hit_time = np.zeros((n, 2), dtype=np.float64)
+        self.match_time = np.zeros(n, dtype=np.float64)
+        
+        # Bullets: axis 1 is the owner, axis 2 the slot in the owner's pool
+        self.bullet_x = np.zeros((n, 2, cap), dtype=np.float64)
+        self.bullet_y = np.zeros((n, 2, cap), dtype=np.float64)
+        self.bullet_prev_x = np.zeros((n, 2, cap), dtype=np.float64)  # position before the last move
+        self.bullet_prev_y = np.zeros((n, 2, cap), dtype=np.float64)
+        self.bullet_dx = np.zeros((n, 2, cap), dtype=np.float64)
+        self.bullet_dy = np.zeros((n, 2, cap), dtype=np.float64)
+        self.bullet_alive = np.zeros((n, 2, cap), dtype=bool)
+        
+        # Match state
+        self.done = np.zeros(n, dtype=bool)
+        self.winner = np.full(n, -1, dtype=np.int64)  # -1 = no winner yet
+        self.step_count = np.zeros(n, dtype=np.int64)
+        
+        # Match statistics
+        self.lives_lost = np.zeros((n, 2), dtype=np.int64)
+        self.shots_fired = np.zeros((n, 2), dtype=np.int64)
+        
+        # Observation buffers, reused between steps
+        self._obs = np.zeros((n, self.observation_size), dtype=np.float32)
+        self._opponent_obs = np.zeros((n, self.observation_size), dtype=np.float32)
+        
+        # Grid cells set by the last write of every match, as (matches, cells)
+        # per side, and the matches written since then that are not in them
+        empty = np.zeros(0, dtype=np.int64)
+        self._grid_cells = [(empty, empty), (empty, empty)]
+        self._grid_stale = np.zeros((2, n), dtype=bool)
+    
+    def reset(self, indices=None, seed: int = None) -> np.ndarray:
+        """Reset the given matches (all by default) and return the observations"""
+        if seed is not None:
+            self.np_random = np.random.default_rng(seed)
+        if indices is None:
+            # The clock is shared by all matches, so only a full reset restarts it
+            indices = self._rows
+            self.tick = 0
+            self.last_update_time = time.time()
+            self.current_time = 0.0 if self.dt is not None else self.last_update_time
+        indices = np.asarray(indices, dtype=np.int64)
+        
+        self.x[indices] = (self.AGENT_START[0], self.OPPONENT_START[0])
+        self.y[indices] = (self.AGENT_START[1], self.OPPONENT_START[1])
+        self.health[indices] = self.max_health
+        self.alive[indices] = True
+        self.last_shot[indices] = 0.0
+        self.hit_time[indices] = -np.inf
+        self.match_time[indices] = self.current_time
+        self.bullet_alive[indices] = False
+        
+        self.done[indices] = False
+        self.winner[indices] = -1
+        self.step_count[indices] = 0
+        self.lives_lost[indices] = 0
+        self.shots_fired[indices] = 0
+        
+        self._write_observation(indices)
+        return self._obs
+    
+    def step(self, agent_actions, opponent_actions=None) -> tuple:
+        """
+        Execute one game step in every match
+        
+        Args:
+            agent_actions: (N,) actions for the learning agents (0-3)
+            opponent_actions: (N,) actions for the opponents (if None, use scripted policy)
+        
+        Returns:
+            observations (N, obs_size), rewards (N,), terminated (N,), truncated (N,), info
+            
+        The observation array is reused between calls. With autoreset enabled,
+        finished matches are reset before returning; their last observations are
+        in info['final_observation'] for the matches listed in info['reset_indices']
+        (and in info['final_opponent_observation'] with opponent_view).
+        With frame_skip > 1 the actions are repeated for frame_skip ticks and
+        rewards are summed over them; a match that ends on an earlier tick is
+        frozen in the state it ended in (see _fast_forward).
+        """
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.start()
+        agent_actions = np.asarray(agent_actions)
+        if opponent_actions is not None:
+            opponent_actions = np.asarray(opponent_actions)
+        
+        rewards, terminated, truncated = self._tick(agent_actions, opponent_actions)
+        if self.frame_skip > 1:
+            rewards, terminated, truncated = self._fast_forward(
+                agent_actions, opponent_actions, rewards, terminated, truncated)
+        
+        if self.info_mode == 'full':
+            info = self.match_stats()
+        else:
+            ended = np.flatnonzero(terminated | truncated)
+            info = self.match_stats(ended)
+            info['ended'] = ended
+        
+        self.step_count += 1
+        if profiler is not None:
+            profiler.lap('info')
+        self._write_observation(self._rows)
+        
+        if self.autoreset:
+            finished = np.flatnonzero(terminated | truncated) if self.info_mode == 'full' else ended
+            info['reset_indices'] = finished
+            info['final_observation'] = self._obs[finished].copy()
+            if len(self._observed_players) == 2:
+                info['final_opponent_observation'] = self._opponent_obs[finished].copy()
+            if finished.size:
+                self.reset(finished)
+                if profiler is not None:
+                    profiler.resets += finished.size
+        
+        if profiler is not None:
+            profiler.lap('observation')
+            profiler.end_step(int(self.bullet_alive.sum()))
+        return self._obs, rewards, terminated, truncated, info
+    
+    def match_stats(self, rows=slice(None)) -> dict:
+        """Copies of the statistics of the given matches (all by default), as in step()'s info"""
+        return {
+            'winner': self.winner[rows].copy(),
+            'agent_health': self.health[rows, 0].copy(),
+            'opponent_health': self.health[rows, 1].copy(),
+            'step_count': self.step_count[rows].copy(),
+            'agent_lives_lost': self.lives_lost[rows, 0].copy(),
+            'opponent_lives_lost': self.lives_lost[rows, 1].copy(),
+            'agent_shots_fired': self.shots_fired[rows, 0].copy(),
+            'opponent_shots_fired': self.shots_fired[rows, 1].copy(),
+        }
+    
+    def _tick(self, agent_actions: np.ndarray, opponent_actions: np.ndarray = None) -> tuple:
+        """Advance every match by one tick and return (rewards, terminated, truncated)"""
+        profiler = self.profiler
+        current_time, dt = self._advance_clock()
+        self.match_time[:] = current_time
+        
+        # Process actions
+        self._process_actions(0, agent_actions, dt)
+        if profiler is not None:
+            profiler.lap('actions')
+        
+        if opponent_actions is not None:
+            self._process_actions(1, opponent_actions, dt)
+        else:
+            # Default opponent behavior
+            self._default_opponent_behavior(dt)
+        if profiler is not None:
+            profiler.lap('opponent')
+        
+        # Update game state
+        self._update_bullets(dt)
+        if profiler is not None:
+            profiler.lap('bullets')
+        hits = self._check_collisions(current_time, dt)
+        if profiler is not None:
+            profiler.lap('collisions')
+        
+        # Get reward
+        rewards = self._get_rewards(hits)
+        if profiler is not None:
+            profiler.lap('reward')
+        
+        # Check if games are done
+        terminated = self.done.copy()
+        truncated = self.step_count > self.max_steps
+        return rewards, terminated, truncated
+    
+    def _fast_forward(self, agent_actions: np.ndarray, opponent_actions: np.ndarray,
+                      rewards: np.ndarray, terminated: np.ndarray, truncated: np.ndarray) -> tuple:
+        """
+        Run the remaining frame_skip - 1 ticks of a step with the same actions
+        
+        All matches share one clock, so matches that end before the last tick
+        keep being simulated with the rest; their state, including the time
+        they were at (match_time), is saved on the tick they ended and put
+        back afterwards, which leaves them exactly as if they had stopped
+        there. Their rewards and done flags stop accumulating
+        at that tick as well.
+        """
+        ended = terminated | truncated
+        saved = []  # (rows, state) of the matches that ended on an earlier tick
+        saved_rows = np.zeros(self.num_matches, dtype=bool)
+        for _ in range(self.frame_skip - 1):
+            if ended.all():
+                break
+            rows = np.flatnonzero(ended & ~saved_rows)
+            if rows.size:
+                saved.append((rows, [getattr(self, name)[rows] for name in self.MATCH_STATE]))
+                saved_rows[rows] = True
+            
+            self.step_count += 1
+            tick_rewards, tick_terminated, tick_truncated = self._tick(agent_actions, opponent_actions)
+            running = ~ended
+            rewards += np.where(running, tick_rewards, 0.0).astype(rewards.dtype)
+            terminated |= tick_terminated & running
+            truncated |= tick_truncated & running
+            ended = terminated | truncated
+        
+        for rows, state in saved:
+            for name, values in zip(self.MATCH_STATE, state):
+                getattr(self, name)[rows] = values
+        return rewards, terminated, truncated
+    
+    def _advance_clock(self) -> tuple:
+        """Advance the shared game clock by one tick and return (current_time, dt)"""
+        if self.dt is None:
+            current_time = time.time()
+            dt = current_time - self.last_update_time
+            self.last_update_time = current_time
+            self.current_time = current_time
+            return current_time, dt
+        
+        self.tick += 1
+        self.current_time = self.tick * self.dt
+        return self.current_time, self.dt
+    
+    def _process_actions(self, player: int, actions: np.ndarray, dt: float):
+        """Convert action indices to game actions for one side of every match"""
+        # MOVE UP (0) / MOVE DOWN (1)
+        dy = (actions == 1).astype(np.int64) - (actions == 0)
+        self._move_agents(player, dy)
+        
+        # SHOOT (2)
+        shoot = actions == 2
+        self.shots_fired[:, player] += shoot
+        self._shoot_bullets(player, shoot, dt)
+        # action 3: DO_NOTHING
+    
+    def _move_agents(self, player: int, dy: np.ndarray):
+        """Move agents vertically, staying inside the grid"""
+        new_y = self.y[:, player] + dy
+        inside = (new_y >= 0) & (new_y < self.grid_size)
+        self.y[inside, player] = new_y[inside]
+    
+    def _shoot_bullets(self, player: int, shooting: np.ndarray, dt: float):
+        """Spawn bullets for shooting agents whose cooldown has expired"""
+        self.last_shot[shooting, player] += dt
+        fire = shooting & (self.last_shot[:, player] >= self.shot_cooldown)
+        rows = np.flatnonzero(fire)
+        if rows.size == 0:
+            return
+        self.last_shot[rows, player] = 0  # Reset cooldown
+        
+        # First free slot in each shooter's pool
+        free = ~self.bullet_alive[rows, player]
+        has_slot = free.any(axis=1)
+        rows = rows[has_slot]
+        slots = free[has_slot].argmax(axis=1)
+        
+        self.bullet_x[rows, player, slots] = self.x[rows, player]
+        self.bullet_y[rows, player, slots] = self.y[rows, player]
+        self.bullet_dx[rows, player, slots] = self.dx[rows, player]
+        self.bullet_dy[rows, player, slots] = 0
+        self.bullet_alive[rows, player, slots] = True
+    
+    def _default_opponent_behavior(self, dt: float):
+        """Default behavior for opponents (simple tracking)"""
+        rand = self.np_random.random((self.num_matches, 3))
+        opponent_y, agent_y = self.y[:, 1], self.y[:, 0]
+        
+        # Move toward player with some randomness
+        down = (opponent_y < agent_y) & (rand[:, 0] > 0.3)
+        up = (opponent_y > agent_y) & (rand[:, 1] > 0.3)
+        self._move_agents(1, down.astype(np.int64) - up)
+        
+        # Shoot with some probability
+        self._shoot_bullets(1, rand[:, 2] < 0.1, dt)
+    
+    def _update_bullets(self, dt: float):
+        """Update bullet positions; off-screen bullets are removed after the collision check"""
+        distance = self.bullet_speed * dt
+        self.bullet_prev_x[:] = self.bullet_x
+        self.bullet_prev_y[:] = self.bullet_y
+        self.bullet_x += self.bullet_dx * distance
+        self.bullet_y += self.bullet_dy * distance
+    
+    def _check_collisions(self, current_time: float, dt: float) -> np.ndarray:
+        """
+        Check for bullet collisions along the bullets' paths in all matches
+        
+        Same rules as AIFightClubCore._check_collisions: hits are applied in
+        time order at their time of impact and the first death ends a match.
+        
+        Returns:
+            (N, 2) int array, hits[:, p] is how often player p hit the other side
+        """
+        n, g = self.num_matches, self.grid_size
+        rows_all = self._rows
+        hits = np.zeros((n, 2), dtype=np.int64)
+        step_start = current_time - dt
+        
+        # When each bullet was inside each target's hit box, as (N, target, slot)
+        # times. Only bullets whose path's bounding box touches the hit box
+        # can hit, so the exact spans are computed for those alone.
+        enter = leave = None
+        for target in (0, 1):
+            owner = 1 - target
+            x0, y0 = self.bullet_prev_x[:, owner], self.bullet_prev_y[:, owner]
+            x1, y1 = self.bullet_x[:, owner], self.bullet_y[:, owner]
+            tx, ty = self.x[:, target, None], self.y[:, target, None]
+            near = (self.bullet_alive[:, owner] &
+                    (np.minimum(x0, x1) < tx + 1) & (np.maximum(x0, x1) > tx - 1) &
+                    (np.minimum(y0, y1) < ty + 1) & (np.maximum(y0, y1) > ty - 1))
+            rows, slots = np.nonzero(near)
+            if rows.size == 0:
+                continue
+            
+            x0, y0 = x0[rows, slots], y0[rows, slots]
+            dx, dy = x1[rows, slots] - x0, y1[rows, slots] - y0
+            tx, ty = self.x[rows, target], self.y[rows, target]
+            spans = (sweep_spans(x0, dx, tx - 1, tx + 1), sweep_spans(y0, dy, ty - 1, ty + 1),
+                     sweep_spans(x0, dx, 0, g, closed_low=True), sweep_spans(y0, dy, 0, g, closed_low=True))
+            first = np.maximum.reduce([span[0] for span in spans])
+            last = np.minimum.reduce([span[1] for span in spans])
+            first_time, last_time = step_start + first * dt, step_start + last * dt
+            
+            # Spans that end before the target's hit cooldown does can never hit
+            ready = self.hit_time[rows, target] + self.hit_cooldown
+            keep = (first < last) & (ready < last_time) & self.alive[rows, target]
+            rows, slots = rows[keep], slots[keep]
+            if rows.size == 0:
+                continue
+            if enter is None:
+                enter = np.full((n, 2, self.bullet_capacity), np.inf)
+                leave = np.full((n, 2, self.bullet_capacity), -np.inf)
+            enter[rows, target, slots] = first_time[keep]
+            leave[rows, target, slots] = last_time[keep]
+        
+        end_time = np.full(n, np.inf)
+        next_time = np.empty((n, 2))
+        next_slot = np.empty((n, 2), dtype=np.int64)
+        while enter is not None and np.isfinite(enter).any():
+            # Earliest time a bullet is inside a target that can be hit; on a
+            # tie, the bullet that would leave first
+            for target in (0, 1):
+                ready = self.hit_time[:, target] + self.hit_cooldown
+                times = np.maximum(enter[:, target], ready[:, None])
+                times = np.where((times < leave[:, target]) & self.alive[:, target, None], times, np.inf)
+                next_time[:, target] = times.min(axis=1)
+                tied = times == next_time[:, target, None]
+                next_slot[:, target] = np.where(tied, leave[:, target], np.inf).argmin(axis=1)
+            
+            # On a tie the agent's hit on the opponent is applied first
+            target = (next_time[:, 1] <= next_time[:, 0]).astype(np.int64)
+            time_ = next_time[rows_all, target]
+            rows = np.flatnonzero((time_ < np.inf) & (time_ <= end_time))
+            if rows.size == 0:
+                break
+            
+            target, time_ = target[rows], time_[rows]
+            owner = 1 - target
+            slots = next_slot[rows, target]
+            enter[rows, target, slots] = np.inf
+            self.bullet_alive[rows, owner, slots] = False
+            self.health[rows, target] -= 1
+            self.lives_lost[rows, target] += 1
+            self.hit_time[rows, target] = time_
+            hits[rows, owner] += 1
+            
+            killed = self.health[rows, target] <= 0
+            self.alive[rows[killed], target[killed]] = False
+            self.done[rows[killed]] = True
+            self.winner[rows[killed]] = owner[killed]
+            end_time[rows[killed]] = time_[killed]
+        
+        # Bullets that left the grid during the step are gone
+        on_screen = ((self.bullet_x >= 0) & (self.bullet_x < g) &
+                     (self.bullet_y >= 0) & (self.bullet_y < g))
+        self.bullet_alive &= on_screen
+        return hits
+    
+    def _get_rewards(self, hits: np.ndarray) -> np.ndarray:
+        """Calculate rewards for the learning agents"""
+        # Small penalty for each step to encourage faster games
+        rewards = np.full(self.num_matches, -0.001, dtype=np.float32)
+        
+        # Reward for hitting opponent, penalty for getting hit
+        rewards += hits[:, 0] * 1.0
+        rewards -= hits[:, 1] * 0.2
+        
+        # Large reward for winning, large penalty for losing
+        rewards += (self.done & (self.winner == 0)) * 10.0
+        rewards -= (self.done & (self.winner == 1)) * 10.0
+        
+        return rewards
+    
+    def _write_observation(self, rows: np.ndarray):
+        """Write the observations of the given matches into the observation buffer(s)"""
+        for player in self._observed_players:
+            if self.observation == 'features':
+                self._write_feature_observation(rows, player)
+            else:
+                self._write_grid_observation(rows, player)
+    
+    def _write_grid_observation(self, rows: np.ndarray, player: int = 0):
+        """
+        Write the grid observations of the given matches into the observation
+        buffer of one side; the opponent's (player 1) is mirrored along x as in
+        AIFightClubCore.get_opponent_observation
+        
+        Only a few cells per match are set, so a write of every match (as in
+        step()) clears just the cells set by the previous one instead of the
+        whole buffer. A write of some matches (as in reset()) clears their rows
+        in full and marks them, and the next write of every match clears those
+        rows in full as well.
+        """
+        obs = self._obs if player == 0 else self._opponent_obs
+        every_match = rows.size == self.num_matches
+        if every_match:
+            obs[self._grid_cells[player]] = 0.0
+            stale = self._grid_stale[player]
+            if stale.any():
+                obs[stale] = 0.0
+                stale[:] = False
+        else:
+            obs[rows] = 0.0
+            self._grid_stale[player, rows] = True
+        g = self.grid_size
+        
+        # Channels 0/1: agent and opponent positions
+        matches, cells = [], []
+        for side in (0, 1):
+            live = rows[self.alive[rows, side]]
+            x = self.x[live, side] if player == 0 else g - 1 - self.x[live, side]
+            matches.append(live)
+            cells.append((self.y[live, side] * g + x) * 4 + (side ^ player))
+        
+        # Channels 2/3: agent and opponent bullets
+        match, owner, slot = np.nonzero(self.bullet_alive[rows])
+        match = rows[match]
+        bx = self.bullet_x[match, owner, slot]
+        if player:
+            bx = g - 1 - bx
+        bx = bx.astype(np.int64)
+        by = self.bullet_y[match, owner, slot].astype(np.int64)
+        matches.append(match)
+        cells.append((by * g + bx) * 4 + 2 + (owner ^ player))
+        
+        set_cells = np.concatenate(matches), np.concatenate(cells)
+        obs[set_cells] = 1.0
+        if every_match:
+            self._grid_cells[player] = set_cells
+        
+        # Health information
+        obs[rows, -2] = self.health[rows, player] / self.max_health
+        obs[rows, -1] = self.health[rows, 1 - player] / self.max_health
+    
+    def _write_feature_observation(self, rows: np.ndarray, player: int = 0):
+        """
+        Write the compact feature observations of the given matches into the
+        observation buffer of one side; the opponent's (player 1) is mirrored
+        along x as in AIFightClubCore.get_opponent_observation
+        """
+        obs = self._obs if player == 0 else self._opponent_obs
+        g = self.grid_size
+        sides = slice(None) if player == 0 else [1, 0]
+        
+        # Positions, health and cooldown timers
+        x = self.x[rows][:, sides]
+        obs[rows, 0:4:2] = (x if player == 0 else g - 1 - x) / g
+        obs[rows, 1:4:2] = self.y[rows][:, sides] / g
+        obs[rows, 4:6] = self.health[rows][:, sides] / self.max_health
+        obs[rows, 6:8] = np.minimum(self.last_shot[rows][:, sides] / self.shot_cooldown, 1.0)
+        left = self.hit_cooldown - (self.match_time[rows, None] - self.hit_time[rows][:, sides])
+        obs[rows, 8:10] = np.clip(left / self.hit_cooldown, 0.0, 1.0)
+        
+        # K nearest bullets to the agent, both owners pooled along the last axis
+        # with the observing side's own bullets first
+        n, cap, k = len(rows), self.bullet_capacity, self.num_nearest_bullets
+        dx = (self.bullet_x[rows][:, sides] - self.x[rows, player, None, None]).reshape(n, 2 * cap)
+        dy = (self.bullet_y[rows][:, sides] - self.y[rows, player, None, None]).reshape(n, 2 * cap)
+        alive = self.bullet_alive[rows][:, sides].reshape(n, 2 * cap)
+        owner = np.repeat(np.array([0.0, 1.0]), cap)
+        
+        distance = np.where(alive, dx * dx + dy * dy, np.inf)
+        nearest = np.argsort(distance, axis=1, kind='stable')[:, :k]
+        present = np.take_along_axis(alive, nearest, axis=1)
+        
+        slots = np.zeros((n, k, 4), dtype=np.float32)
+        slots[..., 0] = np.take_along_axis(dx, nearest, axis=1) / g
+        if player:
+            slots[..., 0] *= -1
+        slots[..., 1] = np.take_along_axis(dy, nearest, axis=1) / g
+        slots[..., 2] = owner[nearest]
+        slots[..., 3] = 1.0
+        slots[~present] = 0.0
+        obs[rows, 10:] = slots.reshape(n, 4 * k)
@@ -0,0 +1,456 @@
+"""
+Offline-RL / behavior-cloning datasets of recorded matches
+
+Transitions are stored in shards of memory-mapped .npy files. A shard holds
+compact game states (positions, health, cooldowns and bullets, under 400
+bytes) and transitions that point at them, instead of observations (6.4 KB
+each for the grid encoding). Observations are rebuilt per minibatch from the
+states by a BatchedAIFightClubCore's observation writers, in either encoding
+and from either player's side, so one state serves both players' transitions.
+
+Shards are written from replay files (replay.py) by shards_from_replays(),
+or from human games by a HumanGameRecorder (pygame_local.py and
+pygame_online.py take --record DIR). TransitionDataset streams shuffled
+minibatches of (obs, action, reward, next_obs, done) from a shard directory
+with only a few shards' indices in memory, and pretrain_policy() clones the
+recorded behavior into a PPO policy before training.
+
+Run from the repository root:
+    python -m game.dataset build shards/ games.afcr
+    python -m game.dataset info shards/
+"""
+
+import argparse
+import glob
+import json
+import os
+
+import numpy as np
+
+# Bullet slots per side in a state; the batched core's capacity for a 20x20 grid
+BULLET_CAPACITY = 10
+
+# Compact game state. Times are in seconds: last_shot is the time charged
+# towards the next shot (as in the cores), hit_ago the time since the last hit.
+# Bullet positions keep double precision: a bullet's grid cell is its
+# truncated position, which float32 rounding can move across a cell border.
+STATE_DTYPE = np.dtype([
+    ('x', 'u1', 2), ('y', 'u1', 2), ('health', 'i1', 2),
+    ('last_shot', '<f4', 2), ('hit_ago', '<f4', 2),
+    ('bullet_x', '<f8', (2, BULLET_CAPACITY)), ('bullet_y', '<f8', (2, BULLET_CAPACITY)),
+    ('bullet_alive', '?', (2, BULLET_CAPACITY)),
+])
+
+# One transition of one player: state and state + 1 are its observation and
+# next observation
+TRANSITION_DTYPE = np.dtype([
+    ('state', '<u8'), ('player', 'u1'), ('action', 'u1'), ('reward', '<f4'),
+    ('terminated', '?'), ('truncated', '?'),
+])
+
+# Reward of the cores (see AIFightClubCore._get_reward), applied to human games
+STEP_PENALTY, HIT_REWARD, HIT_PENALTY, WIN_REWARD = 0.001, 1.0, 0.2, 10.0
+
+
+def _set_bullets(state: np.void, bullets):
+    """
+    Copy a BulletPool's bullets into a state, per owner in slot order
+
+    Raises ValueError if an owner has more bullets in flight than a state
+    holds, rather than recording a state with bullets missing.
+    """
+    n = bullets.count
+    for owner in (0, 1):
+        slots = np.flatnonzero(bullets.owner[:n] == owner)
+        if len(slots) > BULLET_CAPACITY:
+            raise ValueError(f"Player {owner} has {len(slots)} bullets in flight, "
+                             f"a state holds {BULLET_CAPACITY}")
+        state['bullet_x'][owner, :len(slots)] = bullets.x[slots]
+        state['bullet_y'][owner, :len(slots)] = bullets.y[slots]
+        state['bullet_alive'][owner, :len(slots)] = True
+
+
+def core_state(core) -> np.void:
+    """Compact state of an AIFightClubCore"""
+    state = np.zeros((), dtype=STATE_DTYPE)
+    for side, agent in enumerate((core.agent, core.opponent)):
+        state['x'][side], state['y'][side] = agent['x'], agent['y']
+        state['health'][side] = agent['health']
+        state['last_shot'][side] = agent['last_shot']
+        state['hit_ago'][side] = core.current_time - agent['hit_time']
+    _set_bullets(state, core.bullets)
+    return state
+
+
+def agents_state(agents, bullets, now_ms: float) -> np.void:
+    """
+    Compact state of a pygame game: agents = (player 0, player 1) Agent
+    objects with millisecond timers, bullets their BulletPool
+    """
+    state = np.zeros((), dtype=STATE_DTYPE)
+    for side, agent in enumerate(agents):
+        state['x'][side], state['y'][side] = agent.x, agent.y
+        state['health'][side] = agent.health
+        state['last_shot'][side] = (now_ms - agent.last_shot) / 1000
+        state['hit_ago'][side] = (now_ms - agent.hit_time) / 1000 if agent.hit_time else np.inf
+    _set_bullets(state, bullets)
+    return state
+
+
+def _shard_paths(directory: str) -> list:
+    return sorted(glob.glob(os.path.join(directory, 'shard_*.transitions.npy')))
+
+
+class ShardWriter:
+    """
+    Writes episodes into shards of about shard_transitions transitions
+
+    :param directory: Shard directory; new shards are numbered after the
+        ones already there
+    :param grid_size: Grid size of the recorded games
+    """
+
+    def __init__(self, directory: str, grid_size: int = 20, shard_transitions: int = 1_000_000):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.shard_transitions = shard_transitions
+        metadata_path = os.path.join(directory, 'dataset.json')
+        metadata = {'grid_size': grid_size, 'bullet_capacity': BULLET_CAPACITY}
+        if os.path.exists(metadata_path):
+            with open(metadata_path) as f:
+                existing = json.load(f)
+            if existing != metadata:
+                raise ValueError(f"{directory} holds a dataset with other settings: {existing}")
+        else:
+            with open(metadata_path, 'w') as f:
+                json.dump(metadata, f)
+        self._next_shard = len(_shard_paths(directory))
+        self._states = []
+        self._transitions = []
+        self._num_states = 0
+        self._num_transitions = 0
+
+    def add_episode(self, states: np.ndarray, actions: np.ndarray, rewards: np.ndarray,
+                    terminated: bool, truncated: bool = False, players=(0,)):
+        """
+        Add an episode
+
+        :param states: (T + 1,) STATE_DTYPE states, the last one after the last step
+        :param actions: (T, len(players)) actions of the recorded players
+        :param rewards: (T, len(players)) their rewards
+        :param terminated: Whether the episode ended with a win
+        :param truncated: Whether it was cut off by the time limit
+        :param players: Players whose transitions are stored
+        """
+        steps = len(states) - 1
+        actions = np.asarray(actions).reshape(steps, len(players))
+        rewards = np.asarray(rewards).reshape(steps, len(players))
+        transitions = np.zeros((steps, len(players)), dtype=TRANSITION_DTYPE)
+        transitions['state'] = self._num_states + np.arange(steps)[:, None]
+        transitions['player'] = players
+        transitions['action'] = actions
+        transitions['reward'] = rewards
+        transitions['terminated'][-1] = terminated
+        transitions['truncated'][-1] = truncated
+        self._states.append(states)
+        self._transitions.append(transitions.reshape(-1))
+        self._num_states += len(states)
+        self._num_transitions += transitions.size
+        if self._num_transitions >= self.shard_transitions:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered episodes as a shard"""
+        if not self._transitions:
+            return
+        prefix = os.path.join(self.directory, f'shard_{self._next_shard:05d}')
+        np.save(prefix + '.states.npy', np.concatenate(self._states))
+        np.save(prefix + '.transitions.npy', np.concatenate(self._transitions))
+        self._next_shard += 1
+        self._states, self._transitions = [], []
+        self._num_states = self._num_transitions = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def shards_from_replays(replay_paths, directory: str, shard_transitions: int = 1_000_000) -> int:
+    """
+    Replay recorded matches and write the agent's transitions into shards;
+    returns the number of transitions
+    """
+    from .replay import ReplayReader
+
+    total = 0
+    writer = None
+    for path in replay_paths:
+        with ReplayReader(path) as reader:
+            if writer is None:
+                writer = ShardWriter(directory, reader.settings['grid_size'], shard_transitions)
+            # Only the states are needed, so the core builds the cheapest observation
+            core = reader.make_core(observation='features', num_nearest_bullets=1)
+            for episode in range(len(reader)):
+                records = reader.steps(episode)
+                states = np.zeros(len(records) + 1, dtype=STATE_DTYPE)
+                for step, _ in enumerate(reader.replay(episode, core, verify=False)):
+                    states[step] = core_state(core)
+                states[-1] = core_state(core)
+                terminated = bool(reader.episodes[episode]['winner'] >= 0)
+                writer.add_episode(states, records['agent_action'], records['reward'],
+                                   terminated, not terminated)
+                total += len(records)
+    if writer is not None:
+        writer.close()
+    return total
+
+
+class HumanGameRecorder:
+    """
+    Records human games of pygame_local.py / pygame_online.py into shards
+
+    Call frame() once per frame before the players' inputs are applied and
+    end() when the game is over. The players' actions are mapped to the
+    cores' actions (0 up, 1 down, 2 shoot, 3 nothing) and their rewards are
+    computed as in the cores. pygame_local.py moves bullets at its own
+    speed, so its transitions follow slightly different dynamics than the
+    simulator's; online games are simulated by the server's core, but their
+    cooldown timers are only estimated from the snapshots.
+
+    :param directory: Shard directory
+    :param players: Players whose transitions are recorded (both in a local
+        game, the local player in an online one)
+    """
+
+    def __init__(self, directory: str, players=(0, 1), grid_size: int = 20):
+        self.writer = ShardWriter(directory, grid_size)
+        self.players = tuple(players)
+        self._states = []
+        self._actions = []
+
+    @staticmethod
+    def action(up: bool, down: bool, shoot: bool) -> int:
+        """Core action for a player's pressed keys (shooting wins over moving)"""
+        return 2 if shoot else 0 if up else 1 if down else 3
+
+    def frame(self, agents, bullets, now_ms: float, actions):
+        """Record the state at the start of a frame and the players' actions (in players order)"""
+        self._states.append(agents_state(agents, bullets, now_ms))
+        self._actions.append(actions)
+
+    def end(self, agents, bullets, now_ms: float, winner=None):
+        """Record the final state and write the episode"""
+        if not self._actions:
+            return
+        states = np.array(self._states + [agents_state(agents, bullets, now_ms)], dtype=STATE_DTYPE)
+        health = states['health'].astype(np.float32)
+        lost = np.maximum(health[:-1] - health[1:], 0)  # (T, 2) lives lost per step
+        rewards = np.empty((len(lost), len(self.players)), dtype=np.float32)
+        for column, player in enumerate(self.players):
+            rewards[:, column] = -STEP_PENALTY + HIT_REWARD * lost[:, 1 - player] - HIT_PENALTY * lost[:, player]
+            if winner is not None:
+                rewards[-1, column] += WIN_REWARD if winner == player else -WIN_REWARD
+        self.writer.add_episode(states, self._actions, rewards, terminated=winner is not None,
+                                truncated=winner is None, players=self.players)
+        self._states, self._actions = [], []
+
+    def close(self):
+        self.writer.close()
+
+
+class ObservationDecoder:
+    """
+    Builds observations from compact states with the observation writers of
+    a BatchedAIFightClubCore
+
+    :param batch_size: Number of states decoded at once
+    """
+
+    def __init__(self, batch_size: int, grid_size: int = 20, observation: str = 'grid',
+                 num_nearest_bullets: int = 8):
+        from .core import BatchedAIFightClubCore
+
+        self.core = BatchedAIFightClubCore(batch_size, grid_size=grid_size, dt=1.0, autoreset=False,
+                                           observation=observation, num_nearest_bullets=num_nearest_bullets,
+                                           opponent_view=True)
+        if self.core.bullet_capacity != BULLET_CAPACITY:
+            raise ValueError(f"States hold {BULLET_CAPACITY} bullets per side, the core "
+                             f"{self.core.bullet_capacity}")
+        self.core.current_time = 0.0
+        self.core.match_time[:] = 0.0
+        self.observation_size = self.core.observation_size
+
+    def decode(self, states: np.ndarray, players: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """(n, obs_size) observations of the given states from the given players' sides"""
+        n = len(states)
+        if out is None:
+            out = np.empty((n, self.observation_size), dtype=np.float32)
+        size = self.core.num_matches
+        for start in range(0, n, size):
+            self._decode(states[start:start + size], players[start:start + size], out[start:start + size])
+        return out
+
+    def _decode(self, states: np.ndarray, players: np.ndarray, out: np.ndarray):
+        core = self.core
+        n = len(states)
+        rows = np.arange(n)
+        core.x[:n], core.y[:n] = states['x'], states['y']
+        core.health[:n] = states['health']
+        core.alive[:n] = states['health'] > 0
+        core.last_shot[:n] = states['last_shot']
+        core.hit_time[:n] = -states['hit_ago']
+        core.bullet_x[:n], core.bullet_y[:n] = states['bullet_x'], states['bullet_y']
+        core.bullet_alive[:n] = states['bullet_alive']
+
+        for player, buffer in ((0, core._obs), (1, core._opponent_obs)):
+            mine = rows[players == player]
+            if mine.size:
+                if core.observation == 'features':
+                    core._write_feature_observation(mine, player)
+                else:
+                    core._write_grid_observation(mine, player)
+                out[mine] = buffer[mine]
+
+
+class TransitionDataset:
+    """
+    Streams shuffled minibatches from a shard directory
+
+    Iterating yields one epoch of (obs, actions, rewards, next_obs, dones)
+    minibatches; dones are the terminated flags (a truncated transition
+    should still bootstrap). Shards are memory-mapped and visited in random
+    order, shards_per_group at a time, with the transitions of a group
+    shuffled together, so memory holds a group's indices and one minibatch.
+
+    :param observation: Observation encoding to build, 'grid' or 'features'
+    :param players: Only use the transitions of these players
+    """
+
+    def __init__(self, directory: str, batch_size: int = 256, observation: str = 'grid',
+                 num_nearest_bullets: int = 8, shards_per_group: int = 4, players=(0, 1),
+                 seed: int = None, drop_last: bool = True):
+        with open(os.path.join(directory, 'dataset.json')) as f:
+            self.metadata = json.load(f)
+        self.paths = _shard_paths(directory)
+        if not self.paths:
+            raise ValueError(f"No shards in {directory}")
+        self.batch_size = batch_size
+        self.shards_per_group = shards_per_group
+        self.players = np.asarray(players)
+        self.drop_last = drop_last
+        self.np_random = np.random.default_rng(seed)
+        self.decoder = ObservationDecoder(batch_size, self.metadata['grid_size'], observation,
+                                          num_nearest_bullets)
+        self.observation_size = self.decoder.observation_size
+
+    def _load(self, path: str) -> tuple:
+        transitions = np.load(path, mmap_mode='r')
+        states = np.load(path.replace('.transitions.npy', '.states.npy'), mmap_mode='r')
+        return transitions, states
+
+    def __len__(self) -> int:
+        """Number of transitions (of all players)"""
+        return sum(len(np.load(path, mmap_mode='r')) for path in self.paths)
+
+    def __iter__(self):
+        order = self.np_random.permutation(len(self.paths))
+        for start in range(0, len(order), self.shards_per_group):
+            shards = [self._load(self.paths[i]) for i in order[start:start + self.shards_per_group]]
+            # (shard, transition) of the group's usable transitions, shuffled
+            index = np.concatenate([
+                np.stack([np.full(len(selected), shard), selected], axis=1)
+                for shard, selected in enumerate(
+                    np.flatnonzero(np.isin(transitions['player'], self.players)) for transitions, _ in shards)
+            ])
+            index = index[self.np_random.permutation(len(index))]
+            for batch_start in range(0, len(index), self.batch_size):
+                batch = index[batch_start:batch_start + self.batch_size]
+                if self.drop_last and len(batch) < self.batch_size:
+                    break
+                yield self._batch(shards, batch)
+
+    def _batch(self, shards: list, batch: np.ndarray) -> tuple:
+        # Gather in sorted order per shard so the memory maps are read sequentially
+        transitions = np.empty(len(batch), dtype=TRANSITION_DTYPE)
+        states = np.empty(len(batch), dtype=STATE_DTYPE)
+        next_states = np.empty(len(batch), dtype=STATE_DTYPE)
+        for shard, (shard_transitions, shard_states) in enumerate(shards):
+            rows = np.flatnonzero(batch[:, 0] == shard)
+            if not rows.size:
+                continue
+            order = np.argsort(batch[rows, 1])
+            rows = rows[order]
+            transitions[rows] = shard_transitions[batch[rows, 1]]
+            state_index = transitions['state'][rows]
+            states[rows] = shard_states[state_index]
+            next_states[rows] = shard_states[state_index + 1]
+        players = transitions['player']
+        observations = self.decoder.decode(states, players)
+        next_observations = self.decoder.decode(next_states, players)
+        return (observations, transitions['action'].astype(np.int64), transitions['reward'],
+                next_observations, transitions['terminated'])
+
+
+def pretrain_policy(model, dataset: TransitionDataset, epochs: int = 1, learning_rate: float = 3e-4,
+                    verbose: int = 1) -> list:
+    """
+    Behavior cloning: fit a PPO model's policy to the recorded actions by
+    maximizing their log-likelihood; returns the mean loss per epoch
+    """
+    import torch
+
+    policy = model.policy
+    if dataset.observation_size != policy.observation_space.shape[0]:
+        raise ValueError("The dataset's observation encoding does not match the model's")
+    optimizer = torch.optim.Adam(policy.parameters(), lr=learning_rate)
+    policy.set_training_mode(True)
+    losses = []
+    for epoch in range(epochs):
+        total, batches = 0.0, 0
+        for observations, actions, _, _, _ in dataset:
+            observations = torch.as_tensor(observations, device=policy.device)
+            actions = torch.as_tensor(actions, device=policy.device)
+            distribution = policy.get_distribution(observations)
+            loss = -distribution.log_prob(actions).mean()
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total += loss.item()
+            batches += 1
+        losses.append(total / max(batches, 1))
+        if verbose:
+            print(f"Pretraining epoch {epoch + 1}/{epochs}: loss {losses[-1]:.4f} ({batches} batches)")
+    policy.set_training_mode(False)
+    return losses
+
+
+# ==================== MAIN EXECUTION ====================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='write the transitions of replay files into shards')
+    build_parser.add_argument('directory')
+    build_parser.add_argument('replays', nargs='+')
+    build_parser.add_argument('--shard-transitions', type=int, default=1_000_000)
+
+    info_parser = subparsers.add_parser('info', help='summarize a shard directory')
+    info_parser.add_argument('directory')
+
+    args = parser.parse_args()
+    if args.command == 'build':
+        count = shards_from_replays(args.replays, args.directory, args.shard_transitions)
+        print(f"Wrote {count} transitions to {args.directory}")
+    else:
+        paths = _shard_paths(args.directory)
+        transitions = [np.load(path, mmap_mode='r') for path in paths]
+        size = sum(os.path.getsize(path) + os.path.getsize(path.replace('.transitions.', '.states.'))
+                   for path in paths)
+        count = sum(len(t) for t in transitions)
+        print(f"{len(paths)} shards, {count} transitions, {size / 2**20:.1f} MB "
+              f"({size / max(count, 1):.0f} bytes/transition)")
@@ -1,7 +1,7 @@
 import gymnasium as gym
 from gymnasium import spaces
 import numpy as np
-from game.core import AIFightClubCore
+from .core import AIFightClubCore
 
 class AIFightClubEnv(gym.Env):
     """Enhanced environment with proper episode tracking"""
@@ -1,37 +1,45 @@
-import time
-import pygame
-from colors import Colors
+from .colors import Colors
 import numpy as np
-from agent import Agent
-from bullet import Bullet
+from .agent import Agent
+from .bullet import draw_bullets
+from .bullet_pool import BulletPool
+from .clock import TickClock
 
 class GridGame():
+    """
+    Grid version of the game built from Agent and BulletPool
     
-    def __init__(self, grid_size = 20, cell_size = 30, render=False):
+    Game time comes from clock (by default a TickClock advanced once per
+    step), not from pygame, so without render the game runs headless and as
+    fast as it is stepped. pygame is only imported and initialized when
+    rendering.
+    """
+    
+    def __init__(self, grid_size = 20, cell_size = 30, render=False, clock=None):
         self.grid_size = grid_size
         self.cell_size = cell_size
         self.render = render
         self.colors = Colors
+        self.clock = clock if clock is not None else TickClock()  # Any object with tick() and get_ticks() in ms
 
-        # TODO
-        self.agent = Agent(3, 10, Colors['agent1'], dx = 1, player_id = 0)
-        self.opponent = Agent(16,10, (0,0,255), dx=-1, player_id = 1)
-        self.done = False
-        self.winner = None
-        self.step_count = 0
+        self.bullets = BulletPool(grid_size = grid_size)
+        self.reset()
 
         if self.render:
             self._init_pygame()
 
     def _init_pygame(self):
+        import pygame
         pygame.init()
         self.screen = pygame.display.set_mode((self.grid_size * self.cell_size,
                                               self.grid_size * self.cell_size))
         pygame.display.set_caption("AI Fight CLub")
-        self.clock = pygame.time.Clock()
+        self.frame_clock = pygame.time.Clock()
         self.font = pygame.font.SysFont("Arial", 24, bold = True)
+        self.bullet_img = self._load_bullet_image()
 
     def _load_bullet_image(self):
+        import pygame
         try:
             import os
             asset_path = os.path.join(os.path.dirname(__file__), 'assets')
@@ -47,8 +55,10 @@ class GridGame():
 
     def reset(self):
         """Reset the game to initial state"""
-        self.agent = Agent(3, 10, self.colors.agent1, dx=1, player_id=0)
-        self.opponent = Agent(16, 10, self.colors.agent2, dx=-1, player_id=1)
+        self.bullets.clear()
+        self.clock.reset()
+        self.agent = Agent(3, 10, self.colors['agent1'], dx=1, player_id=0, bullets=self.bullets, clock=self.clock)
+        self.opponent = Agent(16, 10, self.colors['agent2'], dx=-1, player_id=1, bullets=self.bullets, clock=self.clock)
         self.done = False
         self.winner = None
         self.step_count = 0
@@ -65,6 +75,8 @@ class GridGame():
         Returns:
             state, reward, done, info
         """
+        self.clock.tick()
+        
         # Process actions
         self._process_action(self.agent, agent_action)
         
@@ -99,7 +111,7 @@ class GridGame():
         elif action == 1:  # MOVE DOWN
             agent.move(1, self.grid_size)
         elif action == 2:  # SHOOT
-            agent.shoot(self.bullet_img, self.cell_size)
+            agent.shoot()
         # action 3: DO_NOTHING
     
     def _default_opponent_behavior(self):
@@ -108,31 +120,27 @@ class GridGame():
             self.opponent.move(1, self.grid_size)
         elif self.opponent.y > self.agent.y:
             self.opponent.move(-1, self.grid_size)
-        elif pygame.time.get_ticks() - self.opponent.last_shot > self.opponent.shot_cooldown:
-            self.opponent.shoot(self.bullet_img, self.cell_size)
+        elif self.clock.get_ticks() - self.opponent.last_shot > self.opponent.shot_cooldown:
+            self.opponent.shoot()
     
     def _update_bullets(self):
-        """Update bullet positions"""
-        self.agent.update_bullets(self.screen if self.render else None)
-        self.opponent.update_bullets(self.screen if self.render else None)
+        """Update bullet positions and remove off-screen bullets"""
+        self.bullets.advance()
+        self.bullets.cull(self.grid_size)
     
     def _check_collisions(self):
         """Check for bullet collisions"""
         # Check if agent bullets hit opponent
-        for bullet in self.agent.bullets[:]:
-            if self.opponent.check_bullet_collision(bullet):
-                self.agent.bullets.remove(bullet)
-                if not self.opponent.alive:
-                    self.done = True
-                    self.winner = self.agent.player_id
+        if self.opponent.check_bullet_collision(self.agent.player_id):
+            if not self.opponent.alive:
+                self.done = True
+                self.winner = self.agent.player_id
         
         # Check if opponent bullets hit agent
-        for bullet in self.opponent.bullets[:]:
-            if self.agent.check_bullet_collision(bullet):
-                self.opponent.bullets.remove(bullet)
-                if not self.agent.alive:
-                    self.done = True
-                    self.winner = self.opponent.player_id
+        if self.agent.check_bullet_collision(self.opponent.player_id):
+            if not self.agent.alive:
+                self.done = True
+                self.winner = self.opponent.player_id
     
     def _get_state(self):
         """Convert game state to numerical representation for AI"""
@@ -147,17 +155,12 @@ class GridGame():
         if self.opponent.alive:
             state[self.opponent.y, self.opponent.x, 1] = 1.0
         
-        # Channel 2: Agent bullets
-        for bullet in self.agent.bullets:
-            x, y = int(bullet.x), int(bullet.y)
-            if 0 <= x < self.grid_size and 0 <= y < self.grid_size:
-                state[y, x, 2] = 1.0
-        
-        # Channel 3: Opponent bullets
-        for bullet in self.opponent.bullets:
-            x, y = int(bullet.x), int(bullet.y)
-            if 0 <= x < self.grid_size and 0 <= y < self.grid_size:
-                state[y, x, 3] = 1.0
+        # Channels 2/3: Agent and opponent bullets (the pool only holds on-screen bullets)
+        n = self.bullets.count
+        if n:
+            x = self.bullets.x[:n].astype(np.int64)
+            y = self.bullets.y[:n].astype(np.int64)
+            state[y, x, 2 + self.bullets.owner[:n]] = 1.0
         
         # Flatten and add health information
         grid_state = state.flatten()
@@ -190,6 +193,7 @@ class GridGame():
         """Render the game state"""
         if not self.render:
             return
+        import pygame
         
         # Handle events
         for event in pygame.event.get():
@@ -197,27 +201,28 @@ class GridGame():
                 self.done = True
         
         # Draw background
-        self.screen.fill(self.colors.background)
+        self.screen.fill(self.colors['background'])
         
         # Draw grid
         for x in range(self.grid_size):
             for y in range(self.grid_size):
                 rect = pygame.Rect(x * self.cell_size, y * self.cell_size, 
                                  self.cell_size, self.cell_size)
-                pygame.draw.rect(self.screen, self.colors.grid, rect, 1)
+                pygame.draw.rect(self.screen, self.colors['grid'], rect, 1)
         
         # Draw agents and bullets
-        self.agent.draw(self.screen, self.cell_size, self.colors.__dict__)
-        self.opponent.draw(self.screen, self.cell_size, self.colors.__dict__)
-        self._update_bullets()  # This also draws bullets
+        self.agent.draw(self.screen, self.cell_size)
+        self.opponent.draw(self.screen, self.cell_size)
+        draw_bullets(self.screen, self.bullets, self.bullet_img, self.cell_size)
         
         # Update display
         pygame.display.flip()
-        self.clock.tick(30)
+        self.frame_clock.tick(30)
     
     def close(self):
         """Clean up resources"""
         if self.render:
+            import pygame
             pygame.quit()
         
     
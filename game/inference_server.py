@@ -0,0 +1,233 @@
+"""
+Batched opponent-policy inference shared by all rollout workers
+
+Instead of every worker process holding its own copy of the opponent network
+and running batch-1 forward passes, one InferenceServer owns the policy and
+the workers query it through InferenceClients. The server queues incoming
+requests and runs one forward pass per micro-batch: a batch is flushed as
+soon as every connected client is waiting, when it reaches max_batch_size
+observations, or when its oldest request has waited max_latency seconds.
+
+Clients only carry the server's address, so they can be pickled into worker
+processes (e.g. inside the env factories of SubprocVecEnv); each one
+connects on first use.
+"""
+
+import os
+import threading
+import time
+from multiprocessing.connection import Listener, Client, wait
+
+import numpy as np
+from stable_baselines3 import PPO
+
+# How often the serving loop looks for new connections and the stop flag
+_POLL_INTERVAL = 0.05
+
+
+class InferenceClient:
+    """
+    Handle for querying an InferenceServer, created by InferenceServer.client()
+
+    predict() takes one observation and returns one action, or a batch of
+    observations and returns an array of actions.
+    """
+
+    def __init__(self, address, authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+        self._connection = None
+
+    def __getstate__(self):
+        # Connections are per process; a copy connects again on first use
+        return {'address': self.address, 'authkey': self.authkey, '_connection': None}
+
+    def predict(self, observation: np.ndarray):
+        if self._connection is None:
+            self._connection = Client(self.address, authkey=self.authkey)
+        observation = np.ascontiguousarray(observation, dtype=np.float32)
+        self._connection.send_bytes(observation)
+        actions = np.frombuffer(self._connection.recv_bytes(), dtype=np.int64)
+        return actions if observation.ndim > 1 else int(actions[0])
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class InferenceServer:
+    """
+    Serves a policy's actions to InferenceClients in micro-batches from a
+    background thread
+
+    :param policy: SB3 policy, PPO model or path of a saved PPO model
+    :param max_batch_size: Observations per forward pass at most
+    :param max_latency: Seconds a request may wait for its batch to fill up
+    :param deterministic: Whether to return the most likely actions
+    :param device: Device the policy is loaded on when given a path
+    """
+
+    def __init__(self, policy, max_batch_size: int = 256, max_latency: float = 0.002,
+                 deterministic: bool = False, device: str = 'cpu'):
+        if isinstance(policy, (str, os.PathLike)):
+            policy = PPO.load(policy, device=device)
+        self.policy = getattr(policy, 'policy', policy)
+        self.policy.set_training_mode(False)
+        self.observation_size = int(np.prod(self.policy.observation_space.shape))
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.deterministic = deterministic
+
+        self._authkey = os.urandom(16)
+        self._listener = Listener(authkey=self._authkey)
+        self._connections = []
+        self._new_connections = []  # Accepted but not yet picked up by the serving loop
+        self._lock = threading.Lock()
+        self._running = False
+        self._threads = []
+        self._reset_stats()
+
+    @property
+    def address(self):
+        return self._listener.address
+
+    def client(self) -> InferenceClient:
+        """Create a client for this server; it can be handed to other processes"""
+        return InferenceClient(self.address, self._authkey)
+
+    def start(self) -> 'InferenceServer':
+        """Start accepting and serving requests in background threads"""
+        self._running = True
+        self._threads = [threading.Thread(target=self._accept, daemon=True),
+                         threading.Thread(target=self._serve, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close all connections"""
+        self._running = False
+        # Closing the listener does not interrupt a blocking accept(), a connection does
+        Client(self.address, authkey=self._authkey).close()
+        for thread in self._threads:
+            thread.join()
+        self._listener.close()
+        for connection in self._connections + self._new_connections:
+            connection.close()
+        self._connections, self._new_connections, self._threads = [], [], []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stats(self, reset: bool = True) -> dict:
+        """
+        Batch size and latency statistics since the last reset
+
+        queue latency is the time from a request arriving to its batch's
+        forward pass starting; forward is the time of the pass itself.
+        """
+        with self._lock:
+            batch_sizes = np.asarray(self._batch_sizes, dtype=np.int64)
+            queue = np.asarray(self._queue_latencies) * 1e6
+            forward = np.asarray(self._forward_times) * 1e6
+            if reset:
+                self._reset_stats()
+        if not batch_sizes.size:
+            return {'batches': 0, 'requests': 0}
+        p50, p99 = np.percentile(queue, [50, 99])
+        return {
+            'batches': int(batch_sizes.size),
+            'requests': int(queue.size),
+            'observations': int(batch_sizes.sum()),
+            'batch_size_mean': float(batch_sizes.mean()),
+            'batch_size_max': int(batch_sizes.max()),
+            'queue_latency_p50_us': float(p50),
+            'queue_latency_p99_us': float(p99),
+            'forward_mean_us': float(forward.mean()),
+        }
+
+    def _reset_stats(self):
+        self._batch_sizes = []
+        self._queue_latencies = []
+        self._forward_times = []
+
+    def _accept(self):
+        """Accept client connections until the listener is closed"""
+        while self._running:
+            try:
+                connection = self._listener.accept()
+            except OSError:
+                break
+            if not self._running:
+                connection.close()
+                break
+            with self._lock:
+                self._new_connections.append(connection)
+
+    def _serve(self):
+        """Collect requests into batches and answer them"""
+        pending = []  # (connection, observations, arrival time) in arrival order
+        waiting = set()  # Connections with a pending request
+        while self._running:
+            with self._lock:
+                if self._new_connections:
+                    self._connections += self._new_connections
+                    self._new_connections = []
+
+            # Wait for requests until the oldest pending one is due
+            timeout = _POLL_INTERVAL
+            if pending:
+                timeout = max(pending[0][2] + self.max_latency - time.perf_counter(), 0.0)
+            idle = [connection for connection in self._connections if connection not in waiting]
+            if idle:
+                ready = wait(idle, timeout)
+            else:
+                time.sleep(timeout)
+                ready = []
+            for connection in ready:
+                try:
+                    data = connection.recv_bytes()
+                except (EOFError, OSError):
+                    self._connections.remove(connection)
+                    continue
+                observations = np.frombuffer(data, dtype=np.float32).reshape(-1, self.observation_size)
+                pending.append((connection, observations, time.perf_counter()))
+                waiting.add(connection)
+
+            if not pending:
+                continue
+            size = sum(len(observations) for _, observations, _ in pending)
+            if (len(waiting) >= len(self._connections) or size >= self.max_batch_size or
+                    time.perf_counter() - pending[0][2] >= self.max_latency):
+                # Forward passes of at most max_batch_size observations (or one request)
+                while pending:
+                    batch, size = [], 0
+                    while pending and (not batch or size + len(pending[0][1]) <= self.max_batch_size):
+                        batch.append(pending.pop(0))
+                        size += len(batch[-1][1])
+                    self._flush(batch)
+                waiting.clear()
+
+    def _flush(self, batch: list):
+        """Run one forward pass over a batch of requests and send back the actions"""
+        start = time.perf_counter()
+        observations = np.concatenate([observations for _, observations, _ in batch])
+        actions, _ = self.policy.predict(observations, deterministic=self.deterministic)
+        actions = np.asarray(actions, dtype=np.int64)
+        forward = time.perf_counter() - start
+        with self._lock:
+            self._batch_sizes.append(len(observations))
+            self._queue_latencies.extend(start - arrival for _, _, arrival in batch)
+            self._forward_times.append(forward)
+
+        offset = 0
+        for connection, request, _ in batch:
+            try:
+                connection.send_bytes(actions[offset:offset + len(request)])
+            except OSError:
+                pass  # The client went away; its connection is dropped on the next read
+            offset += len(request)
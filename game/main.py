@@ -1,4 +1,4 @@
-from game import GridGame
+from .game import GridGame
 
 WINDOW_WIDTH, WINDOW_HEIGHT = 1200, 800
 FPS = 60
@@ -0,0 +1,375 @@
+"""
+Compact binary recordings of AIFightClubCore matches
+
+Instead of observations (1602 floats per step for the grid encoding), a
+replay stores one 13-byte record per step: both actions, both agents'
+positions and health, the bullets each side spawned and the reward. The
+core is deterministic for a fixed dt and seed, so an episode is replayed by
+resetting a core with the episode's seed and feeding it the recorded
+actions, which re-derives the observations in any encoding on demand.
+
+File layout (append-only, little-endian):
+    header   MAGIC, u32 length, JSON core settings
+    chunk    CHUNK_MAGIC, u32 episodes, u32 raw bytes, u32 compressed bytes,
+             the chunk's EPISODE_DTYPE table, zlib-compressed STEP_DTYPE records
+    ...
+    footer   INDEX_MAGIC, EPISODE_DTYPE table of all episodes, u64 footer
+             offset, INDEX_MAGIC (rewritten when the file is closed)
+
+The footer is the episode index. A file that was not closed can still be
+read: its chunks are scanned instead.
+
+Run from the repository root:
+    python -m game.replay record games.afcr --episodes 10000 [--model best_model.zip]
+    python -m game.replay info games.afcr
+"""
+
+import argparse
+import json
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from .core import DEFAULT_DT, AIFightClubCore
+
+MAGIC = b'AFCREPL1'
+CHUNK_MAGIC = b'CHNK'
+INDEX_MAGIC = b'AFCINDEX'
+
+# opponent_action of steps played by the scripted opponent
+SCRIPTED = 255
+
+# One record per step, with the state after the step
+STEP_DTYPE = np.dtype([
+    ('agent_action', 'u1'), ('opponent_action', 'u1'),
+    ('agent_x', 'u1'), ('agent_y', 'u1'), ('opponent_x', 'u1'), ('opponent_y', 'u1'),
+    ('agent_health', 'i1'), ('opponent_health', 'i1'),
+    ('spawns', 'u1'),  # Bullets spawned during the step: agent's in the low nibble, opponent's in the high
+    ('reward', '<f4'),
+])
+
+# One entry per episode; offset is the file offset of its chunk and start
+# the index of its first record in the chunk
+EPISODE_DTYPE = np.dtype([
+    ('seed', '<i8'), ('steps', '<u4'), ('winner', 'i1'), ('reward', '<f4'),
+    ('offset', '<u8'), ('start', '<u4'),
+])
+
+# Settings a core must be created with to replay a file
+CORE_SETTINGS = ('grid_size', 'dt', 'frame_skip', 'observation', 'num_nearest_bullets')
+
+_CHUNK_HEADER = struct.Struct('<4sIII')
+_FOOTER_END = struct.Struct('<Q8s')
+
+
+def core_settings(core: AIFightClubCore) -> dict:
+    """The settings of a core that a replay file records"""
+    if core.dt is None:
+        raise ValueError("Only cores with a fixed dt can be replayed")
+    return {name: getattr(core, name) for name in CORE_SETTINGS}
+
+
+def _read_header(f) -> dict:
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{f.name} is not a replay file")
+    length, = struct.unpack('<I', f.read(4))
+    return json.loads(f.read(length))
+
+
+def _read_index(f, data_start: int) -> tuple:
+    """Return (episodes, end of the last chunk), from the footer or by scanning the chunks"""
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    if size >= data_start + _FOOTER_END.size:
+        f.seek(size - _FOOTER_END.size)
+        footer, magic = _FOOTER_END.unpack(f.read(_FOOTER_END.size))
+        if magic == INDEX_MAGIC:
+            f.seek(footer + len(INDEX_MAGIC))
+            count = (size - _FOOTER_END.size - f.tell()) // EPISODE_DTYPE.itemsize
+            return np.frombuffer(f.read(count * EPISODE_DTYPE.itemsize), dtype=EPISODE_DTYPE).copy(), footer
+
+    # No footer: scan the chunks, ignoring a chunk that was cut off
+    tables = []
+    offset = data_start
+    while offset + _CHUNK_HEADER.size <= size:
+        f.seek(offset)
+        magic, count, _, compressed = _CHUNK_HEADER.unpack(f.read(_CHUNK_HEADER.size))
+        end = offset + _CHUNK_HEADER.size + count * EPISODE_DTYPE.itemsize + compressed
+        if magic != CHUNK_MAGIC or end > size:
+            break
+        tables.append(np.frombuffer(f.read(count * EPISODE_DTYPE.itemsize), dtype=EPISODE_DTYPE))
+        offset = end
+    episodes = np.concatenate(tables) if tables else np.zeros(0, dtype=EPISODE_DTYPE)
+    return episodes, offset
+
+
+class ReplayWriter:
+    """
+    Appends episodes to a replay file in compressed chunks
+
+    :param path: Replay file; an existing one is appended to and must have
+        been written with the same settings
+    :param settings: Core settings (see core_settings)
+    :param chunk_steps: Steps buffered before they are compressed and written
+    :param level: zlib compression level
+    """
+
+    def __init__(self, path: str, settings: dict, chunk_steps: int = 1 << 16, level: int = 6):
+        self.settings = dict(settings)
+        self.chunk_steps = chunk_steps
+        self.level = level
+        self._pending = []  # (seed, records, winner) of episodes not written yet
+        self._pending_steps = 0
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            self._file = open(path, 'r+b')
+            existing = _read_header(self._file)
+            if existing != self.settings:
+                self._file.close()
+                raise ValueError(f"{path} was recorded with other settings: {existing}")
+            tables, end = _read_index(self._file, self._file.tell())
+            self._episodes = [tables]
+            self._file.seek(end)
+            self._file.truncate()
+        else:
+            self._file = open(path, 'wb')
+            header = json.dumps(self.settings).encode()
+            self._file.write(MAGIC + struct.pack('<I', len(header)) + header)
+            self._episodes = []
+
+    def add_episode(self, seed: int, records: np.ndarray, winner):
+        """Add an episode: the seed its core was reset with and its STEP_DTYPE records"""
+        self._pending.append((seed, records, -1 if winner is None else winner))
+        self._pending_steps += len(records)
+        if self._pending_steps >= self.chunk_steps:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered episodes as one chunk"""
+        if not self._pending:
+            return
+        table = np.zeros(len(self._pending), dtype=EPISODE_DTYPE)
+        table['offset'] = self._file.tell()
+        start = 0
+        for entry, (seed, records, winner) in zip(table, self._pending):
+            entry['seed'], entry['steps'], entry['winner'] = seed, len(records), winner
+            entry['reward'], entry['start'] = records['reward'].sum(dtype=np.float64), start
+            start += len(records)
+        raw = np.concatenate([records for _, records, _ in self._pending]).tobytes()
+        compressed = zlib.compress(raw, self.level)
+        self._file.write(_CHUNK_HEADER.pack(CHUNK_MAGIC, len(table), len(raw), len(compressed)))
+        self._file.write(table.tobytes())
+        self._file.write(compressed)
+        self._episodes.append(table)
+        self._pending, self._pending_steps = [], 0
+
+    def close(self):
+        """Write the remaining episodes and the index"""
+        if self._file.closed:
+            return
+        self.flush()
+        footer = self._file.tell()
+        self._file.write(INDEX_MAGIC)
+        for table in self._episodes:
+            self._file.write(table.tobytes())
+        self._file.write(_FOOTER_END.pack(footer, INDEX_MAGIC))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ReplayRecorder:
+    """
+    Records the matches played on an AIFightClubCore
+
+    Use reset() and step() instead of the core's; every episode goes to the
+    writer when it ends. An episode must start with a reset with an explicit
+    seed, which is what makes it replayable.
+    """
+
+    def __init__(self, core: AIFightClubCore, writer: ReplayWriter):
+        if core_settings(core) != writer.settings:
+            raise ValueError("The core's settings differ from the replay file's")
+        self.core = core
+        self.writer = writer
+        self._seed = None
+        self._records = []
+        self._spawned = (0, 0)
+
+    def reset(self, seed: int, out: np.ndarray = None) -> np.ndarray:
+        self._seed = int(seed)
+        self._records = []
+        self._spawned = (0, 0)
+        return self.core.reset(seed=self._seed, out=out)
+
+    def step(self, agent_action: int, opponent_action: int = None, out: np.ndarray = None) -> tuple:
+        if self._seed is None:
+            raise RuntimeError("Call reset() with a seed before recording steps")
+        result = self.core.step(agent_action, opponent_action, out=out)
+        _, reward, terminated, truncated, _ = result
+
+        agent, opponent = self.core.agent, self.core.opponent
+        spawned = (agent['bullets_spawned'], opponent['bullets_spawned'])
+        self._records.append((
+            agent_action, SCRIPTED if opponent_action is None else opponent_action,
+            agent['x'], agent['y'], opponent['x'], opponent['y'],
+            agent['health'], opponent['health'],
+            (spawned[0] - self._spawned[0]) | (spawned[1] - self._spawned[1]) << 4,
+            reward,
+        ))
+        self._spawned = spawned
+
+        if terminated or truncated:
+            self.writer.add_episode(self._seed, np.array(self._records, dtype=STEP_DTYPE), self.core.winner)
+            self._seed = None
+        return result
+
+
+class ReplayReader:
+    """
+    Reads a replay file and replays its episodes
+
+    episodes is the index: one EPISODE_DTYPE entry (seed, steps, winner,
+    total reward, ...) per episode, so episodes can be selected without
+    decompressing anything.
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        self.settings = _read_header(self._file)
+        self.episodes, _ = _read_index(self._file, self._file.tell())
+        self._chunk_offset = None  # The last decompressed chunk is cached
+        self._chunk = None
+
+    def __len__(self) -> int:
+        return len(self.episodes)
+
+    def steps(self, episode: int) -> np.ndarray:
+        """STEP_DTYPE records of an episode"""
+        entry = self.episodes[episode]
+        if entry['offset'] != self._chunk_offset:
+            self._file.seek(int(entry['offset']))
+            _, count, _, compressed = _CHUNK_HEADER.unpack(self._file.read(_CHUNK_HEADER.size))
+            self._file.seek(count * EPISODE_DTYPE.itemsize, os.SEEK_CUR)
+            self._chunk = np.frombuffer(zlib.decompress(self._file.read(compressed)), dtype=STEP_DTYPE)
+            self._chunk_offset = entry['offset']
+        start = int(entry['start'])
+        return self._chunk[start:start + int(entry['steps'])]
+
+    def make_core(self, **overrides) -> AIFightClubCore:
+        """A core with the recorded settings; overrides may change the observation encoding"""
+        return AIFightClubCore(**{**self.settings, **overrides})
+
+    def replay(self, episode: int, core: AIFightClubCore = None, verify: bool = True):
+        """
+        Re-simulate an episode, yielding (observation before the step, record)
+        per step
+
+        With verify, the simulated positions and health are checked against
+        the records and a RuntimeError is raised where they diverge.
+        """
+        core = core if core is not None else self.make_core()
+        observation = core.reset(seed=int(self.episodes[episode]['seed']))
+        for step, record in enumerate(self.steps(episode)):
+            yield observation, record
+            opponent_action = record['opponent_action']
+            observation = core.step(int(record['agent_action']),
+                                    None if opponent_action == SCRIPTED else int(opponent_action))[0]
+            if verify and (core.agent['y'], core.opponent['y'], core.agent['health'],
+                           core.opponent['health']) != (record['agent_y'], record['opponent_y'],
+                                                        record['agent_health'], record['opponent_health']):
+                raise RuntimeError(f"Replay of episode {episode} diverged at step {step}")
+
+    def observations(self, episode: int, core: AIFightClubCore = None) -> np.ndarray:
+        """
+        (steps + 1, obs_size) observations of an episode, the last one being
+        the terminal observation
+        """
+        core = core if core is not None else self.make_core()
+        out = np.empty((int(self.episodes[episode]['steps']) + 1, core.observation_size), dtype=np.float32)
+        step = -1
+        for step, (observation, _) in enumerate(self.replay(episode, core)):
+            out[step] = observation
+        out[step + 1] = core._get_observation()
+        return out
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def record(path: str, episodes: int, model: str = None, seed: int = 0,
+           observation: str = 'grid', frame_skip: int = 1) -> dict:
+    """
+    Record episodes of a saved model (or a random agent) against the scripted
+    opponent and return size statistics
+    """
+    policy = None
+    if model is not None:
+        from stable_baselines3 import PPO
+        policy = PPO.load(model, device='cpu').policy
+    core = AIFightClubCore(dt=DEFAULT_DT, seed=seed, observation=observation, frame_skip=frame_skip)
+    rng = np.random.default_rng(seed)
+    steps = 0
+    with ReplayWriter(path, core_settings(core)) as writer:
+        recorder = ReplayRecorder(core, writer)
+        for episode in range(episodes):
+            observation = recorder.reset(seed=seed + episode)
+            while True:
+                if policy is None:
+                    action = int(rng.integers(4))
+                else:
+                    action = int(policy.predict(observation)[0])
+                observation, _, terminated, truncated, _ = recorder.step(action)
+                steps += 1
+                if terminated or truncated:
+                    break
+    size = os.path.getsize(path)
+    return {'episodes': episodes, 'steps': steps, 'bytes': size, 'bytes_per_step': size / steps,
+            'observation_bytes': steps * core.observation_size * 4}
+
+
+# ==================== MAIN EXECUTION ====================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser('record', help='record episodes against the scripted opponent')
+    record_parser.add_argument('path')
+    record_parser.add_argument('--episodes', type=int, default=1000)
+    record_parser.add_argument('--model', help='saved model playing the agent (default: random actions)')
+    record_parser.add_argument('--seed', type=int, default=0)
+    record_parser.add_argument('--observation', choices=('grid', 'features'), default='grid')
+    record_parser.add_argument('--frame-skip', type=int, default=1)
+
+    info_parser = subparsers.add_parser('info', help='summarize a replay file')
+    info_parser.add_argument('path')
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        stats = record(args.path, args.episodes, model=args.model, seed=args.seed,
+                       observation=args.observation, frame_skip=args.frame_skip)
+        print(f"{stats['episodes']} episodes, {stats['steps']} steps: {stats['bytes'] / 2**20:.2f} MB "
+              f"({stats['bytes_per_step']:.2f} bytes/step, observations would take "
+              f"{stats['observation_bytes'] / 2**20:.0f} MB)")
+    else:
+        with ReplayReader(args.path) as reader:
+            episodes = reader.episodes
+            print(f"settings: {reader.settings}")
+            print(f"{len(episodes)} episodes, {int(episodes['steps'].sum())} steps, "
+                  f"{os.path.getsize(args.path) / 2**20:.2f} MB")
+            if len(episodes):
+                print(f"win rate {np.mean(episodes['winner'] == 0):.1%}, "
+                      f"mean length {episodes['steps'].mean():.1f}, "
+                      f"mean reward {episodes['reward'].mean():.2f}")
@@ -0,0 +1,151 @@
+"""
+Self-play against a league of frozen past policies
+
+The opponent side of every match is played by a policy drawn from an
+OpponentPool of past versions of the learner, loaded from saved checkpoints
+(best_model.zip, final_model.zip, ...) or snapshotted during training. The
+wrapped vec env must be created with self_play=True, so that every
+observation holds the agent's and the opponent's view of the match and every
+action is an (agent, opponent) pair. SelfPlayVecEnv hides the opponent from
+the learner: it passes on the agent's half of each observation and fills in
+the opponents' actions with one batched forward pass per opponent policy in
+play, instead of one predict() call per env.
+"""
+
+import copy
+import os
+
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3 import PPO
+from stable_baselines3.common.vec_env import VecEnvWrapper
+
+
+class OpponentPool:
+    """
+    Frozen past policies that self-play opponents are drawn from
+
+    :param checkpoints: Paths of saved models to start the pool with
+    :param max_size: Number of policies kept; the oldest are dropped first
+    :param latest_prob: Probability of drawing the newest policy; otherwise an
+        opponent is drawn uniformly from the whole pool
+    :param seed: Seed for drawing opponents
+    :param device: Device the opponent policies run on
+    """
+
+    def __init__(self, checkpoints=(), max_size: int = 10, latest_prob: float = 0.5,
+                 seed: int = None, device: str = 'cpu'):
+        self.max_size = max_size
+        self.latest_prob = latest_prob
+        self.device = device
+        self.np_random = np.random.default_rng(seed)
+        self.keys = []  # Keys of the policies in the pool, oldest first
+        self.policies = {}  # key -> policy
+        self.names = {}  # key -> name, kept for policies that were dropped
+        self._next_key = 0
+        for path in checkpoints:
+            self.add_checkpoint(path)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add_checkpoint(self, path: str, name: str = None) -> int:
+        """Load the policy of a saved model into the pool and return its key"""
+        policy = PPO.load(path, device=self.device).policy
+        return self._add(policy, name or os.path.splitext(os.path.basename(path))[0])
+
+    def add_policy(self, policy, name: str) -> int:
+        """Add a frozen copy of a live policy (e.g. the learner's) and return its key"""
+        return self._add(copy.deepcopy(policy).to(self.device), name)
+
+    def _add(self, policy, name: str) -> int:
+        policy.set_training_mode(False)
+        policy.requires_grad_(False)
+        key = self._next_key
+        self._next_key += 1
+        self.keys.append(key)
+        self.policies[key] = policy
+        self.names[key] = name
+        if len(self.keys) > self.max_size:
+            del self.policies[self.keys.pop(0)]
+        return key
+
+    def sample(self, n: int) -> np.ndarray:
+        """Draw the keys of n opponents"""
+        if not self.keys:
+            raise RuntimeError("The opponent pool is empty")
+        keys = np.asarray(self.keys)
+        drawn = keys[self.np_random.integers(len(keys), size=n)]
+        return np.where(self.np_random.random(n) < self.latest_prob, keys[-1], drawn)
+
+
+class SelfPlayVecEnv(VecEnvWrapper):
+    """
+    Plays the opponent side of a self_play=True vec env with policies from an
+    OpponentPool
+
+    Every env gets a new opponent drawn from the pool at the start of each
+    episode. The learner sees a normal single-agent vec env; the infos of
+    finished episodes name the opponent under 'opponent'.
+
+    :param venv: Vec env created with self_play=True
+    :param pool: Pool the opponents are drawn from. It may still be empty
+        here, but must hold a policy by the first reset.
+    :param deterministic: Whether opponents take their most likely action
+    """
+
+    def __init__(self, venv, pool: OpponentPool, deterministic: bool = False):
+        if not isinstance(venv.action_space, spaces.MultiDiscrete):
+            raise ValueError("SelfPlayVecEnv needs an env created with self_play=True")
+        both = venv.observation_space
+        observation_space = spaces.Box(low=both.low[0], high=both.high[0], dtype=both.dtype)
+        action_space = spaces.Discrete(int(venv.action_space.nvec[0]))
+        super().__init__(venv, observation_space, action_space)
+        self.pool = pool
+        self.deterministic = deterministic
+        self.opponents = np.zeros(self.num_envs, dtype=np.int64)  # Pool key per env
+        self._policies = {}  # Policies in play, which may have left the pool since
+        self._opponent_obs = None
+
+    def reset(self):
+        observation = self.venv.reset()
+        self._draw_opponents(np.arange(self.num_envs))
+        self._opponent_obs = observation[:, 1]
+        return observation[:, 0]
+
+    def step_async(self, actions: np.ndarray) -> None:
+        actions = np.stack([np.asarray(actions).reshape(self.num_envs), self._opponent_actions()], axis=1)
+        self.venv.step_async(actions)
+
+    def step_wait(self):
+        observation, rewards, dones, infos = self.venv.step_wait()
+        finished = np.flatnonzero(dones)
+        for env_idx in finished:
+            info = infos[env_idx]
+            info['opponent'] = self.pool.names[self.opponents[env_idx]]
+            if 'terminal_observation' in info:
+                info['terminal_observation'] = info['terminal_observation'][0]
+        if finished.size:
+            self._draw_opponents(finished)
+        self._opponent_obs = observation[:, 1]
+        return observation[:, 0], rewards, dones, infos
+
+    def _draw_opponents(self, env_indices: np.ndarray):
+        """Give the given envs new opponents from the pool"""
+        self.opponents[env_indices] = self.pool.sample(len(env_indices))
+        in_play = set(self.opponents.tolist())
+        for key in in_play - self._policies.keys():
+            self._policies[key] = self.pool.policies[key]
+        for key in self._policies.keys() - in_play:
+            del self._policies[key]
+
+    def _opponent_actions(self) -> np.ndarray:
+        """Actions of all opponents, one forward pass per opponent policy in play"""
+        if len(self._policies) == 1:
+            policy, = self._policies.values()
+            return policy.predict(self._opponent_obs, deterministic=self.deterministic)[0]
+        actions = np.empty(self.num_envs, dtype=np.int64)
+        for key, policy in self._policies.items():
+            envs = np.flatnonzero(self.opponents == key)
+            actions[envs], _ = policy.predict(self._opponent_obs[envs], deterministic=self.deterministic)
+        return actions
@@ -0,0 +1,230 @@
+"""
+Shared-memory vectorized environment
+
+Like SB3's SubprocVecEnv, each environment runs in its own worker process, but
+observations, rewards and done flags are written by the workers directly into
+one multiprocessing.shared_memory block instead of being pickled through a
+pipe. Per step the main process only sends a one-byte step signal to each
+worker and gets back an empty reply, or a small pickled info dict when the
+episode ended.
+"""
+
+import multiprocessing as mp
+import pickle
+from multiprocessing import shared_memory
+
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3.common.env_util import is_wrapped
+from stable_baselines3.common.vec_env import VecEnv
+from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper
+
+# Step signal sent to the workers; every other command is a pickled tuple
+_STEP = b's'
+
+# Offsets of the shared arrays are aligned to cache lines
+_ALIGNMENT = 64
+
+
+def _shared_layout(num_envs: int, observation_space: spaces.Box, action_space: spaces.Space) -> list:
+    """Return [(name, dtype, shape, offset), ...] describing the shared block"""
+    fields = [
+        ('observations', observation_space.dtype, (num_envs,) + observation_space.shape),
+        ('terminal_observations', observation_space.dtype, (num_envs,) + observation_space.shape),
+        ('actions', action_space.dtype, (num_envs,) + action_space.shape),
+        ('rewards', np.dtype(np.float32), (num_envs,)),
+        ('terminated', np.dtype(bool), (num_envs,)),
+        ('truncated', np.dtype(bool), (num_envs,)),
+    ]
+    layout, offset = [], 0
+    for name, dtype, shape in fields:
+        layout.append((name, np.dtype(dtype).str, shape, offset))
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        offset += -(-size // _ALIGNMENT) * _ALIGNMENT
+    return layout
+
+
+def _layout_size(layout: list) -> int:
+    name, dtype, shape, offset = layout[-1]
+    return offset + int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+
+def _shared_arrays(buffer, layout: list) -> dict:
+    """Numpy views of every field of the shared block"""
+    return {
+        name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=buffer, offset=offset)
+        for name, dtype, shape, offset in layout
+    }
+
+
+def _worker(remote, parent_remote, env_fn_wrapper, shm_name: str, layout: list, index: int):
+    """Worker process: step one environment and write its results into shared memory"""
+    parent_remote.close()
+    # Workers share the parent's resource tracker, so attaching here does not
+    # schedule a second unlink; the main process unlinks the block in close()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    arrays = _shared_arrays(shm.buf, layout)
+    observations, terminal_observations = arrays['observations'], arrays['terminal_observations']
+    actions, rewards = arrays['actions'], arrays['rewards']
+    terminated_buf, truncated_buf = arrays['terminated'], arrays['truncated']
+    env = env_fn_wrapper.var()
+
+    try:
+        while True:
+            message = remote.recv_bytes()
+            if message == _STEP:
+                observation, reward, terminated, truncated, info = env.step(actions[index])
+                rewards[index] = reward
+                terminated_buf[index] = terminated
+                truncated_buf[index] = truncated
+                if terminated or truncated:
+                    # Save final observation where the main process can get it, then reset
+                    terminal_observations[index] = observation
+                    info['TimeLimit.truncated'] = truncated and not terminated
+                    observation, _ = env.reset()
+                    observations[index] = observation
+                    remote.send_bytes(pickle.dumps(info))
+                else:
+                    observations[index] = observation
+                    remote.send_bytes(b'')
+                continue
+
+            command, data = pickle.loads(message)
+            if command == 'reset':
+                seed, options = data
+                maybe_options = {'options': options} if options else {}
+                observation, reset_info = env.reset(seed=seed, **maybe_options)
+                observations[index] = observation
+                remote.send(reset_info)
+            elif command == 'get_attr':
+                remote.send(getattr(env, data))
+            elif command == 'set_attr':
+                remote.send(setattr(env, data[0], data[1]))
+            elif command == 'env_method':
+                method_name, args, kwargs = data
+                remote.send(getattr(env, method_name)(*args, **kwargs))
+            elif command == 'is_wrapped':
+                remote.send(is_wrapped(env, data))
+            elif command == 'close':
+                remote.send(None)
+                break
+            else:
+                raise NotImplementedError(f"`{command}` is not implemented in the worker")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        env.close()
+        del observations, terminal_observations, actions, rewards, terminated_buf, truncated_buf, arrays
+        shm.close()
+
+
+class SharedMemoryVecEnv(VecEnv):
+    """
+    Vectorized environment running each env in a worker process that writes
+    its results straight into shared memory
+
+    :param env_fns: Functions creating the environments. The observation
+        space must be a Box.
+    :param start_method: Multiprocessing start method, defaults to
+        'forkserver' when available and 'spawn' otherwise (as in SubprocVecEnv)
+    """
+
+    def __init__(self, env_fns, start_method=None):
+        self.waiting = False
+        self.closed = False
+        n_envs = len(env_fns)
+
+        # Read the spaces from a throwaway env instead of a round trip to a worker
+        probe = env_fns[0]()
+        observation_space, action_space = probe.observation_space, probe.action_space
+        probe.close()
+        if not isinstance(observation_space, spaces.Box):
+            raise ValueError("SharedMemoryVecEnv only supports Box observation spaces")
+
+        layout = _shared_layout(n_envs, observation_space, action_space)
+        self._shm = shared_memory.SharedMemory(create=True, size=_layout_size(layout))
+        self._arrays = _shared_arrays(self._shm.buf, layout)
+
+        if start_method is None:
+            start_method = 'forkserver' if 'forkserver' in mp.get_all_start_methods() else 'spawn'
+        ctx = mp.get_context(start_method)
+
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(n_envs)])
+        self.processes = []
+        for index, (work_remote, remote, env_fn) in enumerate(zip(self.work_remotes, self.remotes, env_fns)):
+            args = (work_remote, remote, CloudpickleWrapper(env_fn), self._shm.name, layout, index)
+            # daemon=True: if the main process crashes, we should not cause things to hang
+            process = ctx.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        super().__init__(n_envs, observation_space, action_space)
+
+    def step_async(self, actions: np.ndarray) -> None:
+        self._arrays['actions'][:] = actions
+        for remote in self.remotes:
+            remote.send_bytes(_STEP)
+        self.waiting = True
+
+    def step_wait(self):
+        infos = []
+        terminal_observations = self._arrays['terminal_observations']
+        for index, remote in enumerate(self.remotes):
+            message = remote.recv_bytes()
+            if message:
+                info = pickle.loads(message)
+                info['terminal_observation'] = terminal_observations[index].copy()
+            else:
+                info = {}
+            infos.append(info)
+        self.waiting = False
+
+        arrays = self._arrays
+        dones = arrays['terminated'] | arrays['truncated']
+        return arrays['observations'].copy(), arrays['rewards'].copy(), dones, infos
+
+    def reset(self):
+        for index, remote in enumerate(self.remotes):
+            remote.send_bytes(pickle.dumps(('reset', (self._seeds[index], self._options[index]))))
+        self.reset_infos = [remote.recv() for remote in self.remotes]
+        # Seeds and options are only used once
+        self._reset_seeds()
+        self._reset_options()
+        return self._arrays['observations'].copy()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        if self.waiting:
+            for remote in self.remotes:
+                remote.recv_bytes()
+        for remote in self.remotes:
+            remote.send_bytes(pickle.dumps(('close', None)))
+        for remote in self.remotes:
+            remote.recv()
+        for process in self.processes:
+            process.join()
+        self._arrays = None
+        self._shm.close()
+        self._shm.unlink()
+        self.closed = True
+
+    def _call(self, command: str, data, indices=None) -> list:
+        """Send a control command to the workers at the given indices and collect the replies"""
+        target_remotes = [self.remotes[i] for i in self._get_indices(indices)]
+        for remote in target_remotes:
+            remote.send_bytes(pickle.dumps((command, data)))
+        return [remote.recv() for remote in target_remotes]
+
+    def get_attr(self, attr_name: str, indices=None) -> list:
+        return self._call('get_attr', attr_name, indices)
+
+    def set_attr(self, attr_name: str, value, indices=None) -> None:
+        self._call('set_attr', (attr_name, value), indices)
+
+    def env_method(self, method_name: str, *method_args, indices=None, **method_kwargs) -> list:
+        return self._call('env_method', (method_name, method_args, method_kwargs), indices)
+
+    def env_is_wrapped(self, wrapper_class, indices=None) -> list:
+        return self._call('is_wrapped', wrapper_class, indices)
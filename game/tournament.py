@@ -0,0 +1,382 @@
+"""
+Round-robin tournament between saved models
+
+Every pair of checkpoints plays a number of games on the deterministic
+batched core. The games are split evenly over a process pool, and every
+worker keeps a batch of games of all pairings running in one core, starting
+the next game in a row as soon as one ends. Each tick every model picks its
+actions for all the games it plays, on either side, in one forward pass.
+The report gives the games and game ticks per second, every model's win
+rate with a Wilson confidence interval, Bradley-Terry Elo ratings with
+bootstrap confidence intervals and the pairwise score matrix.
+
+Run from the repository root:
+    python -m game.tournament best_model.zip final_model.zip --games 2000 --scripted
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations
+
+import numpy as np
+import torch
+from stable_baselines3 import PPO
+
+from .core import DEFAULT_DT, BatchedAIFightClubCore
+
+# Name of the scripted opponent when it takes part
+SCRIPTED = 'scripted'
+
+# Policies of the current process, loaded once by _load_policies
+_policies = {}
+
+
+def _load_policies(checkpoints: dict):
+    """Load every checkpoint's policy into this process (pool initializer)"""
+    torch.set_num_threads(1)
+    for name, path in checkpoints.items():
+        policy = PPO.load(path, device='cpu').policy
+        policy.set_training_mode(False)
+        _policies[name] = policy
+
+
+def _checkpoint_names(paths) -> dict:
+    """
+    Name the checkpoints by file name, falling back to the path (without the
+    extension) for those whose file names clash, e.g. two best_model.zip
+    files from different runs
+    """
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    checkpoints = {}
+    for stem, path in zip(stems, paths):
+        name = stem if stems.count(stem) == 1 else os.path.splitext(os.path.normpath(path))[0]
+        if name in checkpoints:
+            raise ValueError(f"Checkpoint {path} is given more than once")
+        checkpoints[name] = path
+    return checkpoints
+
+
+def _observation_settings(grid_size: int = 20) -> dict:
+    """Observation encoding of the loaded policies, as BatchedAIFightClubCore arguments"""
+    sizes = {int(np.prod(policy.observation_space.shape)) for policy in _policies.values()}
+    if len(sizes) != 1:
+        raise ValueError(f"The models use different observation sizes: {sorted(sizes)}")
+    size = sizes.pop()
+    if size == grid_size * grid_size * 4 + 2:
+        return {'observation': 'grid'}
+    return {'observation': 'features', 'num_nearest_bullets': (size - 10) // 4}
+
+
+def _act(policy, observations: np.ndarray, deterministic: bool) -> np.ndarray:
+    """Actions of a policy for a batch of observations, without predict()'s per-call copies and mode switches"""
+    with torch.no_grad():
+        distribution = policy.get_distribution(torch.from_numpy(observations))
+        return distribution.get_actions(deterministic=deterministic).numpy()
+
+
+def _play(task: tuple) -> tuple:
+    """
+    Play the games of task = (pairings, seed, settings), where pairings holds
+    the (agent, opponent) of every game, and return the game ticks played and
+    (agent, opponent, agent wins, opponent wins, draws) of every distinct
+    pairing
+
+    Up to settings['batch_size'] games run at once in one core, and a row
+    whose game ended takes the next game at once, so the batch stays full
+    until the pairings run out. Every tick each policy picks the actions of
+    all the sides it plays, in any pairing, in one forward pass.
+    """
+    pairings, seed, settings = task
+    torch.manual_seed(seed)
+    scripted = pairings[0][1] == SCRIPTED
+    size = min(settings['batch_size'], len(pairings))
+    core = BatchedAIFightClubCore(size, seed=seed, autoreset=False, opponent_view=not scripted,
+                                  **settings['core'])
+    observations = core.reset()
+    deterministic = settings['deterministic']
+
+    # Policy index of both sides of every game (-1 = scripted)
+    names = sorted({name for pairing in pairings for name in pairing} - {SCRIPTED})
+    index = {name: i for i, name in enumerate(names)}
+    agent_ids = np.array([index[agent] for agent, _ in pairings])
+    opponent_ids = np.array([index.get(opponent, -1) for _, opponent in pairings])
+
+    # Game played in every row, -1 once the row has no game left; idle rows
+    # keep being stepped with no-ops until the batch is done
+    playing = np.arange(size)
+    next_game = size
+    winners = np.full(len(pairings), -1, dtype=np.int64)  # -1 = draw (time limit)
+    agent_actions = np.full(size, 3, dtype=np.int64)
+    opponent_actions = None if scripted else np.full(size, 3, dtype=np.int64)
+    batch = np.empty((size, core.observation_size), dtype=np.float32)  # one policy's observations
+    ticks = 0
+    while True:
+        rows = np.flatnonzero(playing >= 0)
+        if rows.size == 0:
+            break
+        games = playing[rows]
+        agent_actions[:] = 3
+        if not scripted:
+            opponent_actions[:] = 3
+        for i, name in enumerate(names):
+            as_agent = rows[agent_ids[games] == i]
+            as_opponent = rows[opponent_ids[games] == i]
+            if as_agent.size + as_opponent.size == 0:
+                continue
+            k = as_agent.size
+            np.take(observations, as_agent, axis=0, out=batch[:k])
+            if as_opponent.size:
+                np.take(core.opponent_observations, as_opponent, axis=0, out=batch[k:k + as_opponent.size])
+            actions = _act(_policies[name], batch[:k + as_opponent.size], deterministic)
+            agent_actions[as_agent] = actions[:k]
+            if as_opponent.size:
+                opponent_actions[as_opponent] = actions[k:]
+        observations, _, terminated, truncated, info = core.step(agent_actions, opponent_actions)
+        ticks += rows.size
+
+        ended = rows[(terminated | truncated)[rows]]
+        if ended.size:
+            winners[playing[ended]] = info['winner'][ended]
+            refill = ended[:len(pairings) - next_game]
+            playing[ended] = -1
+            if refill.size:
+                playing[refill] = np.arange(next_game, next_game + refill.size)
+                next_game += refill.size
+                core.reset(refill)
+
+    results = {}
+    for pairing, winner in zip(pairings, winners.tolist()):
+        counts = results.setdefault(pairing, [0, 0, 0])
+        counts[winner if winner >= 0 else 2] += 1
+    return ticks, [(agent, opponent, *counts) for (agent, opponent), counts in results.items()]
+
+
+def _tasks(names: list, games_per_pair: int, chunks: int, seed: int, settings: dict) -> list:
+    """
+    The pairings of every game, split into chunks tasks of games between
+    models and as many of games against the scripted opponent
+
+    Consecutive games cycle through the pairs, so every task and every batch
+    mixes all of them, and each pair alternates which model plays the agent's
+    side (the scripted opponent can only play the opponent's side).
+    """
+    models, scripted = [], []
+    for game in range(games_per_pair):
+        for first, second in combinations(names, 2):
+            if first == SCRIPTED:
+                first, second = second, first
+            if second == SCRIPTED:
+                scripted.append((first, second))
+            else:
+                models.append((second, first) if game % 2 else (first, second))
+    tasks = []
+    for pairings in (models, scripted):
+        for chunk in range(chunks):
+            if pairings[chunk::chunks]:
+                tasks.append((pairings[chunk::chunks], seed + len(tasks), settings))
+    return tasks
+
+
+def wilson_interval(successes: float, trials: int, z: float = 1.96) -> tuple:
+    """Wilson score interval of a binomial proportion"""
+    if trials == 0:
+        return 0.0, 1.0
+    p = successes / trials
+    center = (p + z * z / (2 * trials)) / (1 + z * z / trials)
+    half = z * np.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / (1 + z * z / trials)
+    return float(center - half), float(center + half)
+
+
+def bradley_terry_elo(scores: np.ndarray, prior: float = 1.0, iterations: int = 200) -> np.ndarray:
+    """
+    Elo ratings (mean 1500) fitted to a pairwise score matrix
+
+    scores[i, j] is what player i scored against player j (1 per win, 0.5 per
+    draw). Every pair that played also gets prior games split evenly, so a
+    player that never scored still gets a finite rating. Fitted with the
+    minorization-maximization updates for the Bradley-Terry model.
+    """
+    played = (scores + scores.T) > 0
+    scores = scores + 0.5 * prior * played
+    games = scores + scores.T
+    total = scores.sum(axis=1)
+    strength = np.ones(len(scores))
+    for _ in range(iterations):
+        denominator = (games / (strength[:, None] + strength[None, :])).sum(axis=1)
+        updated = total / np.where(denominator > 0, denominator, 1.0)
+        updated /= np.exp(np.log(updated).mean())
+        if np.allclose(updated, strength, rtol=1e-10, atol=0):
+            strength = updated
+            break
+        strength = updated
+    elo = 400 * np.log10(strength)
+    return elo - elo.mean() + 1500
+
+
+def _bootstrap_elo(wins: np.ndarray, draws: np.ndarray, samples: int, seed: int) -> np.ndarray:
+    """(samples, players) Elo ratings refitted to resampled pairwise results"""
+    rng = np.random.default_rng(seed)
+    n = len(wins)
+    ratings = np.empty((samples, n))
+    pairs = [(i, j) for i in range(n) for j in range(i + 1, n)]
+    for sample in range(samples):
+        resampled_wins = np.zeros_like(wins)
+        resampled_draws = np.zeros_like(draws)
+        for i, j in pairs:
+            games = wins[i, j] + wins[j, i] + draws[i, j]
+            if games == 0:
+                continue
+            outcome = rng.multinomial(games, [wins[i, j] / games, wins[j, i] / games, draws[i, j] / games])
+            resampled_wins[i, j], resampled_wins[j, i] = outcome[0], outcome[1]
+            resampled_draws[i, j] = resampled_draws[j, i] = outcome[2]
+        ratings[sample] = bradley_terry_elo(resampled_wins + 0.5 * resampled_draws)
+    return ratings
+
+
+def run_tournament(checkpoints, games_per_pair: int = 1000, scripted: bool = False,
+                   workers: int = None, batch_size: int = 1024, deterministic: bool = False,
+                   dt: float = DEFAULT_DT, frame_skip: int = 1, seed: int = 0,
+                   bootstrap: int = 200) -> dict:
+    """
+    Play a round robin between saved models and return the report
+
+    Args:
+        checkpoints: Paths of saved models (.zip), named by file name (by path
+            where file names clash), or a dict of name -> path
+        games_per_pair: Games every pair of players plays
+        scripted: Also enter the scripted opponent (it always plays the
+            opponent's side)
+        workers: Processes in the pool (default: CPU count); 0 plays every
+            game in this process. The games are split evenly between them.
+        batch_size: Games a worker runs at once in one core. Bigger batches
+            amortize the per-tick forward pass and core overhead.
+        deterministic: Whether the models take their most likely action. The
+            core is deterministic, so with deterministic models every game of
+            a pairing is the same; by default actions are sampled (seeded).
+        dt, frame_skip: Core settings, should match those used in training
+        seed: Base seed of the games and of the bootstrap
+        bootstrap: Resamples for the Elo confidence intervals
+    """
+    if not isinstance(checkpoints, dict):
+        checkpoints = _checkpoint_names(checkpoints)
+    if scripted and SCRIPTED in checkpoints:
+        raise ValueError(f"The name {SCRIPTED!r} is taken by the scripted opponent")
+    names = list(checkpoints) + ([SCRIPTED] if scripted else [])
+    if len(names) < 2:
+        raise ValueError("A tournament needs at least two players")
+
+    _load_policies(checkpoints)
+    settings = {
+        'core': dict(dt=dt, frame_skip=frame_skip, **_observation_settings()),
+        'deterministic': deterministic,
+        'batch_size': batch_size,
+    }
+    chunks = os.cpu_count() if workers is None else max(workers, 1)
+    tasks = _tasks(names, games_per_pair, chunks, seed, settings)
+
+    start = time.perf_counter()
+    if workers == 0:
+        results = [_play(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_load_policies,
+                                 initargs=(checkpoints,)) as pool:
+            results = list(pool.map(_play, tasks))
+    elapsed = time.perf_counter() - start
+
+    # wins[i, j] = games i won against j, draws symmetric
+    index = {name: i for i, name in enumerate(names)}
+    n = len(names)
+    wins = np.zeros((n, n), dtype=np.int64)
+    draws = np.zeros((n, n), dtype=np.int64)
+    for agent, opponent, agent_wins, opponent_wins, drawn in (pairing for _, task_results in results
+                                                              for pairing in task_results):
+        i, j = index[agent], index[opponent]
+        wins[i, j] += agent_wins
+        wins[j, i] += opponent_wins
+        draws[i, j] += drawn
+        draws[j, i] += drawn
+
+    scores = wins + 0.5 * draws
+    elo = bradley_terry_elo(scores)
+    elo_samples = _bootstrap_elo(wins, draws, bootstrap, seed) if bootstrap else elo[None]
+    elo_low, elo_high = np.percentile(elo_samples, [2.5, 97.5], axis=0)
+
+    players = []
+    for i, name in enumerate(names):
+        games = int(wins[i].sum() + wins[:, i].sum() + draws[i].sum())
+        players.append({
+            'name': name,
+            'games': games,
+            'wins': int(wins[i].sum()),
+            'losses': int(wins[:, i].sum()),
+            'draws': int(draws[i].sum()),
+            'win_rate': float(wins[i].sum() / games) if games else 0.0,
+            'win_rate_ci': wilson_interval(wins[i].sum(), games),
+            'elo': float(elo[i]),
+            'elo_ci': (float(elo_low[i]), float(elo_high[i])),
+        })
+    players.sort(key=lambda player: -player['elo'])
+
+    total_games = sum(len(task[0]) for task in tasks)
+    ticks = sum(task_ticks for task_ticks, _ in results)
+    return {
+        'players': players,
+        'names': names,
+        'wins': wins.tolist(),
+        'draws': draws.tolist(),
+        'games': total_games,
+        'seconds': elapsed,
+        'games_per_sec': total_games / elapsed,
+        'ticks': ticks,
+        'ticks_per_sec': ticks / elapsed,
+    }
+
+
+def print_report(report: dict):
+    """Print the standings and the pairwise score matrix"""
+    print(f"{report['games']} games ({report['ticks']} game ticks) in {report['seconds']:.1f}s: "
+          f"{report['games_per_sec']:.0f} games/s, {report['ticks_per_sec']:.0f} ticks/s\n")
+    print(f"{'player':<20} {'elo':>6} {'95% CI':>15} {'win rate':>9} {'95% CI':>15} "
+          f"{'W':>6} {'D':>6} {'L':>6}")
+    for p in report['players']:
+        elo_ci = f"{p['elo_ci'][0]:.0f}-{p['elo_ci'][1]:.0f}"
+        win_ci = f"{p['win_rate_ci'][0]:.1%}-{p['win_rate_ci'][1]:.1%}"
+        print(f"{p['name']:<20} {p['elo']:>6.0f} {elo_ci:>15} {p['win_rate']:>9.1%} {win_ci:>15} "
+              f"{p['wins']:>6} {p['draws']:>6} {p['losses']:>6}")
+
+    # Score of the row player against the column player
+    names = report['names']
+    wins, draws = np.asarray(report['wins']), np.asarray(report['draws'])
+    games = wins + wins.T + draws
+    print(f"\n{'score':<20} " + ' '.join(f"{name[:10]:>10}" for name in names))
+    for i, name in enumerate(names):
+        cells = [f"{(wins[i, j] + 0.5 * draws[i, j]) / games[i, j]:>10.1%}" if games[i, j] else f"{'-':>10}"
+                 for j in range(len(names))]
+        print(f"{name:<20} " + ' '.join(cells))
+
+
+# ==================== MAIN EXECUTION ====================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('checkpoints', nargs='+', help='saved models (.zip)')
+    parser.add_argument('--games', type=int, default=1000, help='games per pair')
+    parser.add_argument('--scripted', action='store_true', help='also play the scripted opponent')
+    parser.add_argument('--workers', type=int, help='processes (default: CPU count, 0 = none)')
+    parser.add_argument('--batch-size', type=int, default=1024, help='games run at once per worker')
+    parser.add_argument('--deterministic', action='store_true')
+    parser.add_argument('--frame-skip', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', dest='json_path', help='write the report here')
+    args = parser.parse_args()
+
+    report = run_tournament(args.checkpoints, games_per_pair=args.games, scripted=args.scripted,
+                            workers=args.workers, batch_size=args.batch_size,
+                            deterministic=args.deterministic, frame_skip=args.frame_skip,
+                            seed=args.seed)
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
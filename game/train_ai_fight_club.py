@@ -1,269 +1,15 @@
 import gymnasium as gym
 from gymnasium import spaces
 import numpy as np
-import time
-from collections import deque
 import matplotlib.pyplot as plt
 from stable_baselines3 import PPO
 from stable_baselines3.common.callbacks import BaseCallback
-from stable_baselines3.common.vec_env import DummyVecEnv
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecEnv
 import torch
 import os
 import pygame
-
-# ==================== GAME CORE ====================
-class AIFightClubCore:
-    """Core game logic for AI Fight Club without rendering"""
-    
-    def __init__(self, grid_size: int = 20):
-        self.grid_size = grid_size
-        self.cell_size = 1
-        self.reset()
-    
-    def reset(self) -> np.ndarray:
-        """Reset the game to initial state and return initial observation"""
-        # Create agents with 3 lives each
-        self.agent = self._create_agent(3, 10, 1, 0)
-        self.opponent = self._create_agent(16, 10, -1, 1)
-        
-        # Game state
-        self.done = False
-        self.winner = None
-        self.step_count = 0
-        self.last_update_time = time.time()
-        
-        # Game statistics
-        self.agent_lives_lost = 0
-        self.opponent_lives_lost = 0
-        self.agent_shots_fired = 0
-        self.opponent_shots_fired = 0
-        
-        return self._get_observation()
-    
-    def _create_agent(self, x: int, y: int, dx: int, player_id: int) -> dict:
-        """Create an agent with the given parameters"""
-        return {
-            'x': x, 'y': y, 'dx': dx, 'player_id': player_id,
-            'bullets': [], 'health': 3, 'alive': True,
-            'last_shot': 0, 'shot_cooldown': 0.5,
-            'hit_time': 0, 'hit_cooldown': 0.5,
-            'score': 0
-        }
-    
-    def step(self, agent_action: int, opponent_action: int = None) -> tuple:
-        """
-        Execute one game step
-        
-        Returns:
-            observation, reward, terminated, truncated, info
-        """
-        current_time = time.time()
-        dt = current_time - self.last_update_time
-        self.last_update_time = current_time
-        
-        # Process actions
-        self._process_action(self.agent, agent_action, dt)
-        
-        if opponent_action is not None:
-            self._process_action(self.opponent, opponent_action, dt)
-        else:
-            # Default opponent behavior
-            self._default_opponent_behavior(dt)
-        
-        # Update game state
-        self._update_bullets(dt)
-        self._check_collisions(current_time)
-        
-        # Get reward
-        reward = self._get_reward()
-        
-        # Check if game is done
-        terminated = self.done
-        truncated = self.step_count > 1000  # End after 1000 steps
-        
-        # Get info with detailed statistics
-        info = {
-            'winner': self.winner,
-            'agent_health': self.agent['health'],
-            'opponent_health': self.opponent['health'],
-            'step_count': self.step_count,
-            'agent_lives_lost': self.agent_lives_lost,
-            'opponent_lives_lost': self.opponent_lives_lost,
-            'agent_shots_fired': self.agent_shots_fired,
-            'opponent_shots_fired': self.opponent_shots_fired,
-        }
-        
-        self.step_count += 1
-        
-        return self._get_observation(), reward, terminated, truncated, info
-    
-    def _process_action(self, agent: dict, action: int, dt: float):
-        """Convert action index to game action"""
-        if action == 0:  # MOVE UP
-            self._move_agent(agent, -1)
-        elif action == 1:  # MOVE DOWN
-            self._move_agent(agent, 1)
-        elif action == 2:  # SHOOT
-            self._shoot_bullet(agent, dt)
-            # Track shots fired
-            if agent['player_id'] == 0:
-                self.agent_shots_fired += 1
-            else:
-                self.opponent_shots_fired += 1
-        # action 3: DO_NOTHING
-    
-    def _move_agent(self, agent: dict, dy: int):
-        """Move agent vertically"""
-        new_y = agent['y'] + dy
-        if 0 <= new_y < self.grid_size:
-            agent['y'] = new_y
-    
-    def _shoot_bullet(self, agent: dict, dt: float):
-        """Agent shoots a bullet if cooldown has expired"""
-        agent['last_shot'] += dt
-        if agent['last_shot'] >= agent['shot_cooldown']:
-            agent['bullets'].append({
-                'x': agent['x'], 
-                'y': agent['y'], 
-                'dx': agent['dx'], 
-                'dy': 0,
-                'speed': 5.0  # cells per second
-            })
-            agent['last_shot'] = 0  # Reset cooldown
-    
-    def _default_opponent_behavior(self, dt: float):
-        """Default behavior for opponent (simple tracking)"""
-        # Move toward player with some randomness
-        if self.opponent['y'] < self.agent['y'] and np.random.random() > 0.3:
-            self._move_agent(self.opponent, 1)
-        elif self.opponent['y'] > self.agent['y'] and np.random.random() > 0.3:
-            self._move_agent(self.opponent, -1)
-        
-        # Shoot with some probability
-        if np.random.random() < 0.1:  # 10% chance to shoot each frame
-            self._shoot_bullet(self.opponent, dt)
-    
-    def _update_bullets(self, dt: float):
-        """Update bullet positions and remove off-screen bullets"""
-        for agent in [self.agent, self.opponent]:
-            for bullet in agent['bullets'][:]:
-                # Move bullet
-                bullet['x'] += bullet['dx'] * bullet['speed'] * dt
-                bullet['y'] += bullet['dy'] * bullet['speed'] * dt
-                
-                # Remove bullets that are off screen
-                if not (0 <= bullet['x'] < self.grid_size and 0 <= bullet['y'] < self.grid_size):
-                    agent['bullets'].remove(bullet)
-    
-    def _check_collisions(self, current_time: float):
-        """Check for bullet collisions"""
-        # Check if agent bullets hit opponent
-        for bullet in self.agent['bullets'][:]:
-            if self._check_bullet_hit(self.opponent, bullet, current_time):
-                self.agent['bullets'].remove(bullet)
-                self.agent['score'] += 1  # Reward for hitting
-                if not self.opponent['alive']:
-                    self.done = True
-                    self.winner = self.agent['player_id']
-        
-        # Check if opponent bullets hit agent
-        for bullet in self.opponent['bullets'][:]:
-            if self._check_bullet_hit(self.agent, bullet, current_time):
-                self.opponent['bullets'].remove(bullet)
-                self.opponent['score'] += 1  # Opponent gets points too
-                if not self.agent['alive']:
-                    self.done = True
-                    self.winner = self.opponent['player_id']
-    
-    def _check_bullet_hit(self, agent: dict, bullet: dict, current_time: float) -> bool:
-        """Check if a bullet hits an agent"""
-        if not agent['alive']:
-            return False
-            
-        # Check if still in hit cooldown
-        if current_time - agent['hit_time'] < agent['hit_cooldown']:
-            return False
-            
-        # Check collision (using manhattan distance for simplicity)
-        if abs(agent['x'] - bullet['x']) < 1 and abs(agent['y'] - bullet['y']) < 1:
-            agent['health'] -= 1
-            
-            # Track lives lost
-            if agent['player_id'] == 0:
-                self.agent_lives_lost += 1
-            else:
-                self.opponent_lives_lost += 1
-                
-            agent['hit_time'] = current_time
-            if agent['health'] <= 0:
-                agent['alive'] = False
-            return True
-        return False
-    
-    def _get_observation(self) -> np.ndarray:
-        """Convert game state to numerical representation for AI"""
-        # Create a grid representation
-        state = np.zeros((self.grid_size, self.grid_size, 4), dtype=np.float32)
-        
-        # Channel 0: Agent position
-        if self.agent['alive']:
-            y, x = int(self.agent['y']), int(self.agent['x'])
-            if 0 <= x < self.grid_size and 0 <= y < self.grid_size:
-                state[y, x, 0] = 1.0
-        
-        # Channel 1: Opponent position
-        if self.opponent['alive']:
-            y, x = int(self.opponent['y']), int(self.opponent['x'])
-            if 0 <= x < self.grid_size and 0 <= y < self.grid_size:
-                state[y, x, 1] = 1.0
-        
-        # Channel 2: Agent bullets
-        for bullet in self.agent['bullets']:
-            x, y = int(bullet['x']), int(bullet['y'])
-            if 0 <= x < self.grid_size and 0 <= y < self.grid_size:
-                state[y, x, 2] = 1.0
-        
-        # Channel 3: Opponent bullets
-        for bullet in self.opponent['bullets']:
-            x, y = int(bullet['x']), int(bullet['y'])
-            if 0 <= x < self.grid_size and 0 <= y < self.grid_size:
-                state[y, x, 3] = 1.0
-        
-        # Flatten and add health information
-        grid_state = state.flatten()
-        health_info = np.array([
-            self.agent['health'] / 3.0, 
-            self.opponent['health'] / 3.0
-        ], dtype=np.float32)
-        
-        full_state = np.concatenate([grid_state, health_info])
-        return full_state
-    
-    def _get_reward(self) -> float:
-        """Calculate reward for the learning agent"""
-        reward = 0.0
-        
-        # Small penalty for each step to encourage faster games
-        reward -= 0.001
-        
-        # Reward for hitting opponent
-        reward += self.agent['score'] * 1.0
-        self.agent['score'] = 0  # Reset for next step
-        
-        # Penalty for getting hit
-        if self.agent_lives_lost > 0:
-            reward -= 0.2 * self.agent_lives_lost
-            self.agent_lives_lost = 0
-        
-        # Large reward for winning
-        if self.done and self.winner == 0:
-            reward += 10.0
-        
-        # Large penalty for losing
-        if self.done and self.winner == 1:
-            reward -= 10.0
-        
-        return reward
+from functools import partial
+from .core import DEFAULT_DT, AIFightClubCore, BatchedAIFightClubCore, StepProfiler
 
 # ==================== GYM ENVIRONMENT ====================
 class AIFightClubEnv(gym.Env):
@@ -271,24 +17,59 @@ class AIFightClubEnv(gym.Env):
     
     metadata = {'render.modes': ['human', 'rgb_array'], 'render_fps': 30}
     
-    def __init__(self, render_mode=None):
+    def __init__(self, render_mode=None, dt=DEFAULT_DT, incremental_obs=False,
+                 observation='grid', profile=False, frame_skip=1, self_play=False,
+                 opponent=None, info_mode='full'):
+        """
+        Args:
+            self_play: Take (agent, opponent) action pairs and return both sides'
+                observations, for self_play.SelfPlayVecEnv
+            opponent: Policy for the opponent instead of the scripted behavior,
+                any object with predict(observation) -> action such as an
+                inference_server.InferenceClient. It is given the opponent's
+                mirrored observation (see AIFightClubCore.get_opponent_observation).
+            info_mode: 'full' returns the match statistics, the running episode
+                return/length and the win rate on every step; 'terminal' only
+                on the step the episode ends and an empty dict otherwise, which
+                is all the vec envs and SB3 need.
+        """
         super(AIFightClubEnv, self).__init__()
         
         self.render_mode = render_mode
-        self.game = AIFightClubCore()
+        self.game = AIFightClubCore(dt=dt, incremental_obs=incremental_obs,
+                                    observation=observation, frame_skip=frame_skip,
+                                    info_mode=info_mode)
+        self.info_mode = info_mode
+        if profile:
+            self.game.profiler = StepProfiler()
         
         # Define action and observation space
         self.action_space = spaces.Discrete(4)  # UP, DOWN, SHOOT, NOOP
         
-        # Observation space: grid state + health info
-        grid_size = self.game.grid_size
-        state_size = grid_size * grid_size * 4 + 2  # 4 channels + 2 health values
+        # Observation space: grid state + health info (4 channels + 2 health
+        # values), or the compact feature vector
         self.observation_space = spaces.Box(
-            low=0, high=1, 
-            shape=(state_size,), 
+            low=0 if observation == 'grid' else -1, high=1, 
+            shape=(self.game.observation_size,), 
             dtype=np.float32
         )
         
+        # Self-play: actions are (agent, opponent) pairs and observations hold
+        # both sides' views, see self_play.SelfPlayVecEnv
+        self.self_play = self_play
+        if self_play:
+            self.action_space = spaces.MultiDiscrete([4, 4])
+            self.observation_space = spaces.Box(
+                low=self.observation_space.low[0], high=1,
+                shape=(2, self.game.observation_size),
+                dtype=np.float32
+            )
+            self._obs = np.zeros(self.observation_space.shape, dtype=np.float32)
+        
+        self.opponent = opponent
+        if opponent is not None:
+            self._opponent_obs = np.zeros(self.game.observation_size, dtype=np.float32)
+        
         # Episode tracking
         self.episode_reward = 0
         self.episode_length = 0
@@ -334,7 +115,9 @@ class AIFightClubEnv(gym.Env):
         self.episode_reward = 0
         self.episode_length = 0
         
-        observation = self.game.reset()
+        observation = self.game.reset(seed=seed)
+        if self.self_play:
+            observation = self._both_observations(observation)
         info = {
             'episode': {
                 'r': self.episode_reward,
@@ -347,7 +130,20 @@ class AIFightClubEnv(gym.Env):
     
     def step(self, action):
         """Run one timestep of the environment's dynamics"""
-        observation, reward, terminated, truncated, info = self.game.step(action)
+        if self.self_play:
+            observation, reward, terminated, truncated, info = self.game.step(
+                int(action[0]), int(action[1]), out=self._obs[0])
+            observation = self._both_observations(observation)
+        elif self.opponent is not None:
+            opponent_action = self.opponent.predict(self.game.get_opponent_observation(out=self._opponent_obs))
+            observation, reward, terminated, truncated, info = self.game.step(action, opponent_action)
+        else:
+            observation, reward, terminated, truncated, info = self.game.step(action)
+        
+        # The vec env keeps the terminal observation after calling reset(),
+        # which would overwrite the core's reused observation buffer
+        if (terminated or truncated) and (self.game.incremental_obs or self.self_play):
+            observation = observation.copy()
         
         # Update episode statistics
         self.episode_reward += reward
@@ -357,21 +153,37 @@ class AIFightClubEnv(gym.Env):
         if terminated and info.get('winner') == 0:
             self.total_wins += 1
         
-        # Add episode info to the info dict
-        info['episode'] = {
-            'r': self.episode_reward,
-            'l': self.episode_length,
-            't': 0.0
-        }
-        
-        # Add win rate to info
-        info['win_rate'] = self.total_wins / max(1, self.episode_count) * 100
+        # Add episode info and win rate to the info dict (which stays empty
+        # until the episode ends with info_mode='terminal')
+        if info:
+            info['episode'] = {
+                'r': self.episode_reward,
+                'l': self.episode_length,
+                't': 0.0
+            }
+            info['win_rate'] = self.total_wins / max(1, self.episode_count) * 100
         
         if self.render_mode == 'human':
             self.render()
         
         return observation, reward, terminated, truncated, info
     
+    def _both_observations(self, observation: np.ndarray) -> np.ndarray:
+        """Stack the agent's observation with the opponent's (self-play)"""
+        obs = self._obs
+        if not np.shares_memory(observation, obs):
+            obs[0] = observation
+        self.game.get_opponent_observation(out=obs[1])
+        return obs
+    
+    def pop_profile_stats(self):
+        """Return the core's per-phase timing summary and start a new window"""
+        if self.game.profiler is None:
+            return None
+        stats = self.game.profiler.summary()
+        self.game.profiler.reset()
+        return stats
+    
     def render(self):
         """Render the environment"""
         if self.render_mode is None:
@@ -401,8 +213,7 @@ class AIFightClubEnv(gym.Env):
         self._draw_agent(self.game.opponent, self.colors['opponent'])
         
         # Draw bullets
-        self._draw_bullets(self.game.agent['bullets'], self.colors['bullet'])
-        self._draw_bullets(self.game.opponent['bullets'], self.colors['bullet'])
+        self._draw_bullets(self.game.bullets, self.colors['bullet'])
         
         # Update display
         pygame.display.flip()
@@ -431,10 +242,10 @@ class AIFightClubEnv(gym.Env):
     
     def _draw_bullets(self, bullets, color):
         """Draw bullets on the screen"""
-        for bullet in bullets:
+        for x, y in zip(bullets.x[:bullets.count], bullets.y[:bullets.count]):
             bullet_rect = pygame.Rect(
-                bullet['x'] * self.cell_size + self.cell_size // 4,
-                bullet['y'] * self.cell_size + self.cell_size // 4,
+                x * self.cell_size + self.cell_size // 4,
+                y * self.cell_size + self.cell_size // 4,
                 self.cell_size // 2,
                 self.cell_size // 2
             )
@@ -445,81 +256,424 @@ class AIFightClubEnv(gym.Env):
         if hasattr(self, 'screen'):
             pygame.quit()
 
+# ==================== VECTORIZED ENVIRONMENTS ====================
+class BatchedVecEnv(VecEnv):
+    """
+    SB3 vectorized environment backed by a single BatchedAIFightClubCore
+    
+    All envs are stepped in-process with one vectorized call, so there is no
+    per-env Python loop and no inter-process communication.
+    """
+    
+    def __init__(self, num_envs, dt=DEFAULT_DT, observation='grid', seed=None, profile=False,
+                 frame_skip=1, self_play=False):
+        self.render_mode = None
+        # Only the matches that end need statistics, so info only holds those
+        self.game = BatchedAIFightClubCore(num_envs, dt=dt, seed=seed, observation=observation,
+                                           frame_skip=frame_skip, opponent_view=self_play,
+                                           info_mode='terminal')
+        if profile:
+            self.game.profiler = StepProfiler()
+        
+        # Self-play: same (agent, opponent) layout as AIFightClubEnv(self_play=True)
+        self.self_play = self_play
+        shape = (self.game.observation_size,)
+        action_space = spaces.Discrete(4)
+        if self_play:
+            shape = (2,) + shape
+            action_space = spaces.MultiDiscrete([4, 4])
+        observation_space = spaces.Box(
+            low=0 if observation == 'grid' else -1, high=1,
+            shape=shape,
+            dtype=np.float32
+        )
+        super(BatchedVecEnv, self).__init__(num_envs, observation_space, action_space)
+        
+        # Episode tracking
+        self.episode_rewards = np.zeros(num_envs, dtype=np.float64)
+        self.episode_lengths = np.zeros(num_envs, dtype=np.int64)
+        self.episode_count = 0
+        self.total_wins = 0
+        self._actions = None
+    
+    def reset(self):
+        """Reset all matches and return the stacked observations"""
+        # One generator drives all matches, so only the first env's seed is used
+        observation = self.game.reset(seed=self._seeds[0])
+        self._reset_seeds()
+        self.episode_rewards[:] = 0
+        self.episode_lengths[:] = 0
+        if self.self_play:
+            return np.stack([observation, self.game.opponent_observations], axis=1)
+        return observation.copy()
+    
+    def step_async(self, actions):
+        self._actions = actions
+    
+    def step_wait(self):
+        if self.self_play:
+            actions = np.asarray(self._actions)
+            observation, rewards, terminated, truncated, info = self.game.step(actions[:, 0], actions[:, 1])
+            observation = np.stack([observation, self.game.opponent_observations], axis=1)
+            info['final_observation'] = np.stack(
+                [info['final_observation'], info['final_opponent_observation']], axis=1)
+        else:
+            observation, rewards, terminated, truncated, info = self.game.step(self._actions)
+        self.episode_rewards += rewards
+        self.episode_lengths += 1
+        dones = terminated | truncated
+        
+        infos = [{} for _ in range(self.num_envs)]
+        for i, env_idx in enumerate(info['reset_indices']):
+            winner = int(info['winner'][i])
+            infos[env_idx] = {
+                'winner': winner if winner >= 0 else None,
+                'agent_health': int(info['agent_health'][i]),
+                'opponent_health': int(info['opponent_health'][i]),
+                'step_count': int(info['step_count'][i]),
+                'agent_lives_lost': int(info['agent_lives_lost'][i]),
+                'opponent_lives_lost': int(info['opponent_lives_lost'][i]),
+                'agent_shots_fired': int(info['agent_shots_fired'][i]),
+                'opponent_shots_fired': int(info['opponent_shots_fired'][i]),
+                'episode': {
+                    'r': float(self.episode_rewards[env_idx]),
+                    'l': int(self.episode_lengths[env_idx]),
+                    't': 0.0
+                },
+                'terminal_observation': info['final_observation'][i],
+                'TimeLimit.truncated': bool(truncated[env_idx] and not terminated[env_idx]),
+            }
+            
+            # Track wins
+            self.episode_count += 1
+            if terminated[env_idx] and winner == 0:
+                self.total_wins += 1
+            infos[env_idx]['win_rate'] = self.total_wins / self.episode_count * 100
+            
+            self.episode_rewards[env_idx] = 0
+            self.episode_lengths[env_idx] = 0
+        
+        if not self.self_play:
+            observation = observation.copy()
+        return observation, rewards, dones, infos
+    
+    def pop_profile_stats(self):
+        """
+        Return the core's per-phase timing summary and start a new window
+        
+        The core times whole batched steps. The summary is converted to
+        per-env steps (steps count every match's step, the phase times and
+        bullets are shares of one env), so it reads like the other backends'.
+        """
+        stats = AIFightClubEnv.pop_profile_stats(self)
+        if stats is None:
+            return None
+        for key in stats:
+            if key.endswith('_us') or key == 'bullets_per_step':
+                stats[key] /= self.num_envs
+        stats['steps'] *= self.num_envs
+        return stats
+    
+    def close(self):
+        pass
+    
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self, attr_name)] * len(self._get_indices(indices))
+    
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self, attr_name, value)
+    
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        # The matches share one core, so a method runs once for all the given
+        # envs and its result covers them all. Copying it per env would count
+        # it len(indices) times (e.g. the profile stats' resets and steps).
+        if not len(self._get_indices(indices)):
+            return []
+        return [getattr(self, method_name)(*method_args, **method_kwargs)]
+    
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False] * len(self._get_indices(indices))
+
 # ==================== TRAINING CODE ====================
+class EpisodeStats:
+    """
+    Rolling means over the last `window` finished episodes of all envs
+    
+    Reward, length and win of each episode go into ring buffers with running
+    sums, so adding an episode and reading the means are O(1) however many
+    envs there are. The sums are recomputed each time the ring wraps around
+    so that rounding errors cannot build up.
+    """
+    
+    KEYS = ('reward', 'length', 'win_rate')
+    
+    def __init__(self, window=100):
+        self.window = window
+        self.episodes = 0  # Episodes added in total
+        self._values = np.zeros((len(self.KEYS), window))
+        self._sums = np.zeros(len(self.KEYS))
+        self._next = 0
+    
+    def __len__(self):
+        return min(self.episodes, self.window)
+    
+    def add(self, rewards, lengths, wins):
+        """Add a batch of finished episodes (one array per statistic)"""
+        batch = np.array([rewards, lengths, wins], dtype=np.float64).reshape(len(self.KEYS), -1)
+        n = batch.shape[1]
+        if n >= self.window:
+            self._values[:] = batch[:, n - self.window:]
+            self._next = 0
+        else:
+            slots = (self._next + np.arange(n)) % self.window
+            self._sums += batch.sum(axis=1) - self._values[:, slots].sum(axis=1)
+            self._values[:, slots] = batch
+            self._next = (self._next + n) % self.window
+        self.episodes += n
+        if self._next < n or n >= self.window:
+            self._sums = self._values.sum(axis=1)
+    
+    def means(self) -> dict:
+        """Mean of each statistic over the window (win_rate in %)"""
+        means = dict(zip(self.KEYS, self._sums / max(len(self), 1)))
+        means['win_rate'] *= 100
+        return means
+
 class TrainingCallback(BaseCallback):
-    """Custom callback for tracking training metrics"""
-    
-    def __init__(self, check_freq=1000, verbose=1):
+    """
+    Custom callback for tracking training metrics
+    
+    Finished episodes of all envs feed an EpisodeStats window. Every
+    check_freq timesteps its means are recorded for TensorBoard (episode/)
+    and the best model so far is checkpointed; every print_freq timesteps
+    they are also printed on one line.
+    """
+    
+    def __init__(self, check_freq=1000, verbose=1, log_profile=False, opponent_pool=None,
+                 snapshot_freq=50000, inference_server=None, checkpoint_path="best_model.zip",
+                 keep_checkpoints=5, print_freq=10000, stats_window=100):
         super(TrainingCallback, self).__init__(verbose)
         self.check_freq = check_freq
+        self.print_freq = print_freq
+        self.log_profile = log_profile
+        self.last_check = 0
+        self.last_print = 0
+        
+        # Best models are written in the background as versions of checkpoint_path
+        self.checkpoint_path = checkpoint_path
+        self.keep_checkpoints = keep_checkpoints
+        self.checkpointer = None
+        
+        # Self-play league: a frozen copy of the model joins the pool every snapshot_freq steps
+        self.opponent_pool = opponent_pool
+        self.snapshot_freq = snapshot_freq
+        self.last_snapshot = 0
+        self.inference_server = inference_server  # Logged under opponent/ if set
         self.episode_rewards = []
         self.episode_lengths = []
         self.win_rates = []
-        self.episode_count = 0
-        self.reward_buffer = deque(maxlen=100)
-        self.length_buffer = deque(maxlen=100)
-        self.win_buffer = deque(maxlen=100)
+        self.stats = EpisodeStats(stats_window)
+        
+    def _init_callback(self) -> None:
+        from .checkpointing import AsyncCheckpointer
+        
+        self.checkpointer = AsyncCheckpointer(self.checkpoint_path, keep=self.keep_checkpoints,
+                                              verbose=self.verbose > 1)
         
     def _on_step(self) -> bool:
-        # Log rewards and episode lengths when episodes are done
-        if 'episode' in self.locals['infos'][0]:
-            episode_info = self.locals['infos'][0]['episode']
-            self.reward_buffer.append(episode_info['r'])
-            self.length_buffer.append(episode_info['l'])
-            self.win_buffer.append(1 if self.locals['infos'][0].get('winner') == 0 else 0)
+        # Collect the episodes that ended in any env this step
+        dones = self.locals['dones']
+        if dones.any():
+            infos = self.locals['infos']
+            episodes = [infos[env_idx] for env_idx in np.flatnonzero(dones) if 'episode' in infos[env_idx]]
+            if episodes:
+                self.stats.add([info['episode']['r'] for info in episodes],
+                               [info['episode']['l'] for info in episodes],
+                               [info.get('winner') == 0 for info in episodes])
+        
+        # Update metrics every check_freq steps (num_timesteps grows by n_envs per call)
+        if self.num_timesteps - self.last_check >= self.check_freq and len(self.stats):
+            self.last_check = self.num_timesteps
+            if self.log_profile:
+                self._record_profile_stats()
+            if self.inference_server is not None:
+                for key, value in self.inference_server.stats().items():
+                    self.logger.record(f"opponent/{key}", value)
+            means = self.stats.means()
+            for key, value in means.items():
+                self.logger.record(f"episode/{key}", value)
+            self.logger.record("episode/count", self.stats.episodes)
+            win_rate = means['win_rate']
+            
+            self.episode_rewards.append(means['reward'])
+            self.episode_lengths.append(means['length'])
+            self.win_rates.append(win_rate)
             
-            # Update metrics every check_freq steps
-            if self.num_timesteps % self.check_freq == 0:
-                avg_reward = np.mean(self.reward_buffer)
-                avg_length = np.mean(self.length_buffer)
-                win_rate = np.mean(self.win_buffer) * 100
-                
-                self.episode_rewards.append(avg_reward)
-                self.episode_lengths.append(avg_length)
-                self.win_rates.append(win_rate)
-                
-                print(f"Timestep: {self.num_timesteps}")
-                print(f"Avg Reward: {avg_reward:.2f}")
-                print(f"Avg Episode Length: {avg_length:.2f}")
-                print(f"Win Rate: {win_rate:.2f}%")
-                print("-" * 40)
-                
-                # Save model if it has the best win rate so far
-                if win_rate >= max(self.win_rates, default=0):
-                    self.model.save("best_model")
+            if self.verbose and self.num_timesteps - self.last_print >= self.print_freq:
+                self.last_print = self.num_timesteps
+                print(f"Timestep: {self.num_timesteps} | Episodes: {self.stats.episodes} | "
+                      f"Avg Reward: {means['reward']:.2f} | Avg Episode Length: {means['length']:.2f} | "
+                      f"Win Rate: {win_rate:.2f}%")
+            
+            # Save model if it has the best win rate so far
+            if win_rate >= max(self.win_rates, default=0):
+                self.checkpointer.save(self.model)
+        
+        if self.opponent_pool is not None and self.num_timesteps - self.last_snapshot >= self.snapshot_freq:
+            self.last_snapshot = self.num_timesteps
+            self.opponent_pool.add_policy(self.model.policy, f"step_{self.num_timesteps}")
         
         return True
+    
+    def _on_training_end(self) -> None:
+        # Wait for the checkpoint still being written
+        self.checkpointer.close()
+        if self.verbose:
+            print(f"Checkpoints: {self.checkpointer.written} written, "
+                  f"{self.checkpointer.dropped} superseded before being written, "
+                  f"{self.checkpointer.snapshot_time:.2f}s of snapshots on the training thread, "
+                  f"{self.checkpointer.write_time:.2f}s of writing in the background")
+    
+    def _record_profile_stats(self):
+        """Log the simulator's per-phase timings next to the PPO metrics in TensorBoard"""
+        stats = StepProfiler.merge(self.training_env.env_method('pop_profile_stats'))
+        for key, value in stats.items():
+            self.logger.record(f"sim/{key}", value)
 
-def create_env(render_mode=None):
+def create_env(render_mode=None, dt=DEFAULT_DT, incremental_obs=True, observation='grid',
+               profile=False, frame_skip=1, self_play=False, opponent=None, info_mode='terminal'):
     """Create and return the environment"""
-    env = AIFightClubEnv(render_mode=render_mode)
+    # The vectorized env copies each observation into its own buffer, so the
+    # core's reused observation buffer is safe to use for training. Training
+    # only reads info at episode ends, so by default there is none before.
+    env = AIFightClubEnv(render_mode=render_mode, dt=dt, incremental_obs=incremental_obs,
+                         observation=observation, profile=profile, frame_skip=frame_skip,
+                         self_play=self_play, opponent=opponent, info_mode=info_mode)
     return env
 
-def train_model(total_timesteps=1000000):
-    """Train the model with progress tracking"""
+# Rollout backends supported by create_vec_env
+VEC_ENV_BACKENDS = ('dummy', 'subproc', 'shm', 'batched')
+
+def create_vec_env(n_envs=1, backend='dummy', observation='grid', seed=None, profile=False,
+                   frame_skip=1, self_play=False, opponent=None):
+    """
+    Create a vectorized environment with n_envs copies of the game
+    
+    Backends:
+        dummy: AIFightClubEnv instances stepped one after another in this process
+        subproc: one AIFightClubEnv per worker process (SubprocVecEnv)
+        shm: one AIFightClubEnv per worker process, results exchanged through
+             shared memory instead of pickled pipes (SharedMemoryVecEnv)
+        batched: all matches in one BatchedAIFightClubCore, stepped in a single call
+    
+    Env i is seeded with seed + i on its first reset. With profile=True every
+    env times the phases of its core's step (see StepProfiler). With
+    frame_skip > 1 every action is repeated for that many game ticks. With
+    self_play=True the envs also take the opponents' actions and return their
+    observations, to be wrapped in a SelfPlayVecEnv. opponent is a policy
+    client (e.g. an InferenceClient) that plays the opponent in every env;
+    the batched backend does not support it, use self-play there instead.
+    """
+    if backend == 'batched':
+        if opponent is not None:
+            raise ValueError("The batched backend does not take an opponent, use self_play")
+        env = BatchedVecEnv(n_envs, observation=observation, profile=profile,
+                            frame_skip=frame_skip, self_play=self_play)
+    elif backend in ('dummy', 'subproc', 'shm'):
+        env_fns = [partial(create_env, observation=observation, profile=profile,
+                           frame_skip=frame_skip, self_play=self_play, opponent=opponent)
+                   for _ in range(n_envs)]
+        if backend == 'dummy':
+            env = DummyVecEnv(env_fns)
+        elif backend == 'subproc':
+            env = SubprocVecEnv(env_fns)
+        else:
+            from .shm_vec_env import SharedMemoryVecEnv
+            env = SharedMemoryVecEnv(env_fns)
+    else:
+        raise ValueError(f"Unknown vec env backend: {backend}")
+    
+    env.seed(seed)
+    return env
+
+# PPO settings shared by train_model and the benchmarks
+PPO_HYPERPARAMS = {
+    'learning_rate': 3e-4,
+    'n_steps': 2048,
+    'batch_size': 64,
+    'n_epochs': 10,
+    'gamma': 0.99,
+    'gae_lambda': 0.95,
+    'clip_range': 0.2,
+    'ent_coef': 0.01,
+}
+
+def train_model(total_timesteps=1000000, observation='grid', n_envs=1, backend='dummy',
+                seed=None, profile=False, frame_skip=1, self_play=False, opponent_checkpoints=(),
+                snapshot_freq=50000, opponent_model=None, pretrain_dataset=None, pretrain_epochs=1):
+    """
+    Train the model with progress tracking
+    
+    Args:
+        n_envs: Number of environments collecting rollouts in parallel
+        backend: How the environments are run, one of VEC_ENV_BACKENDS
+        seed: Base seed for the environments and the model
+        profile: Time the simulator's step phases and log them under sim/ in TensorBoard
+        frame_skip: Game ticks per policy decision; total_timesteps counts decisions
+        self_play: Play against past versions of the model instead of the scripted
+            opponent. The league starts with opponent_checkpoints (e.g.
+            "best_model.zip"), or the untrained model if there are none, and a
+            snapshot of the model joins it every snapshot_freq timesteps.
+        opponent_model: Path of a saved model that plays the opponent. One
+            InferenceServer runs it for all envs in micro-batches; its batch and
+            latency statistics are logged under opponent/ in TensorBoard.
+        pretrain_dataset: Shard directory of recorded matches (see dataset.py);
+            the policy first clones their actions for pretrain_epochs epochs
+    """
     
     # Create environment
-    env = create_env()
-    env = DummyVecEnv([lambda: env])
+    inference_server = None
+    opponent = None
+    if opponent_model is not None:
+        from .inference_server import InferenceServer
+        inference_server = InferenceServer(opponent_model).start()
+        opponent = inference_server.client()
+    env = create_vec_env(n_envs, backend=backend, observation=observation, seed=seed,
+                         profile=profile, frame_skip=frame_skip, self_play=self_play,
+                         opponent=opponent)
+    opponent_pool = None
+    if self_play:
+        from .self_play import OpponentPool, SelfPlayVecEnv
+        opponent_pool = OpponentPool(opponent_checkpoints, seed=seed)
+        env = SelfPlayVecEnv(env, opponent_pool)
+    
+    # Keep the rollout size (n_steps * n_envs) close to the single-env setting
+    hyperparams = dict(PPO_HYPERPARAMS)
+    hyperparams['n_steps'] = max(PPO_HYPERPARAMS['n_steps'] // n_envs, hyperparams['batch_size'])
     
     # Create model
     model = PPO(
         "MlpPolicy",
         env,
         verbose=1,
-        learning_rate=3e-4,
-        n_steps=2048,
-        batch_size=64,
-        n_epochs=10,
-        gamma=0.99,
-        gae_lambda=0.95,
-        clip_range=0.2,
-        ent_coef=0.01,
-        tensorboard_log="./tensorboard_logs/"
+        seed=seed,
+        tensorboard_log="./tensorboard_logs/",
+        **hyperparams
     )
     
+    if pretrain_dataset is not None:
+        from .dataset import TransitionDataset, pretrain_policy
+        dataset = TransitionDataset(pretrain_dataset, batch_size=hyperparams['batch_size'],
+                                    observation=observation, seed=seed)
+        pretrain_policy(model, dataset, epochs=pretrain_epochs,
+                        learning_rate=hyperparams['learning_rate'])
+    
+    if opponent_pool is not None and not len(opponent_pool):
+        opponent_pool.add_policy(model.policy, 'initial')
+    
     # Create callback
-    callback = TrainingCallback()
+    callback = TrainingCallback(log_profile=profile, opponent_pool=opponent_pool,
+                                snapshot_freq=snapshot_freq, inference_server=inference_server)
     
     # Train the model
     print("Starting training...")
@@ -532,6 +686,8 @@ def train_model(total_timesteps=1000000):
     plot_training_results(callback.episode_rewards, callback.episode_lengths, callback.win_rates)
     
     env.close()
+    if inference_server is not None:
+        inference_server.stop()
     return model, callback
 
 def plot_training_results(rewards, lengths, win_rates):
@@ -576,8 +732,9 @@ if __name__ == "__main__":
     
     # Print final results
     print("\nTraining Completed!")
-    print(f"Final Average Reward: {np.mean(callback.reward_buffer):.2f}")
-    print(f"Final Win Rate: {np.mean(callback.win_buffer) * 100:.2f}%")
+    final_stats = callback.stats.means()
+    print(f"Final Average Reward: {final_stats['reward']:.2f}")
+    print(f"Final Win Rate: {final_stats['win_rate']:.2f}%")
     
     # Test the trained model
     print("\nTesting trained model...")
@@ -0,0 +1,429 @@
+"""
+Load generator for server.py
+
+The play command opens many client connections from one event loop. Every
+client plays like pygame_online.py does: it sends a new input now and then
+and reads the snapshots its room broadcasts after every tick. It reports
+how many connections the server took, the inputs and snapshots per second
+and the input latency, i.e. the time from sending an input until the first
+snapshot that has applied it (which includes waiting for the room's next
+tick). A client whose match is decided connects again for a new one.
+
+Clients connect first; the timed run starts once every connection attempt
+is done, so the figures describe steady play. Running the generator on the
+same machine as the server shares its CPU with it; use another machine (or
+core) to see how far the server alone scales.
+
+The rooms command instead fills the server with rooms of idle players, step
+by step, and reads the server's counters back after each step to report
+the memory per room, the CPU time per room per tick and how many rooms one
+process can hold. The idle players stand still, but like network.py they
+send their input again every KEEPALIVE seconds so the server's idle_timeout
+doesn't drop them during a long run.
+
+Run from the repository root, with the server running:
+    python loadgen.py play --clients 200 --rate 5 --duration 20
+    python loadgen.py --json load.json play --clients 100
+    python loadgen.py rooms --step 50 --memory-mb 1024
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+from network import KEEPALIVE
+from protocol import (FULL, NOTHING, SNAPSHOT, STATS, WELCOME, FrameBuffer, ProtocolError, encode_input,
+                      encode_stats)
+from server import PORT, raise_fd_limit
+
+
+class ClientStats:
+    """Counters and input latencies shared by all clients"""
+
+    def __init__(self):
+        self.connected = 0
+        self.failed = 0
+        self.disconnected = 0
+        self.matches = 0  # Matches played to the end
+        self.inputs = 0
+        self.snapshots = 0
+        self.latencies = []  # Seconds from an input to its first snapshot, during the timed run
+
+
+class ServerFull(ConnectionError):
+    """The server turned the connection away (a FULL message)"""
+
+
+async def _receive(reader: asyncio.StreamReader, frames: FrameBuffer, timeout: float = None) -> list:
+    """Read from the connection until at least one message is complete and return the messages"""
+    while True:
+        data = await asyncio.wait_for(reader.read(65536), timeout)
+        if not data:
+            raise ConnectionError("server closed the connection")
+        frames.feed(data)
+        messages = frames.messages()
+        if messages:
+            return messages
+
+
+async def _connect(host: str, port: int, timeout: float = 10.0) -> tuple:
+    """Open a connection and read the server's welcome; returns reader, writer and their FrameBuffer"""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    frames = FrameBuffer()
+    try:
+        # Snapshots may follow the welcome in the same read; they are dropped
+        for message_type, _ in await _receive(reader, frames, timeout):
+            if message_type == WELCOME:
+                return reader, writer, frames
+            if message_type == FULL:
+                raise ServerFull("the server is full")
+        raise ConnectionError("no welcome from the server")
+    except BaseException:
+        writer.close()
+        raise
+
+
+async def _play_match(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, frames: FrameBuffer,
+                      rate: float, rng: random.Random, stats: ClientStats, stop: asyncio.Event) -> bool:
+    """Send inputs and read snapshots until stop or the end of the match; True if the match ended"""
+    sent = {}  # seq -> time sent, of inputs not seen in a snapshot yet
+    seq = 0
+
+    async def send_inputs():
+        nonlocal seq
+        # Spread the clients over the interval instead of sending in lockstep
+        await asyncio.sleep(rng.random() / rate)
+        while True:
+            seq += 1
+            sent[seq] = time.perf_counter()
+            writer.write(encode_input(seq, rng.randrange(4)))
+            stats.inputs += 1
+            await writer.drain()
+            await asyncio.sleep(1 / rate)
+
+    sender = asyncio.create_task(send_inputs())
+    stopping = asyncio.create_task(stop.wait())
+    try:
+        while True:
+            reading = asyncio.ensure_future(_receive(reader, frames))
+            await asyncio.wait((reading, stopping, sender), return_when=asyncio.FIRST_COMPLETED)
+            if not reading.done():
+                reading.cancel()
+                if sender.done():
+                    sender.result()  # Raises the sender's connection error
+                return False
+            now = time.perf_counter()
+            for message_type, snapshot in reading.result():
+                if message_type != SNAPSHOT:
+                    continue
+                stats.snapshots += 1
+                for acked in [s for s in sent if s <= snapshot.ack]:
+                    stats.latencies.append(now - sent.pop(acked))
+                if snapshot.winner is not None:
+                    stats.matches += 1
+                    return True
+    finally:
+        sender.cancel()
+        stopping.cancel()
+
+
+async def _client(host: str, port: int, rate: float, stats: ClientStats, connect_slots: asyncio.Semaphore,
+                  go: asyncio.Event, stop: asyncio.Event, seed: int):
+    rng = random.Random(seed)
+    try:
+        async with connect_slots:
+            reader, writer, frames = await _connect(host, port)
+    except (OSError, asyncio.TimeoutError, ConnectionError, ProtocolError):
+        stats.failed += 1
+        return
+    stats.connected += 1
+
+    try:
+        await go.wait()
+        while await _play_match(reader, writer, frames, rate, rng, stats, stop):
+            # Like pressing R after a match: reconnect for a new opponent
+            writer.close()
+            reader, writer, frames = await _connect(host, port)
+    except (OSError, asyncio.TimeoutError, ConnectionError, ProtocolError):
+        stats.disconnected += 1
+    finally:
+        writer.close()
+
+
+async def run_load(host: str = "127.0.0.1", port: int = PORT, clients: int = 200, rate: float = 5.0,
+                   duration: float = 10.0, connect_concurrency: int = 200, seed: int = 0) -> dict:
+    """
+    Connect the clients, let them play for duration seconds and return the figures
+
+    :param host: Server address
+    :param port: Server port
+    :param clients: Number of connections to open (two per room)
+    :param rate: Inputs per second per client
+    :param duration: Seconds of the timed run
+    :param connect_concurrency: Connection attempts in flight at once
+    :param seed: Seed of the inputs sent
+    """
+    stats = ClientStats()
+    go, stop = asyncio.Event(), asyncio.Event()
+    connect_slots = asyncio.Semaphore(connect_concurrency)
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(_client(host, port, rate, stats, connect_slots, go, stop, seed + i))
+             for i in range(clients)]
+    # The timed run starts once every client has connected or given up
+    while stats.connected + stats.failed < clients:
+        await asyncio.sleep(0.05)
+    connect_time = time.perf_counter() - start
+
+    # Only count what happens during the timed run
+    go.set()
+    stats.inputs = stats.snapshots = 0
+    await asyncio.sleep(duration)
+    inputs, snapshots, latencies = stats.inputs, stats.snapshots, stats.latencies[:]
+    stop.set()
+    await asyncio.gather(*tasks)
+
+    latencies = np.array(latencies) * 1000
+    percentiles = np.percentile(latencies, [50, 99, 99.9]) if latencies.size else [float('nan')] * 3
+    return {
+        'clients': clients,
+        'connected': stats.connected,
+        'failed': stats.failed,
+        'disconnected': stats.disconnected,
+        'connect_time': connect_time,
+        'duration': duration,
+        'matches': stats.matches,
+        'inputs': inputs,
+        'inputs_per_second': inputs / duration,
+        'snapshots': snapshots,
+        'snapshots_per_second': snapshots / duration,
+        'latency_ms': {
+            'mean': float(latencies.mean()) if latencies.size else float('nan'),
+            'p50': float(percentiles[0]),
+            'p99': float(percentiles[1]),
+            'p99.9': float(percentiles[2]),
+            'max': float(latencies.max()) if latencies.size else float('nan'),
+        },
+    }
+
+
+def print_report(report: dict):
+    latency = report['latency_ms']
+    print(f"Connections:  {report['connected']}/{report['clients']} "
+          f"({report['failed']} failed, {report['disconnected']} dropped) in {report['connect_time']:.2f}s")
+    print(f"Inputs:       {report['inputs']} in {report['duration']:.1f}s "
+          f"= {report['inputs_per_second']:.0f} msgs/s")
+    print(f"Snapshots:    {report['snapshots']} = {report['snapshots_per_second']:.0f} msgs/s "
+          f"({report['matches']} matches decided)")
+    print(f"Input latency: mean {latency['mean']:.2f} ms, p50 {latency['p50']:.2f} ms, "
+          f"p99 {latency['p99']:.2f} ms, p99.9 {latency['p99.9']:.2f} ms, max {latency['max']:.2f} ms")
+
+
+# ==================== ROOM CAPACITY ====================
+# Rooms of idle players (who never end their match) are opened in steps. After
+# each step the server's counters are read twice with STATS, window seconds
+# apart: the slope of resident memory over rooms is the memory of a room (both
+# connections with their stream buffers and tasks, the players, the room and
+# its core), and the CPU time between the two reads over the ticks run in
+# between is the CPU time of a room tick.
+
+async def _query_stats(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, frames: FrameBuffer) -> dict:
+    writer.write(encode_stats())
+    await writer.drain()
+    while True:
+        # Skip the snapshots of the stats connection's own room
+        for message_type, value in await _receive(reader, frames, 10):
+            if message_type == STATS:
+                return value
+
+
+async def _drain(reader: asyncio.StreamReader):
+    """Read and drop a connection's snapshots, like a client would read them"""
+    while await reader.read(65536):
+        pass
+
+
+async def _keepalive(stats_writer: asyncio.StreamWriter, writers: list):
+    """Send every idle player's (unchanged) input again every KEEPALIVE seconds"""
+    seq = 0
+    while True:
+        await asyncio.sleep(KEEPALIVE)
+        seq += 1
+        message = encode_input(seq, NOTHING)
+        for writer in [stats_writer] + writers:
+            if not writer.is_closing():
+                writer.write(message)
+
+
+async def measure_rooms(host: str = "127.0.0.1", port: int = PORT, step: int = 50, max_rooms: int = None,
+                        memory_mb: float = None, window: float = 2.0, max_cpu: float = 0.9,
+                        connect_concurrency: int = 200) -> dict:
+    """
+    Fill the server with rooms, step by step, and return the cost of a room and the room limit
+
+    Opening stops at max_rooms, when the server turns connections away or
+    they fail, when its ticks run late or use more than max_cpu of a core,
+    or when this process runs out of open files.
+
+    :param host: Server address
+    :param port: Server port
+    :param step: Rooms opened per step
+    :param max_rooms: Stop after this many rooms (None: go on until stopped)
+    :param memory_mb: Memory the server may use, for the memory bound on rooms
+    :param window: Seconds over which the CPU time is measured after each step
+    :param max_cpu: Share of a core the server may use before opening stops
+    :param connect_concurrency: Connection attempts in flight at once
+    """
+    # Keep a few files for the event loop, the stats connection and the like
+    max_clients = raise_fd_limit() - 64
+    connect_slots = asyncio.Semaphore(connect_concurrency)
+    connections = []
+    drains = []
+    outcome = {'failed': 0, 'rejected': 0}
+
+    async def open_one():
+        try:
+            async with connect_slots:
+                reader, writer, _ = await _connect(host, port)
+        except ServerFull:
+            outcome['rejected'] += 1
+        except (OSError, asyncio.TimeoutError, ConnectionError, ProtocolError):
+            outcome['failed'] += 1
+        else:
+            connections.append(writer)
+            drains.append(asyncio.create_task(_drain(reader)))
+
+    async def sample() -> dict:
+        await asyncio.sleep(0.5)  # Let the new rooms settle
+        first = await _query_stats(stats_reader, stats_writer, stats_frames)
+        start = time.perf_counter()
+        await asyncio.sleep(window)
+        last = await _query_stats(stats_reader, stats_writer, stats_frames)
+        elapsed = time.perf_counter() - start
+        ticks = max(last['ticks'] - first['ticks'], 1)
+        return {
+            'rooms': last['rooms'],
+            'connections': last['connections'],
+            'rss_mb': last['rss_mb'],
+            'cpu': (last['cpu_time'] - first['cpu_time']) / elapsed,
+            'cpu_us_per_tick': (last['cpu_time'] - first['cpu_time']) / ticks * 1e6,
+            'tick_us': (last['tick_time'] - first['tick_time']) / ticks * 1e6,
+            'late_ticks': last['late_ticks'] - first['late_ticks'],
+            'tick_rate': last['tick_rate'],
+            'fd_limit': last['fd_limit'],
+            'max_rooms': last['max_rooms'],
+        }
+
+    stats_reader, stats_writer, stats_frames = await _connect(host, port)
+    keepalive = asyncio.create_task(_keepalive(stats_writer, connections))
+    # The stats connection is a player too; pair it so every room is counted
+    await open_one()
+    samples = [await sample()]
+    stop_reason = None
+    try:
+        while stop_reason is None:
+            rooms = samples[-1]['rooms']
+            count = step if max_rooms is None else min(step, max_rooms - rooms)
+            count = min(count, (max_clients - len(connections)) // 2)
+            if count <= 0:
+                stop_reason = 'max_rooms' if max_rooms is not None and rooms >= max_rooms else 'client open files'
+                break
+            await asyncio.gather(*(open_one() for _ in range(2 * count)))
+            samples.append(await sample())
+            if outcome['rejected']:
+                stop_reason = 'server full'
+            elif outcome['failed']:
+                stop_reason = 'connect failures'
+            elif samples[-1]['late_ticks'] or samples[-1]['cpu'] > max_cpu:
+                stop_reason = 'cpu'
+    finally:
+        keepalive.cancel()
+        for writer in connections:
+            writer.close()
+        for drain in drains:
+            drain.cancel()
+        stats_writer.close()
+
+    rooms = np.array([s['rooms'] for s in samples], dtype=np.float64)
+    fit = np.ptp(rooms) > 0
+    # RSS = fixed cost of the server process + rooms * memory per room
+    mb_per_room, base_mb = (np.polyfit(rooms, [s['rss_mb'] for s in samples], 1).tolist() if fit
+                            else (float('nan'), samples[0]['rss_mb']))
+    cpu_per_room = float(np.polyfit(rooms, [s['cpu'] for s in samples], 1)[0]) if fit else float('nan')
+    server = samples[-1]
+    bounds = {'open files': server['fd_limit'] // 2}
+    if server['max_rooms'] is not None:
+        bounds['server max_rooms'] = server['max_rooms']
+    if cpu_per_room > 0:
+        bounds['one core'] = int(1 / cpu_per_room)
+    if memory_mb is not None and mb_per_room > 0:
+        bounds['memory'] = int((memory_mb - base_mb) / mb_per_room)
+    return {
+        'samples': samples,
+        'rooms_reached': int(rooms.max()),
+        'stop_reason': stop_reason,
+        'failed': outcome['failed'],
+        'rejected': outcome['rejected'],
+        'tick_rate': server['tick_rate'],
+        'kb_per_room': mb_per_room * 1024,
+        'base_rss_mb': base_mb,
+        'cpu_us_per_room_tick': cpu_per_room / server['tick_rate'] * 1e6,
+        'max_rooms_estimate': min(bounds.values()),
+        'bounds': bounds,
+    }
+
+
+def print_rooms_report(report: dict):
+    print(f"{'Rooms':>7} {'Connections':>12} {'RSS (MB)':>10} {'CPU':>6} {'CPU/tick (us)':>14} "
+          f"{'Tick (us)':>10} {'Late':>5}")
+    for s in report['samples']:
+        print(f"{s['rooms']:>7} {s['connections']:>12} {s['rss_mb']:>10.1f} {s['cpu']:>6.0%} "
+              f"{s['cpu_us_per_tick']:>14.1f} {s['tick_us']:>10.1f} {s['late_ticks']:>5}")
+    print(f"Rooms reached: {report['rooms_reached']} (stopped by {report['stop_reason']}; "
+          f"{report['failed']} failed, {report['rejected']} rejected)")
+    print(f"Memory per room: {report['kb_per_room']:.1f} KB, on top of {report['base_rss_mb']:.1f} MB "
+          f"for the server process itself")
+    print(f"CPU per room per tick: {report['cpu_us_per_room_tick']:.1f} us at {report['tick_rate']:g} ticks/s")
+    bounds = ', '.join(f"{name} {bound}" for name, bound in report['bounds'].items())
+    print(f"Max rooms per process: {report['max_rooms_estimate']} ({bounds})")
+
+
+# ==================== MAIN EXECUTION ====================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--connect-concurrency', type=int, default=200)
+    parser.add_argument('--json', dest='json_path', help='write the report here')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    play = subparsers.add_parser('play', help='clients playing: msgs/s and input latency')
+    play.add_argument('--clients', type=int, default=200)
+    play.add_argument('--rate', type=float, default=5.0, help='inputs per second per client')
+    play.add_argument('--duration', type=float, default=10.0, help='seconds of the timed run')
+    play.add_argument('--seed', type=int, default=0)
+
+    rooms = subparsers.add_parser('rooms', help='rooms opened in steps: memory and CPU per room, max rooms')
+    rooms.add_argument('--step', type=int, default=50, help='rooms opened per step')
+    rooms.add_argument('--max-rooms', type=int, help='stop after this many rooms')
+    rooms.add_argument('--memory-mb', type=float, help='memory the server may use')
+    rooms.add_argument('--window', type=float, default=2.0, help='seconds of CPU measurement per step')
+    rooms.add_argument('--max-cpu', type=float, default=0.9, help='share of a core the server may use')
+    args = parser.parse_args()
+
+    if args.command == 'play':
+        raise_fd_limit()
+        report = asyncio.run(run_load(args.host, args.port, args.clients, args.rate, args.duration,
+                                      args.connect_concurrency, args.seed))
+        print_report(report)
+    else:
+        report = asyncio.run(measure_rooms(args.host, args.port, args.step, args.max_rooms, args.memory_mb,
+                                           args.window, args.max_cpu, args.connect_concurrency))
+        print_rooms_report(report)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -1,61 +1,102 @@
 import socket
 import time
+from protocol import FULL, SNAPSHOT, WELCOME, FrameBuffer, ProtocolError, encode_input
+
+# Seconds after which an unchanged input is sent again, so the server
+# doesn't drop a player that stands still as idle
+KEEPALIVE = 5.0
 
 class Network:
-    def __init__(self):
+    def __init__(self, server='www.toliha.net', port=5555):
         self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server = 'www.toliha.net'  # Change to your server IP
-        self.port = 5555
+        self.server = server  # Change to your server IP
+        self.port = port
         self.addr = (self.server, self.port)
         self.player_id = -1
         self.connected = False
         self.last_connection_attempt = 0
+        self._frames = FrameBuffer()
+        self._seq = 0
+        self._action = None  # Last action sent
+        self._last_send = 0
         self.connect()
 
     def connect(self):
         now = time.time()
         if now - self.last_connection_attempt < 2:  # 2 second cooldown
             return False
-            
+
         try:
             self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.client.settimeout(3.0)
             self.client.connect(self.addr)
-            
-            initial_data = self.client.recv(2048).decode('utf-8')
-            if initial_data:
-                parts = initial_data.split(',')
-                if len(parts) == 3:
-                    self.player_id = int(parts[2])
-                    self.connected = True
-                    print(f"Connected as player {self.player_id}")
-                    return True
-        except Exception as e:
+            self._frames = FrameBuffer()
+            self.player_id = self._read_welcome()
+            # Snapshots are polled once per frame from here on
+            self.client.setblocking(False)
+            self._seq = 0
+            self._action = None
+            self.connected = True
+            print(f"Connected as player {self.player_id}")
+            return True
+        except (OSError, ValueError) as e:
             print(f"Connection error: {e}")
-        
+
         self.last_connection_attempt = time.time()
         return False
 
-    def send(self, data, retries=3):
-        if not self.connected and not self.connect():
+    def _read_welcome(self):
+        '''Player id from the server's welcome'''
+        while True:
+            if not self._frames.recv_into(self.client):
+                raise ConnectionError("Server closed the connection")
+            for message_type, value in self._frames.messages():
+                if message_type == WELCOME:
+                    return value[2]
+                if message_type == FULL:
+                    raise ConnectionError("Game is full")
+
+    def send_input(self, action):
+        '''Tell the server the action the player holds (0 up, 1 down, 2 shoot, 3 nothing)'''
+        if not self.connected:
+            return False
+        now = time.time()
+        if action == self._action and now - self._last_send < KEEPALIVE:
+            return True
+        self._seq += 1
+        try:
+            self.client.sendall(encode_input(self._seq, action))
+        except OSError as e:
+            print(f"Network error: {e}")
+            self.connected = False
+            return False
+        self._action = action
+        self._last_send = now
+        return True
+
+    def poll(self):
+        '''Newest snapshot received since the last poll, or None'''
+        if not self.connected:
             return None
-            
-        for attempt in range(retries):
-            try:
-                self.client.settimeout(2.0)
-                self.client.sendall(str.encode(data))
-                reply = self.client.recv(2048).decode('utf-8')
-                return reply if reply else None
-            except socket.timeout:
-                print(f"Timeout (attempt {attempt+1}/{retries})")
-                if attempt == retries-1:
-                    self.connected = False
-            except socket.error as e:
-                print(f"Network error: {e}")
-                self.connected = False
-                if not self.connect():
-                    return None
-        return None
+        try:
+            while self._frames.recv_into(self.client):
+                pass
+            print("Server closed the connection")
+            self.connected = False
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            print(f"Network error: {e}")
+            self.connected = False
+        snapshot = None
+        try:
+            for message_type, value in self._frames.messages():
+                if message_type == SNAPSHOT:
+                    snapshot = value
+        except ProtocolError as e:
+            print(f"Network error: {e}")
+            self.connected = False
+        return snapshot
 
     def get_player_id(self):
         return self.player_id
@@ -65,4 +106,4 @@ class Network:
             self.client.close()
         except:
             pass
-        self.connected = False
\ No newline at end of file
+        self.connected = False
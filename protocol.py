@@ -0,0 +1,332 @@
+"""
+Messages between server.py and its clients (network.py, loadgen.py)
+
+Every message is a binary frame: a little-endian header with the length of
+the rest of the frame (2 bytes), the protocol version (1 byte) and the
+message type (1 byte), followed by the type's fixed-layout struct records.
+A reader collects received bytes in a FrameBuffer and decodes every
+complete frame in place with struct.unpack_from on a memoryview, so reads
+that split or coalesce frames are handled and no message is ever cut off.
+
+    server -> client  WELCOME   x, y, player_id (u8 each)            on connect
+    server -> client  FULL      -                                    no room left
+    client -> server  INPUT     seq (u32), action (u8)               the action held
+                                                                      from now on
+    server -> client  SNAPSHOT  tick (u32), ack (u32), winner (i8),  after every tick;
+                                2 x player: x, y (u8), health (i8),  ack is the seq of
+                                count (u16), count x bullet:         the last input
+                                x, y (f32), owner (u8)               applied, winner -1
+                                                                      while playing
+    client -> server  STATS     -
+    server -> client  STATS     the server's counters as JSON
+
+Actions are the cores': 0 up, 1 down, 2 shoot, 3 nothing.
+
+Run from the repository root to compare the codec with the earlier text
+protocol ("SNAP tick,ack,winner|x0,y0,h0|x1,y1,h1|bx,by,owner|...\\n"):
+    python protocol.py --bullets 0 4 16 32 [--json codec.json]
+"""
+
+import argparse
+import json
+import struct
+import time
+from collections import namedtuple
+
+VERSION = 1
+WELCOME, FULL, INPUT, SNAPSHOT, STATS = range(1, 6)
+NOTHING = 3  # Action of a player that sent no input yet
+
+_HEADER = struct.Struct('<HBB')  # length of version + type + payload, version, type
+_WELCOME = struct.Struct('<BBB')  # x, y, player_id
+_INPUT = struct.Struct('<IB')  # seq, action
+_SNAPSHOT = struct.Struct('<IIb')  # tick, ack, winner
+_PLAYER = struct.Struct('<BBb')  # x, y, health
+_COUNT = struct.Struct('<H')  # number of bullets
+_BULLET = struct.Struct('<ffB')  # x, y, owner
+_LENGTH_OFFSET = 2  # The length counts the version and type bytes
+
+# players: ((x, y, health) of player 0, of player 1); bullets: [(x, y, owner), ...]
+Snapshot = namedtuple('Snapshot', ['tick', 'ack', 'winner', 'players', 'bullets'])
+
+
+class ProtocolError(ValueError):
+    """A frame that is malformed or of another protocol version"""
+
+
+# ==================== ENCODING ====================
+
+def _frame(message_type: int, payload: bytes = b'') -> bytes:
+    return _HEADER.pack(len(payload) + 2, VERSION, message_type) + payload
+
+
+def encode_welcome(x: int, y: int, player_id: int) -> bytes:
+    return _frame(WELCOME, _WELCOME.pack(x, y, player_id))
+
+
+def encode_full() -> bytes:
+    return _frame(FULL)
+
+
+def encode_input(seq: int, action: int) -> bytes:
+    return _frame(INPUT, _INPUT.pack(seq, action))
+
+
+def encode_state(core) -> bytes:
+    """Players and bullets of an AIFightClubCore, the part of a snapshot both players get"""
+    bullets = core.bullets.items()
+    return b''.join([
+        _PLAYER.pack(core.agent['x'], core.agent['y'], core.agent['health']),
+        _PLAYER.pack(core.opponent['x'], core.opponent['y'], core.opponent['health']),
+        _COUNT.pack(len(bullets)),
+        *[_BULLET.pack(*bullet) for bullet in bullets],
+    ])
+
+
+def encode_snapshot(tick: int, ack: int, winner, state: bytes) -> bytes:
+    payload_size = _SNAPSHOT.size + len(state)
+    return (_HEADER.pack(payload_size + 2, VERSION, SNAPSHOT)
+            + _SNAPSHOT.pack(tick, ack, -1 if winner is None else winner) + state)
+
+
+def encode_stats(stats: dict = None) -> bytes:
+    """A stats request (no stats) or reply"""
+    return _frame(STATS, json.dumps(stats).encode() if stats is not None else b'')
+
+
+# ==================== DECODING ====================
+
+def _decode_snapshot(view: memoryview, offset: int, end: int) -> Snapshot:
+    tick, ack, winner = _SNAPSHOT.unpack_from(view, offset)
+    offset += _SNAPSHOT.size
+    players = (_PLAYER.unpack_from(view, offset), _PLAYER.unpack_from(view, offset + _PLAYER.size))
+    offset += 2 * _PLAYER.size
+    count, = _COUNT.unpack_from(view, offset)
+    offset += _COUNT.size
+    if offset + count * _BULLET.size != end:
+        raise ProtocolError(f"Snapshot of {count} bullets with {end - offset} bytes of bullets")
+    bullets = list(_BULLET.iter_unpack(view[offset:end])) if count else []
+    return Snapshot(tick, ack, None if winner < 0 else winner, players, bullets)
+
+
+def _decode(message_type: int, view: memoryview, offset: int, end: int):
+    """Value of one message whose payload is view[offset:end]"""
+    try:
+        if message_type == SNAPSHOT:
+            return _decode_snapshot(view, offset, end)
+        if message_type == INPUT:
+            seq, action = _INPUT.unpack_from(view, offset)
+            if not 0 <= action <= 3:
+                raise ProtocolError(f"Unknown action {action}")
+            return seq, action
+        if message_type == WELCOME:
+            return _WELCOME.unpack_from(view, offset)
+        if message_type == STATS:
+            return json.loads(bytes(view[offset:end])) if end > offset else None
+        if message_type == FULL:
+            return None
+    except (struct.error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ProtocolError(f"Malformed message of type {message_type}: {e}") from e
+    raise ProtocolError(f"Unknown message type {message_type}")
+
+
+class FrameBuffer:
+    """
+    Received bytes and the complete frames in them
+
+    Data is appended with feed() or received straight into the buffer with
+    recv_into(); messages() decodes every complete frame in place and keeps
+    the bytes of an incomplete one for the next call.
+
+    :param size: Initial size in bytes; the buffer grows to hold a frame
+        that doesn't fit
+    """
+
+    def __init__(self, size: int = 65536):
+        self._data = bytearray(size)
+        self._start = 0  # First byte not decoded yet
+        self._end = 0  # End of the bytes received
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def _reserve(self, size: int):
+        """Make room for size more bytes after the ones received"""
+        if self._end + size <= len(self._data):
+            return
+        pending = self._end - self._start
+        if pending + size > len(self._data):
+            data = bytearray(max(2 * len(self._data), pending + size))
+            data[:pending] = self._data[self._start:self._end]
+            self._data = data
+        else:
+            self._data[:pending] = self._data[self._start:self._end]
+        self._start, self._end = 0, pending
+
+    def feed(self, data: bytes):
+        self._reserve(len(data))
+        self._data[self._end:self._end + len(data)] = data
+        self._end += len(data)
+
+    def recv_into(self, sock, size: int = 65536) -> int:
+        """Receive up to size bytes from a socket straight into the buffer; 0 when it closed"""
+        self._reserve(size)
+        with memoryview(self._data) as view:
+            received = sock.recv_into(view[self._end:self._end + size])
+        self._end += received
+        return received
+
+    def messages(self) -> list:
+        """(message_type, value) of every complete frame received, in order"""
+        messages = []
+        with memoryview(self._data) as view:
+            while self._end - self._start >= _HEADER.size:
+                length, version, message_type = _HEADER.unpack_from(view, self._start)
+                if version != VERSION:
+                    raise ProtocolError(f"Protocol version {version}, expected {VERSION}")
+                if length < 2:
+                    raise ProtocolError(f"Frame length {length}")
+                end = self._start + _LENGTH_OFFSET + length
+                if end > self._end:
+                    break
+                messages.append((message_type, _decode(message_type, view, self._start + _HEADER.size, end)))
+                self._start = end
+        if self._start == self._end:
+            self._start = self._end = 0
+        return messages
+
+
+# ==================== CODEC BENCHMARK ====================
+# The text protocol these frames replaced, kept to compare against
+
+def _text_encode_state(core) -> str:
+    parts = [f"{agent['x']},{agent['y']},{agent['health']}" for agent in (core.agent, core.opponent)]
+    parts += [f"{x:.2f},{y:.2f},{owner}" for x, y, owner in core.bullets.items()]
+    return '|'.join(parts)
+
+
+def _text_encode_snapshot(tick: int, ack: int, winner, state: str) -> bytes:
+    return f"SNAP {tick},{ack},{-1 if winner is None else winner}|{state}\n".encode()
+
+
+def _text_decode_snapshot(line: str) -> Snapshot:
+    parts = line[5:].split('|')
+    tick, ack, winner = map(int, parts[0].split(','))
+    players = tuple(tuple(map(int, part.split(','))) for part in parts[1:3])
+    bullets = []
+    for part in parts[3:]:
+        x, y, owner = part.split(',')
+        bullets.append((float(x), float(y), int(owner)))
+    return Snapshot(tick, ack, None if winner < 0 else winner, players, bullets)
+
+
+def _text_decode_stream(chunks: list) -> list:
+    """Snapshots in a stream of received chunks, split into lines like network.py used to"""
+    snapshots = []
+    buffer = b''
+    for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        snapshots.extend(_text_decode_snapshot(line.decode()) for line in lines)
+    return snapshots
+
+
+def _binary_decode_stream(chunks: list) -> list:
+    buffer = FrameBuffer()
+    snapshots = []
+    for chunk in chunks:
+        buffer.feed(chunk)
+        snapshots.extend(value for _, value in buffer.messages())
+    return snapshots
+
+
+def _benchmark_core(bullets: int, seed: int = 0):
+    """A core-shaped state with the given number of bullets in flight"""
+    import random
+    from types import SimpleNamespace
+    from game.bullet_pool import BulletPool
+
+    rng = random.Random(seed)
+    pool = BulletPool(capacity=max(bullets, 1), grid_size=20)
+    for _ in range(bullets):
+        owner = rng.randrange(2)
+        pool.spawn(rng.uniform(0, 20), rng.randrange(20), 1 - 2 * owner, 0, 5.0, owner)
+    return SimpleNamespace(agent={'x': 3, 'y': rng.randrange(20), 'health': 3},
+                           opponent={'x': 16, 'y': rng.randrange(20), 'health': 2}, bullets=pool)
+
+
+def _benchmark_state(core) -> tuple:
+    return tuple((agent['x'], agent['y'], agent['health']) for agent in (core.agent, core.opponent))
+
+
+def _time_per_call(function, repeats: int) -> float:
+    """Best of 5 runs of repeats calls, in microseconds per call"""
+    best = float('inf')
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            function()
+        best = min(best, time.perf_counter() - start)
+    return best / repeats * 1e6
+
+
+def benchmark_codecs(bullet_counts=(0, 4, 16, 32), messages: int = 1000, chunk_size: int = 1460) -> list:
+    """
+    Encode and decode snapshots with the binary and the text codec
+
+    Decoding is measured on a stream of messages snapshots cut into
+    chunk_size-byte reads (one TCP segment each by default), so both codecs
+    also pay for reassembling messages across reads.
+    """
+    results = []
+    for count in bullet_counts:
+        core = _benchmark_core(count)
+        binary = encode_snapshot(1234, 56, None, encode_state(core))
+        text = _text_encode_snapshot(1234, 56, None, _text_encode_state(core))
+        repeats = 20000 // (count + 4) + 100
+        result = {'bullets': count}
+        for name, encode, message, decode_stream in (
+                ('binary', lambda: encode_snapshot(1234, 56, None, encode_state(core)), binary, _binary_decode_stream),
+                ('text', lambda: _text_encode_snapshot(1234, 56, None, _text_encode_state(core)), text,
+                 _text_decode_stream)):
+            stream = message * messages
+            chunks = [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+            decoded = decode_stream(chunks)
+            if len(decoded) != messages or decoded[0].players != _benchmark_state(core):
+                raise AssertionError(f"The {name} codec did not round-trip")
+            result[name] = {
+                'bytes': len(message),
+                'encode_us': _time_per_call(encode, repeats),
+                'decode_us': _time_per_call(lambda: decode_stream(chunks), max(repeats // messages, 3)) / messages,
+            }
+        results.append(result)
+    return results
+
+
+def print_benchmark(results: list):
+    print(f"{'Bullets':>7} | {'Bytes':>13} | {'Encode (us)':>15} | {'Decode (us)':>15} | {'Speedup':>13}")
+    print(f"{'':>7} | {'binary':>6} {'text':>6} | {'binary':>7} {'text':>7} | {'binary':>7} {'text':>7} "
+          f"| {'enc':>6} {'dec':>6}")
+    for result in results:
+        binary, text = result['binary'], result['text']
+        print(f"{result['bullets']:>7} | {binary['bytes']:>6} {text['bytes']:>6} "
+              f"| {binary['encode_us']:>7.2f} {text['encode_us']:>7.2f} "
+              f"| {binary['decode_us']:>7.2f} {text['decode_us']:>7.2f} "
+              f"| {text['encode_us'] / binary['encode_us']:>5.1f}x {text['decode_us'] / binary['decode_us']:>5.1f}x")
+
+
+# ==================== MAIN EXECUTION ====================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Snapshot codec benchmark: binary frames vs the text protocol")
+    parser.add_argument('--bullets', type=int, nargs='+', default=[0, 4, 16, 32], help='bullets per snapshot')
+    parser.add_argument('--messages', type=int, default=1000, help='snapshots per decoded stream')
+    parser.add_argument('--chunk-size', type=int, default=1460, help='bytes per simulated read')
+    parser.add_argument('--json', dest='json_path', help='write the results here')
+    args = parser.parse_args()
+
+    results = benchmark_codecs(args.bullets, args.messages, args.chunk_size)
+    print_benchmark(results)
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -1,5 +1,8 @@
 import pygame, time
 import os
+import sys
+from game.bullet_pool import BulletPool
+from game.dataset import HumanGameRecorder
 
 
 ASSETS_PATH = os.path.join(os.path.dirname(__file__), 'Assets')
@@ -10,6 +13,8 @@ screen_height = grid_size * cell_size
 screen_width = grid_size * cell_size
 screen = pygame.display.set_mode((screen_width, screen_height))
 pygame.display.set_caption('AI Fight Club')
+# Cells per bullet update; bullets are updated twice per frame
+BULLET_SPEED = 1.0
 colors = {
     'background': (255, 255, 255), # white
     'grid': (200, 200, 200), # black
@@ -20,11 +25,11 @@ colors = {
 }
 
 class Agent:
-    def __init__(self, x, y, color, dx, shoot_key, player_id):
+    def __init__(self, x, y, color, dx, shoot_key, player_id, bullets):
         self.x = x
         self.y = y
         self.color = color
-        self.bullets = []
+        self.bullets = bullets  # BulletPool shared by both agents
         self.dx = dx
         self.shoot_key = shoot_key
 
@@ -37,7 +42,8 @@ class Agent:
         self.hit_time = 0
         self.player_id = player_id
 
-    def check_bullet_collision(self, bullet):
+    def check_bullet_collision(self, owner):
+        '''Take a hit from the first bullet fired by owner that reached this agent'''
         if not self.alive:
             return False
             
@@ -45,7 +51,9 @@ class Agent:
         if now - self.hit_time < self.hit_cooldown:
             return False
             
-        if (abs(self.x - bullet.x) < 1 and abs(self.y - bullet.y) < 1):
+        hit = self.bullets.find_hit(self.x, self.y, owner)
+        if hit >= 0:
+            self.bullets.remove(hit)
             self.health -= 1
             self.hit_time = now
             if self.health <= 0:
@@ -79,54 +87,37 @@ class Agent:
     def shoot(self):
         now = pygame.time.get_ticks()
         if now - self.last_shot > self.shot_cooldown:
-            self.bullets.append(Bullet(self.x, self.y, self.dx, 0))
+            self.bullets.spawn(self.x, self.y, self.dx, 0, BULLET_SPEED, self.player_id)
             self.last_shot = now
 
-    def update_bullets(self):
-        for bullet in self.bullets[:]:
-            bullet.move()
-            bullet.draw()
-            if bullet.off_screen():
-                self.bullets.remove(bullet)
-
     def update_position(self, x, y):
         self.x = x
         self.y = y
 
 
-class Bullet:
-    def __init__(self, x, y, dx, dy):
-        self.x = x
-        self.y = y
-        self.dx = dx
-        self.dy = dy
-        #self.image = pygame.transform.scale(bullet_img, (cell_size // 2, cell_size // 2))
-        try:
-            bullet_path = os.path.join(ASSETS_PATH, 'bullet_img.png')
-            self.image = pygame.image.load(bullet_path).convert_alpha()
-            self.image = pygame.transform.scale(self.image, (cell_size // 2, cell_size // 2))
-        except:
-            self.image = pygame.Surface((cell_size // 2, cell_size // 2), pygame.SRCALPHA)
-            pygame.draw.circle(self.image, (255, 0, 0), 
-                             (cell_size // 4, cell_size // 4), 
-                             cell_size // 4)
-    
-    def move(self):
-        self.x += self.dx
-        self.y += self.dy
-
-
-    def draw(self):
-        img_width, img_height = bullet_img.get_size()
-        pos_x = self.x * cell_size + (cell_size - img_width) // 2
-        pos_y = self.y * cell_size + (cell_size - img_height) // 2
+def update_bullets(bullets):
+    '''Move and draw every bullet, then drop the ones that left the grid'''
+    bullets.advance()
+    img_width, img_height = bullet_img.get_size()
+    for x, y, _ in bullets.items():
+        pos_x = x * cell_size + (cell_size - img_width) // 2
+        pos_y = y * cell_size + (cell_size - img_height) // 2
         screen.blit(bullet_img, (pos_x, pos_y))
+    bullets.cull(grid_size)
+
 
-    def off_screen(self):
-        '''Remove bullet if its off the screen: Save memory
-        If bullets are fired left or right, change self.x <= screen width to screen height
-        Else change screen_width to screen_height'''
-        return not (self.x >= 0 and self.x <= screen_width)
+def load_bullet_image():
+    '''Load the bullet sprite once, falling back to a red circle'''
+    try:
+        bullet_path = os.path.join(ASSETS_PATH, 'bullet_img.png')
+        image = pygame.image.load(bullet_path).convert_alpha()
+        return pygame.transform.scale(image, (cell_size // 2, cell_size // 2))
+    except Exception:
+        image = pygame.Surface((cell_size // 2, cell_size // 2), pygame.SRCALPHA)
+        pygame.draw.circle(image, colors['bullet'],
+                           (cell_size // 4, cell_size // 4),
+                           cell_size // 4)
+        return image
 
 
 def draw_grid():
@@ -183,23 +174,16 @@ def draw_game_over(screen, font, winner):
     restart_rect = restart_text.get_rect(center=(screen_width // 2, screen_height // 2 + 30))
     screen.blit(restart_text, restart_rect)
 
-def main():
+def main(recorder=None):
+    '''Play local games; a HumanGameRecorder records both players' moves'''
     try:
         global bullet_img
-        try:
-            bullet_path = os.path.join(ASSETS_PATH, 'bullet_img.png')
-            bullet_img = pygame.image.load(bullet_path).convert_alpha()
-            # Scale to appropriate size (about 1/2 to 2/3 of cell_size works well)
-            #bullet_img = pygame.transform.scale(bullet_img, (cell_size // 2, cell_size // 2))
-        except Exception as e:
-            bullet_image = pygame.Surface((cell_size, cell_size), pygame.SRCALPHA)
-            pygame.draw.circle(bullet_image, (255, 0, 0), 
-                            (cell_size // 4, cell_size // 4), 
-                            cell_size // 4)
+        bullet_img = load_bullet_image()
 
         clock = pygame.time.Clock()
-        agent = Agent(3, 10, colors['agent1'], dx = 1, shoot_key = pygame.K_SPACE, player_id = 0)
-        opponent = Agent(16, 10, colors['agent2'], dx = -1, shoot_key = pygame.K_RETURN, player_id = 1)
+        bullets = BulletPool(grid_size=grid_size)
+        agent = Agent(3, 10, colors['agent1'], dx = 1, shoot_key = pygame.K_SPACE, player_id = 0, bullets = bullets)
+        opponent = Agent(16, 10, colors['agent2'], dx = -1, shoot_key = pygame.K_RETURN, player_id = 1, bullets = bullets)
         running = True
         font = pygame.font.SysFont('Arial', 24, bold=True)
         running = True
@@ -219,11 +203,13 @@ def main():
                         if show_help:
                             show_help = False
                         elif game_over and event.key == pygame.K_r:
-                            return main()
+                            return main(recorder)
                         elif event.key == pygame.K_ESCAPE:
                             running = False
 
             if game_over:
+                if recorder is not None:
+                    recorder.end((agent, opponent), bullets, current_time, winner)
                 screen.fill(colors['background'])
                 draw_grid()
                 agent.draw()
@@ -234,6 +220,10 @@ def main():
 
             if not show_help:
                 keys = pygame.key.get_pressed()
+                if recorder is not None:
+                    recorder.frame((agent, opponent), bullets, current_time, (
+                        HumanGameRecorder.action(keys[pygame.K_w], keys[pygame.K_s], keys[agent.shoot_key]),
+                        HumanGameRecorder.action(keys[pygame.K_UP], keys[pygame.K_DOWN], keys[opponent.shoot_key])))
 
                 # agent 1
                 if keys[pygame.K_w]:
@@ -251,47 +241,51 @@ def main():
                 if keys[opponent.shoot_key]:
                     opponent.shoot()
             
-            agent.update_bullets()
-            opponent.update_bullets()
+            update_bullets(bullets)
         
-            for bullet in agent.bullets[:]:
-                if opponent.check_bullet_collision(bullet):
-                    agent.bullets.remove(bullet)
-                    if not opponent.alive:
-                        game_over = True
-                        winner = agent.player_id
-                        #try:
-                        #    n.send("GAME_OVER")
-                        #except:
-                        #    pass
-
-            for bullet in opponent.bullets[:]:
-                if agent.check_bullet_collision(bullet):
-                    opponent.bullets.remove(bullet)
-                    if not agent.alive:
-                        game_over = True
-                        winner = opponent.player_id
-                        #try:
-                        #    n.send("GAME_OVER")
-                        #except:
-                        #    pass
+            if opponent.check_bullet_collision(agent.player_id):
+                if not opponent.alive:
+                    game_over = True
+                    winner = agent.player_id
+                    #try:
+                    #    n.send("GAME_OVER")
+                    #except:
+                    #    pass
+
+            if agent.check_bullet_collision(opponent.player_id):
+                if not agent.alive:
+                    game_over = True
+                    winner = opponent.player_id
+                    #try:
+                    #    n.send("GAME_OVER")
+                    #except:
+                    #    pass
 
             screen.fill(colors['background'])
             draw_grid()
             agent.draw()
             opponent.draw()
-            agent.update_bullets()
-            opponent.update_bullets()
+            update_bullets(bullets)
 
             if show_help:
                 draw_help_box(screen, font)
 
             pygame.display.flip()
             clock.tick(20)
+
+        if recorder is not None:
+            # A game that was quit before it ended is recorded as cut off
+            recorder.end((agent, opponent), bullets, pygame.time.get_ticks())
     except Exception as e:
         print(f'Game error: {e}')
     finally:
         pygame.quit()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # python pygame_local.py [--record DIR] records the games for dataset.py
+    recorder = None
+    if '--record' in sys.argv:
+        recorder = HumanGameRecorder(sys.argv[sys.argv.index('--record') + 1])
+    main(recorder)
+    if recorder is not None:
+        recorder.close()
\ No newline at end of file
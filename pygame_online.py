@@ -1,6 +1,10 @@
 import pygame
 import os
+import sys
 from network import Network
+from protocol import NOTHING
+from game.bullet_pool import BulletPool
+from game.dataset import HumanGameRecorder
 
 # Initialize pygame
 pygame.init()
@@ -14,6 +18,11 @@ screen_width = grid_size * cell_size
 screen = pygame.display.set_mode((screen_width, screen_height))
 pygame.display.set_caption('AI Fight Club')
 
+# Cells per second the server's bullets move, for the recorded states
+BULLET_SPEED = 5.0
+# Seconds without a snapshot before the game shows that it waits for an opponent
+SNAPSHOT_TIMEOUT = 0.5
+
 # Colors
 colors = {
     'background': (255, 255, 255),
@@ -26,38 +35,26 @@ colors = {
 }
 
 class Agent:
-    def __init__(self, x, y, color, dx, shoot_key, player_id):
+    """A player as last reported by the server"""
+
+    def __init__(self, x, y, color, dx, player_id):
         self.x = x
         self.y = y
         self.color = color
-        self.bullets = []
         self.dx = dx
-        self.shoot_key = shoot_key
         self.player_id = player_id
         self.last_shot = 0
-        self.shot_cooldown = 500
         self.health = 3
         self.alive = True
-        self.hit_cooldown = 0
         self.hit_time = 0
 
-    def check_bullet_collision(self, bullet):
-        if bullet.owner_id == self.player_id:
-            return False
-        if not self.alive:
-            return False
-            
-        now = pygame.time.get_ticks()
-        if now - self.hit_time < self.hit_cooldown:
-            return False
-            
-        if (abs(self.x - bullet.x) < 1 and abs(self.y - bullet.y) < 1):
-            self.health -= 1
+    def update(self, x, y, health, now):
+        if health < self.health:
             self.hit_time = now
-            if self.health <= 0:
-                self.alive = False
-            return True
-        return False
+        self.x = x
+        self.y = y
+        self.health = health
+        self.alive = health > 0
 
     def draw(self):
         # Flash when hit
@@ -76,58 +73,40 @@ class Agent:
             pygame.draw.rect(screen, colors['health'],
                            (self.x * cell_size, self.y * cell_size - 10,
                             health_width, 5))
-        
-    def move(self, dy):
-        new_y = self.y + dy
-        if 0 <= new_y < grid_size:
-            self.y = new_y
-    
-    def shoot(self):
-        now = pygame.time.get_ticks()
-        if now - self.last_shot > self.shot_cooldown and self.alive:
-            self.bullets.append(Bullet(self.x, self.y, self.dx, 0, self.player_id))
-            self.last_shot = now
-
-    def update_bullets(self):
-        for bullet in self.bullets[:]:
-            bullet.move()
-            bullet.draw()
-            if bullet.off_screen():
-                self.bullets.remove(bullet)
-
-    def update_position(self, x, y):
-        self.x = x
-        self.y = y
 
-class Bullet:
-    def __init__(self, x, y, dx, dy, owner_id):
-        self.x = x
-        self.y = y
-        self.dx = dx * 0.5  # Slower bullets
-        self.dy = dy * 0.5
-        self.owner_id = owner_id
-        try:
-            bullet_path = os.path.join(ASSETS_PATH, 'bullet_img.png')
-            self.image = pygame.image.load(bullet_path).convert_alpha()
-            self.image = pygame.transform.scale(self.image, (cell_size // 2, cell_size // 2))
-        except:
-            self.image = pygame.Surface((cell_size // 2, cell_size // 2), pygame.SRCALPHA)
-            pygame.draw.circle(self.image, (255, 0, 0), 
-                             (cell_size // 4, cell_size // 4), 
-                             cell_size // 4)
-    
-    def move(self):
-        self.x += self.dx
-        self.y += self.dy
 
-    def draw(self):
-        img_width, img_height = self.image.get_size()
-        pos_x = self.x * cell_size + (cell_size - img_width) // 2
-        pos_y = self.y * cell_size + (cell_size - img_height) // 2
-        screen.blit(self.image, (pos_x, pos_y))
+def update_bullets(bullets, snapshot, agents, now):
+    '''Replace the bullets with the snapshot's'''
+    previous = [bullets.owned_by(agent.player_id).size for agent in agents]
+    bullets.clear()
+    for x, y, owner in snapshot.bullets:
+        bullets.spawn(x, y, agents[owner].dx, 0, BULLET_SPEED, owner)
+    for agent, count in zip(agents, previous):
+        if bullets.owned_by(agent.player_id).size > count:
+            agent.last_shot = now
+
+
+def draw_bullets(bullets):
+    img_width, img_height = bullet_img.get_size()
+    for x, y, _ in bullets.items():
+        pos_x = x * cell_size + (cell_size - img_width) // 2
+        pos_y = y * cell_size + (cell_size - img_height) // 2
+        screen.blit(bullet_img, (pos_x, pos_y))
+
+
+def load_bullet_image():
+    '''Load the bullet sprite once, falling back to a red circle'''
+    try:
+        bullet_path = os.path.join(ASSETS_PATH, 'bullet_img.png')
+        image = pygame.image.load(bullet_path).convert_alpha()
+        return pygame.transform.scale(image, (cell_size // 2, cell_size // 2))
+    except Exception:
+        image = pygame.Surface((cell_size // 2, cell_size // 2), pygame.SRCALPHA)
+        pygame.draw.circle(image, colors['bullet'],
+                           (cell_size // 4, cell_size // 4),
+                           cell_size // 4)
+        return image
 
-    def off_screen(self):
-        return not (0 <= self.x < grid_size and 0 <= self.y < grid_size)
 
 def draw_grid():
     for x in range(grid_size):
@@ -173,7 +152,12 @@ def draw_game_over(screen, font, winner):
     restart_rect = restart_text.get_rect(center=(screen_width // 2, screen_height // 2 + 30))
     screen.blit(restart_text, restart_rect)
 
-def main():
+def draw_waiting(screen, font):
+    text = font.render("Waiting for an opponent...", True, (0, 0, 0))
+    screen.blit(text, text.get_rect(center=(screen_width // 2, screen_height // 2)))
+
+def main(record_dir=None):
+    '''Play an online game; with record_dir the local player's moves are recorded'''
     try:
         n = Network()
         player_id = n.get_player_id()
@@ -182,13 +166,14 @@ def main():
             pygame.quit()
             return
         
+        global bullet_img
+        bullet_img = load_bullet_image()
+
         # Initialize agents
-        if player_id == 0:
-            agent = Agent(3, 10, colors['agent1'], 1, pygame.K_SPACE, 0)
-            opponent = Agent(17, 10, colors['agent2'], -1, pygame.K_RETURN, 1)
-        else:
-            agent = Agent(17, 10, colors['agent2'], -1, pygame.K_RETURN, 1)
-            opponent = Agent(3, 10, colors['agent1'], 1, pygame.K_SPACE, 0)
+        bullets = BulletPool(grid_size=grid_size)
+        players = (Agent(3, 10, colors['agent1'], 1, 0), Agent(16, 10, colors['agent2'], -1, 1))
+        agent, opponent = players[player_id], players[1 - player_id]
+        recorder = HumanGameRecorder(record_dir, players=(player_id,)) if record_dir else None
 
         clock = pygame.time.Clock()
         font = pygame.font.SysFont('Arial', 24, bold=True)
@@ -196,8 +181,7 @@ def main():
         show_help = True
         game_over = False
         winner = None
-        last_network_time = 0
-        network_delay = 100  # ms between network updates
+        last_snapshot_time = float('-inf')
 
         while running:
             current_time = pygame.time.get_ticks()
@@ -209,127 +193,72 @@ def main():
                     if show_help:
                         show_help = False
                     elif game_over and event.key == pygame.K_r:
-                        return main()
+                        if recorder is not None:
+                            recorder.close()
+                        n.close()
+                        return main(record_dir)
                     elif event.key == pygame.K_ESCAPE:
                         running = False
 
             if game_over:
+                if recorder is not None:
+                    recorder.end(players, bullets, current_time, winner)
                 screen.fill(colors['background'])
                 draw_grid()
                 agent.draw()
                 opponent.draw()
                 draw_game_over(screen, font, winner)
                 pygame.display.flip()
+                clock.tick(30)
                 continue
 
+            # The server simulates the game; only the held keys are sent
+            action = NOTHING
             if not show_help:
                 keys = pygame.key.get_pressed()
-                if keys[pygame.K_w]:
-                    agent.move(-1)
-                if keys[pygame.K_s]:
-                    agent.move(1)
-                if keys[pygame.K_SPACE]:
-                    agent.shoot()
-
-            # Network communication
-            if current_time - last_network_time > network_delay:
-                try:
-                    pos_data = f"{int(agent.x)},{int(agent.y)}"
-                    if agent.bullets:
-                        bullet_strs = [f"{int(b.x)},{int(b.y)}" for b in agent.bullets]
-                        pos_data += "|" + "|".join(bullet_strs)
-
-                    opponent_data = n.send(pos_data)
-                    
-                    #if opponent_data is None:
-                    #    print("Server not responding - attempting to reconnect")
-                    #    if not n.connect():
-                    #        print("Reconnection failed")
-                    #        continue
-                    
-                    if opponent_data == "OPPONENT_DISCONNECTED":
-                        continue
-                        
-                    elif opponent_data == "GAME_OVER_WIN":
-                        game_over = True
-                        winner = agent.player_id
-                        
-                    elif opponent_data:
-                        parts = opponent_data.split('|')
-                        opp_data = parts[0].split(',')
-                        opp_x, opp_y, opp_alive = map(int, opp_data[:3])
-                        opponent.update_position(opp_x, opp_y)
-                        opponent.alive = bool(opp_alive)
-
-                        if not opponent.alive:
-                            game_over = True
-                            winner = agent.player_id
-                            n.send("GAME_OVER")
-                            continue
-                        
-                        # Update opponent bullets
-                        opponent.bullets.clear()
-                        if len(parts) > 1:
-                            for bullet_str in parts[1:]:
-                                if bullet_str:
-                                    bx, by = map(int, bullet_str.split(','))
-                                    opponent.bullets.append(Bullet(bx, by, opponent.dx, 0, opponent.player_id))
-                        
-                       
-                    
-                    last_network_time = current_time
-                    
-                except Exception as e:
-                    print(f"Network error: {e}")
-                    # Continue running despite network errors
-            # Update game state
-            agent.update_bullets()
-            opponent.update_bullets()
-
-            # Check collisions
-            for bullet in agent.bullets[:]:
-                if opponent.check_bullet_collision(bullet):
-                    agent.bullets.remove(bullet)
-                    if not opponent.alive:
-                        game_over = True
-                        winner = agent.player_id
-                        try:
-                            response = n.send("GAME_OVER")
-                            if response != "GAME_OVER":
-                                print(f"Failed to notify server of game over, error is in main() and check bullet collision")
-                                n.send("GAME_OVER")
-                        except:
-                            pass
-            
-            for bullet in opponent.bullets[:]:
-                if agent.check_bullet_collision(bullet):
-                    opponent.bullets.remove(bullet)
-                    if not agent.alive:
-                        game_over = True
-                        winner = opponent.player_id
-                        try:
-                            n.send("GAME_OVER")
-                        except:
-                            pass
+                action = HumanGameRecorder.action(keys[pygame.K_w], keys[pygame.K_s], keys[pygame.K_SPACE])
+            if recorder is not None and not show_help:
+                recorder.frame(players, bullets, current_time, (action,))
+            n.send_input(action)
+
+            snapshot = n.poll()
+            if snapshot is not None:
+                last_snapshot_time = current_time
+                for player, (x, y, health) in zip(players, snapshot.players):
+                    player.update(x, y, health, current_time)
+                update_bullets(bullets, snapshot, players, current_time)
+                if snapshot.winner is not None:
+                    game_over = True
+                    winner = snapshot.winner
+            elif not n.connected:
+                print("Lost connection to the server")
+                running = False
 
             # Drawing
             screen.fill(colors['background'])
             draw_grid()
             agent.draw()
             opponent.draw()
-            agent.update_bullets()
-            opponent.update_bullets()
+            draw_bullets(bullets)
 
             if show_help:
                 draw_help_box(screen, font)
+            elif current_time - last_snapshot_time > SNAPSHOT_TIMEOUT * 1000:
+                draw_waiting(screen, font)
 
             pygame.display.flip()
             clock.tick(30)
 
+        if recorder is not None:
+            # A game that was quit before it ended is recorded as cut off
+            recorder.end(players, bullets, pygame.time.get_ticks())
+            recorder.close()
+
     except Exception as e:
         print(f"Game error: {e}")
     finally:
         pygame.quit()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # python pygame_online.py [--record DIR] records the local player's games for dataset.py
+    main(sys.argv[sys.argv.index('--record') + 1] if '--record' in sys.argv else None)
\ No newline at end of file
@@ -1,141 +1,388 @@
-import socket
-from _thread import *
-import sys
-from threading import Lock
-
-server = "0.0.0.0"  # Listen on all interfaces
-port = 5555
-
-s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-try:
-    s.bind((server, port))
-except socket.error as e:
-    print(str(e))
-    sys.exit()
-
-s.listen(2)
-print("Waiting for connections, Server started")
-
-players_lock = Lock()
-players = {
-    0: {"x": 3, "y": 10, 'connected': False, 'addr': None, 'bullets': [], 'alive': True, 'health': 3},  # Player 1
-    1: {"x": 17, "y": 10, 'connected': False, 'addr': None, 'bullets': [], 'alive': True, 'health': 3}  # Player 2
-}
-
-def reset_players(player_id):
-    with players_lock:
-        players[player_id] = {
-            'x': 3 if player_id == 0 else 17,
-            'y': 10,
-            'connected': False,
-            'addr': None,
-            'bullets': [],
-            'alive': True,
-            'health': 3
-        }
-
-def find_available_slot():
-    with players_lock:
-        for player_id, player in players.items():
-            if not player['connected']:
-                player['connected'] = True
-                return player_id
-        return None
-
-
-
-def threaded_client(conn, addr, player_id):
-    try:
-        with players_lock:
-            initial_data = f"{players[player_id]['x']},{players[player_id]['y']},{player_id}"
-            players[player_id]['addr'] = addr
-        
-        conn.send(str.encode(initial_data))
-        print(f"Player {player_id} initialized from {addr}")
-        
-        while True:
-            try:
-                data = conn.recv(2048).decode().strip()
-                if not data:
-                    print(f"Player {player_id} disconnected")
-                    break
-
-                if data == "RESET":
-                    reset_players(player_id)
-                    continue
-                    #opponent_id = 1 - player_id
-                    #with players_lock:
-                    #    if players[opponent_id]['connected']:
-                    #        try:
-                    #            conn.sendall(str.encode("GAME_OVER"))
-                    #        except:
-                    #            pass
-                    #break
-
-                parts = data.split('|')
-                if not parts or not parts[0]:
-                    continue
-                
-                try:
-                    # Process position and bullets
-                    x, y = map(int, parts[0].split(','))
-                    bullet_data = [b for b in parts[1:] if b] if len(parts) > 1 else []
-
-                    with players_lock:
-                        players[player_id]['x'] = x
-                        players[player_id]['y'] = y
-                        players[player_id]['bullets'] = bullet_data
-
-                    opponent_id = 1 - player_id
-                    reply = None
-                    with players_lock:
-                        if players[opponent_id]['connected']:
-                            if not players[opponent_id]['alive']:
-                                reply = "GAME_OVER_WIN"
-                            else:
-                                reply = f"{players[opponent_id]['x']},{players[opponent_id]['y']},{int(players[opponent_id]['alive'])}"
-                                if players[opponent_id]['bullets']:
-                                    reply += '|' + '|'.join(players[opponent_id]['bullets'])
-                        else:
-                            reply = "OPPONENT_DISCONNECTED"
-
-                    if reply:
-                        try:
-                            conn.sendall(str.encode(reply))
-                        except:
-                            print(f"Failed to send to player {player_id}")
-                            break
-                            
-                except ValueError:
-                    continue
-                
-            except ConnectionResetError:
-                break
-            except Exception as e:
-                print(f"Error with player {player_id}: {e}")
-                break
-    finally:
-        print(f"Closing connection with player {player_id}")
-        with players_lock:
-            players[player_id]['connected'] = False
-            players[player_id]['addr'] = None
-        conn.close()
-
-try:
-    while True:
-        conn, addr = s.accept()
-        player_id = find_available_slot()
-        #print(f"Connected to: {addr}, assigned player {player_id}")
-        if player_id is not None:
-            print(f"Player {player_id} connected from {addr}")
-            start_new_thread(threaded_client, (conn, addr, player_id))
-        else:
-            print("No available slots, rejecting connection")
-            conn.send(str.encode("Game is full"))
-            conn.close()
-        
-except KeyboardInterrupt:
-    print("Server shutting down")
-finally:
-    s.close()
\ No newline at end of file
+"""
+Game server for pygame_online.py
+
+One asyncio event loop serves every connection, so a single process holds
+thousands of sockets without a thread (and a stack) per client, and hosts
+many rooms at once. A room is one match between two players; all state is
+only touched from the event loop, so there is no global player table and no
+lock.
+
+The server is authoritative: every room runs its own AIFightClubCore at a
+fixed tick rate. Clients only send their inputs (the action they hold),
+each tick applies the latest input of both players, and the resulting
+positions, health and bullets are broadcast to both as a snapshot. Hits and
+the winner are decided by the server alone. The time each tick takes (the
+simulation step plus building and sending the snapshots) is recorded so the
+CPU cost per room per tick can be read back with a STATS message.
+
+Connections go through a matchmaking queue: a newcomer is paired with the
+longest-waiting player and the two get a new room. Once the match is
+decided, the room is closed and both connections are closed after the final
+snapshot; a client connects again for a new match (R in pygame_online.py).
+When a player leaves mid-match, the room is closed and the opponent goes
+back into the queue (keeping its side) to be paired with the next newcomer.
+Online matches have no time limit: the core's tick limit (truncated) only
+caps training episodes, so a room runs until a player wins or leaves. Once
+max_rooms rooms are open, new connections are turned away (a FULL message)
+until one closes, and connections that stay silent for idle_timeout seconds
+are dropped.
+
+The messages are described in protocol.py.
+
+Run from the repository root:
+    python server.py [--host 0.0.0.0] [--port 5555] [--tick-rate 30] [--max-rooms 500] [--quiet]
+and measure it with loadgen.py.
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import resource
+import time
+from collections import deque
+
+import numpy as np
+
+from game.core import AIFightClubCore
+from protocol import (INPUT, NOTHING, STATS, FrameBuffer, ProtocolError, encode_full, encode_snapshot, encode_state,
+                      encode_stats, encode_welcome)
+
+HOST = "0.0.0.0"  # Listen on all interfaces
+PORT = 5555
+START_POSITIONS = {0: (3, 10), 1: (16, 10)}  # Where AIFightClubCore.reset() puts the players
+# Snapshots are skipped for a client whose unsent data exceeds this many bytes
+MAX_BUFFERED = 64 * 1024
+# Initial receive buffer per connection; clients only send small inputs
+RECEIVE_BUFFER = 256
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process in MB"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        # No /proc: fall back to the peak
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def raise_fd_limit() -> int:
+    """Raise the soft limit on open files to the hard limit and return it"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass
+    return soft
+
+
+class Player:
+    """One connection and its player's latest input"""
+
+    __slots__ = ('player_id', 'addr', 'writer', 'room', 'action', 'ack')
+
+    def __init__(self, player_id: int, addr, writer: asyncio.StreamWriter):
+        self.player_id = player_id
+        self.addr = addr
+        self.writer = writer
+        self.room = None  # None while waiting in the matchmaking queue
+        self.reset()
+
+    def reset(self):
+        self.action = NOTHING
+        self.ack = 0  # seq of the latest input
+
+    def welcome(self) -> bytes:
+        return encode_welcome(*START_POSITIONS[self.player_id], self.player_id)
+
+
+class Room:
+    """A match between two players, simulated by its own core"""
+
+    __slots__ = ('room_id', 'players', 'core', 'task')
+
+    def __init__(self, room_id: int, first: Player, second: Player, core):
+        self.room_id = room_id
+        self.players = {first.player_id: first, second.player_id: second}
+        self.core = core
+        self.task = None  # The room's tick loop
+        for player in (first, second):
+            player.reset()
+            player.room = self
+
+    def opponent(self, player: Player) -> Player:
+        return self.players[1 - player.player_id]
+
+
+class GameServer:
+    """
+    Pairs connections into rooms and simulates the rooms' matches
+
+    :param host: Address to listen on
+    :param port: TCP port to listen on
+    :param tick_rate: Ticks per second of every room
+    :param max_rooms: Rooms open at once before new connections are turned
+        away (None: no limit besides the open-file limit)
+    :param idle_timeout: Seconds without a message before a connection is
+        dropped (None: never)
+    :param backlog: Pending connections the OS queues before accept
+    :param verbose: Whether to print every connect, disconnect and room
+    """
+
+    def __init__(self, host: str = HOST, port: int = PORT, tick_rate: float = 30.0, max_rooms: int = None,
+                 idle_timeout: float = 60.0, backlog: int = 1024, verbose: int = 1):
+        self.host = host
+        self.port = port
+        self.tick_rate = tick_rate
+        self.max_rooms = max_rooms
+        self.idle_timeout = idle_timeout
+        self.backlog = backlog
+        self.verbose = verbose
+        self.rooms = {}  # room_id -> Room
+        # Players waiting for an opponent, per side, oldest first (dicts as ordered sets)
+        self.waiting = {player_id: {} for player_id in START_POSITIONS}
+        self._room_ids = itertools.count()
+        self.connections = 0
+        self.messages = 0
+        self.rooms_opened = 0
+        self.rooms_closed = 0
+        self.peak_rooms = 0
+        self.rejected = 0
+        self.ticks = 0
+        self.late_ticks = 0  # Ticks that started more than a tick late and were skipped
+        self.skipped_snapshots = 0  # Snapshots not sent to clients that fell behind
+        self.tick_time = 0.0  # Seconds spent in ticks, summed
+        self.tick_times = deque(maxlen=100_000)  # Seconds per tick, most recent ones
+        self._server = None
+
+    # ---------- matchmaking ----------
+
+    def _full(self) -> bool:
+        return self.max_rooms is not None and len(self.rooms) >= self.max_rooms
+
+    def _enqueue(self, player: Player):
+        self.waiting[player.player_id][player] = None
+        self._match()
+
+    def _match(self):
+        """Open rooms for the longest-waiting players of both sides"""
+        while self.waiting[0] and self.waiting[1] and not self._full():
+            first, second = (next(iter(self.waiting[player_id])) for player_id in START_POSITIONS)
+            del self.waiting[0][first], self.waiting[1][second]
+            room_id = next(self._room_ids)
+            core = AIFightClubCore(dt=1 / self.tick_rate, seed=room_id, observation='features',
+                                    info_mode='terminal')
+            room = Room(room_id, first, second, core)
+            self.rooms[room_id] = room
+            room.task = asyncio.get_running_loop().create_task(self._run_room(room))
+            self.rooms_opened += 1
+            self.peak_rooms = max(self.peak_rooms, len(self.rooms))
+            if self.verbose:
+                print(f"Room {room_id} opened for {first.addr} and {second.addr}")
+
+    def _join(self, addr, writer: asyncio.StreamWriter):
+        """Player for a new connection, or None if the server is full"""
+        if self._full():
+            return None
+        # Take the side that lets the newcomer play right away
+        player = Player(1 if self.waiting[0] else 0, addr, writer)
+        self._enqueue(player)
+        return player
+
+    def _leave(self, player: Player):
+        """Close the player's room and send its opponent back to the queue"""
+        room = player.room
+        if room is None:
+            self.waiting[player.player_id].pop(player, None)
+            return
+        room.task.cancel()
+        self._close_room(room)
+        opponent = room.opponent(player)
+        opponent.reset()
+        self._enqueue(opponent)
+
+    def _close_room(self, room: Room):
+        """Remove a room and detach its players from it"""
+        del self.rooms[room.room_id]
+        self.rooms_closed += 1
+        for player in room.players.values():
+            player.room = None
+        if self.verbose:
+            print(f"Room {room.room_id} closed")
+
+    # ---------- simulation ----------
+
+    async def _run_room(self, room: Room):
+        """
+        Tick the room's core at the tick rate until the match is decided, then
+        close the room and both connections
+
+        The core's truncated flag is ignored: online matches have no time limit.
+        """
+        loop = asyncio.get_running_loop()
+        period = 1 / self.tick_rate
+        core = room.core
+        players = tuple(room.players[player_id] for player_id in START_POSITIONS)
+        next_tick = loop.time()
+        while not core.done:
+            next_tick += period
+            delay = next_tick - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -period:
+                # Too far behind to catch up: drop the missed ticks instead of bursting
+                self.late_ticks += 1
+                next_tick = loop.time()
+
+            start = time.perf_counter()
+            core.advance(players[0].action, players[1].action)
+            state = encode_state(core)
+            for player in players:
+                writer = player.writer
+                if writer.transport.get_write_buffer_size() > MAX_BUFFERED:
+                    self.skipped_snapshots += 1
+                else:
+                    writer.write(encode_snapshot(core.tick, player.ack, core.winner, state))
+            elapsed = time.perf_counter() - start
+            self.ticks += 1
+            self.tick_time += elapsed
+            self.tick_times.append(elapsed)
+        if self.verbose:
+            print(f"Room {room.room_id}: player {core.winner} wins after {core.tick} ticks")
+        # The final snapshot is flushed before the connections close; ending
+        # them makes each handle_client() finish and frees the room for the queue
+        self._close_room(room)
+        for player in players:
+            player.writer.close()
+        self._match()
+
+    # ---------- messages ----------
+
+    def stats(self) -> dict:
+        tick_us = np.array(self.tick_times) * 1e6
+        return {
+            'connections': self.connections,
+            'rooms': len(self.rooms),
+            'waiting': sum(len(players) for players in self.waiting.values()),
+            'peak_rooms': self.peak_rooms,
+            'rooms_opened': self.rooms_opened,
+            'rooms_closed': self.rooms_closed,
+            'rejected': self.rejected,
+            'messages': self.messages,
+            'max_rooms': self.max_rooms,
+            'tick_rate': self.tick_rate,
+            'ticks': self.ticks,
+            'late_ticks': self.late_ticks,
+            'skipped_snapshots': self.skipped_snapshots,
+            'tick_time': self.tick_time,
+            'tick_us': {
+                'mean': float(tick_us.mean()) if tick_us.size else None,
+                'p50': float(np.percentile(tick_us, 50)) if tick_us.size else None,
+                'p99': float(np.percentile(tick_us, 99)) if tick_us.size else None,
+            },
+            'cpu_time': time.process_time(),
+            'fd_limit': resource.getrlimit(resource.RLIMIT_NOFILE)[0],
+            'rss_mb': rss_mb(),
+        }
+
+    def _handle_message(self, player: Player, message_type: int, value):
+        """Apply a client message and return the reply to send, if any"""
+        if message_type == INPUT:
+            player.ack, player.action = value
+        elif message_type == STATS:
+            return encode_stats(self.stats())
+        return None
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        addr = writer.get_extra_info('peername')
+        player = self._join(addr, writer)
+        if player is None:
+            self.rejected += 1
+            if self.verbose:
+                print(f"No rooms available, rejecting {addr}")
+            writer.write(encode_full())
+            await self._close(writer)
+            return
+        self.connections += 1
+        if self.verbose:
+            print(f"Player {player.player_id} connected from {addr}")
+        try:
+            writer.write(player.welcome())
+            await writer.drain()
+            frames = FrameBuffer(RECEIVE_BUFFER)
+            while True:
+                data = await asyncio.wait_for(reader.read(4096), self.idle_timeout)
+                if not data:
+                    break
+                frames.feed(data)
+                for message_type, value in frames.messages():
+                    self.messages += 1
+                    reply = self._handle_message(player, message_type, value)
+                    if reply is not None:
+                        writer.write(reply)
+                await writer.drain()
+        except asyncio.TimeoutError:
+            if self.verbose:
+                print(f"Player {player.player_id} from {addr} timed out")
+        except (ConnectionError, ProtocolError) as e:
+            if self.verbose:
+                print(f"Error with player {player.player_id} from {addr}: {e}")
+        finally:
+            self.connections -= 1
+            self._leave(player)
+            if self.verbose:
+                print(f"Closing connection with player {player.player_id} from {addr}")
+            await self._close(writer)
+
+    @staticmethod
+    async def _close(writer: asyncio.StreamWriter):
+        """Close a connection and wait until its transport has flushed and closed"""
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass  # The peer is gone already
+
+    # ---------- serving ----------
+
+    async def start(self):
+        self._server = await asyncio.start_server(self.handle_client, self.host, self.port,
+                                                  backlog=self.backlog)
+        if self.verbose:
+            print(f"Waiting for connections, server started on {self.host}:{self.port}")
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+
+
+# ==================== MAIN EXECUTION ====================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--tick-rate', type=float, default=30.0, help='ticks per second of every room')
+    parser.add_argument('--max-rooms', type=int, help='default: as many as open files allow')
+    parser.add_argument('--idle-timeout', type=float, default=60.0, help='seconds (0 = never)')
+    parser.add_argument('--backlog', type=int, default=1024)
+    parser.add_argument('--quiet', action='store_true', help="don't print every connection")
+    args = parser.parse_args()
+
+    fd_limit = raise_fd_limit()
+    print(f"Open-file limit {fd_limit}: at most about {fd_limit // 2} rooms")
+    server = GameServer(args.host, args.port, args.tick_rate, args.max_rooms, args.idle_timeout or None,
+                        args.backlog, verbose=0 if args.quiet else 1)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        print("Server shutting down")
@@ -0,0 +1,92 @@
+"""Equivalence checks between the game cores' implementations and options"""
+
+import numpy as np
+import pytest
+
+from game.core import DEFAULT_DT, AIFightClubCore, BatchedAIFightClubCore
+
+
+def _actions(seed: int, steps: int, n: int = None):
+    size = steps if n is None else (steps, n)
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 4, size=size), rng.integers(0, 4, size=size)
+
+
+@pytest.mark.parametrize('observation', ['grid', 'features'])
+@pytest.mark.parametrize('frame_skip', [1, 3])
+def test_batched_core_matches_scalar_cores(observation, frame_skip):
+    # Long enough for every match to end, by the latest at the tick limit
+    n, steps = 8, 1010 // frame_skip + 1
+    batched = BatchedAIFightClubCore(n, dt=DEFAULT_DT, autoreset=False, observation=observation,
+                                     frame_skip=frame_skip)
+    cores = [AIFightClubCore(dt=DEFAULT_DT, observation=observation, frame_skip=frame_skip)
+             for _ in range(n)]
+    actions, opponent_actions = _actions(0, steps, n)
+    running = np.ones(n, dtype=bool)
+    for t in range(steps):
+        observations, rewards, terminated, truncated, _ = batched.step(actions[t], opponent_actions[t])
+        for i in np.flatnonzero(running):
+            expected = cores[i].step(int(actions[t, i]), int(opponent_actions[t, i]))
+            np.testing.assert_array_equal(observations[i], expected[0])
+            assert rewards[i] == pytest.approx(expected[1])
+            assert (terminated[i], truncated[i]) == (expected[2], expected[3])
+            running[i] = not (expected[2] or expected[3])
+        if not running.any():
+            break
+    assert not running.any()
+
+
+@pytest.mark.parametrize('observation', ['grid', 'features'])
+def test_opponent_view_matches_scalar_core(observation):
+    n, steps = 4, 300
+    batched = BatchedAIFightClubCore(n, dt=DEFAULT_DT, autoreset=False, observation=observation,
+                                     opponent_view=True)
+    cores = [AIFightClubCore(dt=DEFAULT_DT, observation=observation) for _ in range(n)]
+    actions, opponent_actions = _actions(1, steps, n)
+    for t in range(steps):
+        _, _, terminated, truncated, _ = batched.step(actions[t], opponent_actions[t])
+        for i, core in enumerate(cores):
+            if not core.done:
+                core.step(int(actions[t, i]), int(opponent_actions[t, i]))
+                np.testing.assert_array_equal(batched.opponent_observations[i],
+                                              core.get_opponent_observation())
+        if (terminated | truncated).all():
+            break
+
+
+def test_incremental_observation_matches_full():
+    full = AIFightClubCore(dt=DEFAULT_DT, seed=2)
+    incremental = AIFightClubCore(dt=DEFAULT_DT, seed=2, incremental_obs=True)
+    np.testing.assert_array_equal(incremental.reset(), full.reset())
+    actions, _ = _actions(2, 3000)
+    matches = 0
+    for action in actions:
+        expected, _, terminated, truncated, _ = full.step(int(action))
+        observation, *_ = incremental.step(int(action))
+        np.testing.assert_array_equal(observation, expected)
+        if terminated or truncated:
+            matches += 1
+            np.testing.assert_array_equal(incremental.reset(), full.reset())
+    assert matches > 1
+
+
+@pytest.mark.parametrize('observation', ['grid', 'features'])
+def test_frame_skip_repeats_the_actions(observation):
+    frame_skip = 4
+    skipping = AIFightClubCore(dt=DEFAULT_DT, observation=observation, frame_skip=frame_skip)
+    single = AIFightClubCore(dt=DEFAULT_DT, observation=observation)
+    actions, opponent_actions = _actions(3, 400)
+    for action, opponent_action in zip(actions.tolist(), opponent_actions.tolist()):
+        observation, reward, terminated, truncated, _ = skipping.step(action, opponent_action)
+        total = 0.0
+        for _ in range(frame_skip):
+            expected, tick_reward, tick_terminated, tick_truncated, _ = single.step(action, opponent_action)
+            total += tick_reward
+            if tick_terminated or tick_truncated:
+                break
+        np.testing.assert_array_equal(observation, expected)
+        assert reward == pytest.approx(total)
+        assert (terminated, truncated) == (tick_terminated, tick_truncated)
+        if terminated or truncated:
+            return
+    pytest.fail("No match ended")
@@ -0,0 +1,109 @@
+"""Encoding and decoding of the wire protocol's frames"""
+
+import socket
+import struct
+
+import numpy as np
+import pytest
+
+from game.core import DEFAULT_DT, AIFightClubCore
+from protocol import (FULL, INPUT, SNAPSHOT, STATS, VERSION, WELCOME, FrameBuffer, ProtocolError, Snapshot,
+                      encode_full, encode_input, encode_snapshot, encode_state, encode_stats, encode_welcome)
+
+
+def _core_with_bullets() -> AIFightClubCore:
+    core = AIFightClubCore(dt=DEFAULT_DT, seed=0)
+    for _ in range(20):
+        core.step(2, 2)  # Both shoot whenever their cooldown allows
+    assert len(core.bullets) > 0
+    return core
+
+
+def _messages(frames: bytes, size: int = 65536) -> list:
+    buffer = FrameBuffer(size)
+    buffer.feed(frames)
+    return buffer.messages()
+
+
+def test_every_message_type_round_trips():
+    core = _core_with_bullets()
+    frames = (encode_welcome(3, 10, 1) + encode_full() + encode_input(70000, 2)
+              + encode_snapshot(12, 70000, None, encode_state(core)) + encode_snapshot(13, 4, 0, encode_state(core))
+              + encode_stats() + encode_stats({'rooms': 2, 'rss_mb': 39.5}))
+    messages = _messages(frames)
+    assert [message_type for message_type, _ in messages] == [
+        WELCOME, FULL, INPUT, SNAPSHOT, SNAPSHOT, STATS, STATS]
+    assert messages[0][1] == (3, 10, 1)
+    assert messages[1][1] is None
+    assert messages[2][1] == (70000, 2)
+    assert messages[3][1].winner is None and messages[4][1].winner == 0
+    assert messages[5][1] is None
+    assert messages[6][1] == {'rooms': 2, 'rss_mb': 39.5}
+
+
+def test_snapshot_carries_the_core_state():
+    core = _core_with_bullets()
+    (message_type, snapshot), = _messages(encode_snapshot(7, 3, None, encode_state(core)))
+    assert message_type == SNAPSHOT
+    assert isinstance(snapshot, Snapshot)
+    assert (snapshot.tick, snapshot.ack) == (7, 3)
+    assert snapshot.players == tuple((agent['x'], agent['y'], agent['health'])
+                                     for agent in (core.agent, core.opponent))
+    expected = core.bullets.items()
+    assert len(snapshot.bullets) == len(expected)
+    for (x, y, owner), (ex, ey, eowner) in zip(snapshot.bullets, expected):
+        assert (x, y, owner) == (np.float32(ex), np.float32(ey), eowner)
+
+
+def test_partial_frames_are_kept_until_complete():
+    core = _core_with_bullets()
+    frames = b''.join(encode_input(seq, seq % 4) + encode_snapshot(seq, seq, None, encode_state(core))
+                      for seq in range(50))
+    expected = _messages(frames)
+    rng = np.random.default_rng(0)
+    cuts = np.sort(rng.choice(np.arange(1, len(frames)), size=200, replace=False))
+    buffer = FrameBuffer(64)  # Smaller than a snapshot, so the buffer has to grow
+    received = []
+    for chunk in np.split(np.frombuffer(frames, dtype=np.uint8), cuts):
+        buffer.feed(chunk.tobytes())
+        received.extend(buffer.messages())
+    assert received == expected
+    assert len(buffer) == 0
+
+
+def test_byte_by_byte_input():
+    frame = encode_input(1, 3)
+    buffer = FrameBuffer(8)
+    for i in range(len(frame) - 1):
+        buffer.feed(frame[i:i + 1])
+        assert buffer.messages() == []
+    buffer.feed(frame[-1:])
+    assert buffer.messages() == [(INPUT, (1, 3))]
+
+
+def test_recv_into_reads_from_a_socket():
+    left, right = socket.socketpair()
+    with left, right:
+        left.sendall(encode_welcome(16, 10, 0) + encode_input(5, 1))
+        buffer = FrameBuffer()
+        assert buffer.recv_into(right) > 0
+        assert buffer.messages() == [(WELCOME, (16, 10, 0)), (INPUT, (5, 1))]
+        left.close()
+        assert buffer.recv_into(right) == 0
+
+
+def _snapshot_missing_a_bullet() -> bytes:
+    state = encode_state(_core_with_bullets())
+    return encode_snapshot(1, 1, None, state[:-struct.calcsize('<ffB')])
+
+
+@pytest.mark.parametrize('frame', [
+    struct.pack('<HBB', 2, VERSION + 1, FULL),  # Other protocol version
+    struct.pack('<HBB', 2, VERSION, 99),  # Unknown message type
+    struct.pack('<HBB', 1, VERSION, FULL),  # Length shorter than the header
+    encode_input(1, 7),  # Unknown action
+    _snapshot_missing_a_bullet(),  # Fewer bullets than its count
+])
+def test_malformed_frames_raise(frame):
+    with pytest.raises(ProtocolError):
+        _messages(frame)
@@ -0,0 +1,88 @@
+"""Round trips through the replay file format"""
+
+import os
+import struct
+
+import numpy as np
+import pytest
+
+from game.core import DEFAULT_DT, AIFightClubCore
+from game.replay import SCRIPTED, ReplayReader, ReplayRecorder, ReplayWriter, core_settings
+
+
+def _record(path, episodes: int, seed: int = 0, **writer_kwargs) -> list:
+    """Record episodes of random play and return each one's observations as played"""
+    core = AIFightClubCore(dt=DEFAULT_DT, seed=seed)
+    rng = np.random.default_rng(seed)
+    played = []
+    with ReplayWriter(path, core_settings(core), **writer_kwargs) as writer:
+        recorder = ReplayRecorder(core, writer)
+        for episode in range(episodes):
+            observations = [recorder.reset(seed=seed + episode).copy()]
+            # Odd episodes give the opponent's actions, even ones leave it scripted
+            scripted = episode % 2 == 0
+            while True:
+                opponent_action = None if scripted else int(rng.integers(4))
+                observation, _, terminated, truncated, _ = recorder.step(int(rng.integers(4)), opponent_action)
+                observations.append(observation.copy())
+                if terminated or truncated:
+                    break
+            played.append(np.array(observations))
+    return played
+
+
+def test_replay_round_trip(tmp_path):
+    path = tmp_path / 'games.afcr'
+    # Small chunks, so the episodes are spread over several of them
+    played = _record(path, 4, chunk_steps=500)
+    with ReplayReader(path) as reader:
+        assert len(reader) == 4
+        np.testing.assert_array_equal(reader.episodes['steps'], [len(obs) - 1 for obs in played])
+        for episode, observations in enumerate(played):
+            np.testing.assert_array_equal(reader.observations(episode), observations)
+
+
+def test_replay_in_another_observation_encoding(tmp_path):
+    path = tmp_path / 'games.afcr'
+    _record(path, 1, seed=5)
+    with ReplayReader(path) as reader:
+        records = reader.steps(0)
+        observations = reader.observations(0, reader.make_core(observation='features'))
+
+    core = AIFightClubCore(dt=DEFAULT_DT, observation='features')
+    expected = [core.reset(seed=5).copy()]
+    for record in records:
+        opponent_action = None if record['opponent_action'] == SCRIPTED else int(record['opponent_action'])
+        expected.append(core.step(int(record['agent_action']), opponent_action)[0].copy())
+    np.testing.assert_array_equal(observations, expected)
+
+
+def test_unclosed_file_is_read_by_scanning_chunks(tmp_path):
+    path = tmp_path / 'games.afcr'
+    played = _record(path, 3, chunk_steps=1)
+    # Cut the footer off, as if the writer had never been closed
+    with open(path, 'r+b') as f:
+        f.seek(-16, os.SEEK_END)
+        footer, _ = struct.unpack('<Q8s', f.read(16))
+        f.truncate(footer)
+    with ReplayReader(path) as reader:
+        assert len(reader) == 3
+        np.testing.assert_array_equal(reader.observations(2), played[2])
+
+
+def test_writer_appends_to_an_existing_file(tmp_path):
+    path = tmp_path / 'games.afcr'
+    first = _record(path, 2, seed=0)
+    second = _record(path, 2, seed=10)
+    with ReplayReader(path) as reader:
+        np.testing.assert_array_equal(reader.episodes['seed'], [0, 1, 10, 11])
+        np.testing.assert_array_equal(reader.observations(1), first[1])
+        np.testing.assert_array_equal(reader.observations(3), second[1])
+
+
+def test_writer_rejects_other_settings(tmp_path):
+    path = tmp_path / 'games.afcr'
+    _record(path, 1)
+    settings = core_settings(AIFightClubCore(dt=DEFAULT_DT, frame_skip=2))
+    with pytest.raises(ValueError):
+        ReplayWriter(path, settings)